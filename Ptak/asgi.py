@@ -0,0 +1,546 @@
+"""
+Asynchroniczny tryb serwera (ASGI) - wymaga: pip install uvicorn
+
+    python asgi.py [--port 5001] [--no-ssl] [--workers N]     (domyslnie HTTPS na porcie 5001, jak server.py)
+
+Stream ingest (POST /api/stream/... or WebSocket .../ws) and MJPEG fan-out (GET .../mjpeg) run directly
+on one asyncio event loop, so an open viewer costs a coroutine instead of an OS thread.
+Slow viewers are not buffered: while a send is blocked on the socket, newer frames
+replace older ones and the viewer gets the latest frame when it catches up.
+Live state events (GET /api/ptak/events, /api/snake/events) are served the same way,
+and so are the files under /static/ (see server.StaticAssets) and /uploads/, with byte ranges.
+All of these also exist per station under /api/s/<station>/... (see server.Station).
+Every other route is the unchanged Flask app, run on a thread pool.
+With --workers N the app runs in N processes that share the live state through this
+(supervisor) process, see shared_state.py.
+"""
+import argparse
+import asyncio
+import io
+import json
+import mimetypes
+import os
+import sys
+import tempfile
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.http import parse_accept_header, parse_etags, parse_range_header
+from werkzeug.security import safe_join
+import server
+import shared_state
+
+MAX_FRAME_SIZE = 4 * 1024 * 1024 # Bytes, larger uploads are rejected
+KEEPALIVE = 1.0 # Seconds without a new frame before the last one is resent
+WSGI_THREADS = 32 # Pool for the Flask routes (long-polls hold a thread while waiting)
+HUB_ENV = 'PTAK_STATE_HUB' # Set for the worker processes: address of the state hub
+HUB_KEY_ENV = 'PTAK_STATE_HUB_KEY'
+FILE_CHUNK = 256 * 1024 # Bytes read per step when the server has no zero-copy send
+BUFFERED_BODY_MAX = 1024 * 1024 # Bytes; bigger (or chunked) request bodies are streamed to Flask
+
+INGEST_PATHS = {
+    '/api/stream/snake': 'snake',
+    '/api/stream/ptak': 'ptak',
+    '/api/stream/ptak/camera': 'ptak_camera'
+}
+MJPEG_PATHS = {path + '/mjpeg': name for path, name in INGEST_PATHS.items()}
+WS_PATHS = {path + '/ws': name for path, name in INGEST_PATHS.items()}
+EVENT_PATHS = {f"/api/{name}/events": name for name in ("snake", "ptak")}
+STATION_PREFIX = '/api/s/'
+STATIC_PATHS = {'/static/js/': 'js/', '/static/css/': 'css/'}
+UPLOADS_PREFIX = '/uploads/'
+
+wsgi_executor = ThreadPoolExecutor(max_workers=WSGI_THREADS, thread_name_prefix='wsgi')
+
+
+class AsyncFanout:
+    """Wakes the asyncio viewers of one FrameBroadcaster (or LiveDocument), whichever thread published"""
+
+    def __init__(self, broadcaster, loop):
+        self.broadcaster = broadcaster
+        self.loop = loop
+        self.waiters = set() # One asyncio.Event per viewer
+        broadcaster.listeners.append(self._on_publish)
+
+    def _on_publish(self):
+        self.loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        for event in self.waiters:
+            event.set()
+
+fanouts = {} # FrameBroadcaster / LiveDocument -> AsyncFanout, created on first use
+loop = None
+
+
+def fanout(broadcaster):
+    if broadcaster not in fanouts:
+        fanouts[broadcaster] = AsyncFanout(broadcaster, loop)
+    return fanouts[broadcaster]
+
+
+def drop_station_fanouts(station):
+    # Registered as a server.stations.on_remove callback
+    for broadcaster in list(station.streams.values()) + list(station.live_documents.values()):
+        fanouts.pop(broadcaster, None)
+
+
+def split_station(path):
+    """(station name, path without the /api/s/<station> prefix); the name is None for plain /api/... paths"""
+    if not path.startswith(STATION_PREFIX):
+        return None, path
+    name, _, rest = path[len(STATION_PREFIX):].partition('/')
+    return name, '/api/' + rest
+
+
+async def get_station(name):
+    # None for an invalid name or when every station is busy; Flask then answers with the error
+    if name is None:
+        return server.default_station
+    if not server.STATION_NAME.match(name):
+        return None
+    if server.shared.primary:
+        return server.shared.open_station(name)
+    # A worker asks the hub (blocking), which creates and evicts the stations of every process
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(wsgi_executor, server.shared.open_station, name)
+
+
+async def read_body(receive, limit=None):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if limit is not None and len(body) > limit:
+            return None
+        if not message.get('more_body', False):
+            return bytes(body)
+
+
+async def send_simple(send, status, body, headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'text/plain'), (b'content-length', str(len(body)).encode())] + list(headers)
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def ingest(station, name, receive, send):
+    data = await read_body(receive, MAX_FRAME_SIZE)
+    if data is None:
+        return await send_simple(send, 413, b"Frame too large")
+    if not data:
+        return await send_simple(send, 400, b"No data")
+
+    server.ingest_frame(station, name, data) # Never blocks: the recorder only queues the frame
+    viewers = str(station.streams[name].viewers).encode()
+    await send_simple(send, 200, b"OK", [(b'x-stream-viewers', viewers)])
+
+
+async def ingest_ws(station, name, receive, send):
+    # Persistent binary ingest: every message is [u32 seq][f64 timestamp ms][JPEG]
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    await send({'type': 'websocket.accept'})
+    broadcaster = station.streams[name]
+    viewers = None
+    while True:
+        message = await receive()
+        if message['type'] == 'websocket.disconnect':
+            break
+        data = message.get('bytes')
+        if data:
+            server.ingest_ws_message(station, name, data)
+        if broadcaster.viewers != viewers:
+            viewers = broadcaster.viewers
+            await send({'type': 'websocket.send', 'text': json.dumps({'viewers': viewers})})
+
+
+async def serve_mjpeg(station, name, receive, send):
+    broadcaster = station.streams[name]
+    waiters = fanout(broadcaster).waiters
+    event = asyncio.Event()
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+        event.set()
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'multipart/x-mixed-replace; boundary=frame'), (b'cache-control', b'no-cache')]
+    })
+
+    waiters.add(event)
+    with broadcaster.cond:
+        broadcaster.local_viewers += 1
+    watcher = asyncio.ensure_future(watch_disconnect())
+    try:
+        seq = -1
+        while not disconnected.is_set():
+            if broadcaster.seq == seq:
+                event.clear()
+                if broadcaster.seq == seq: # Re-check after clear so a publish in between isn't lost
+                    try:
+                        await asyncio.wait_for(event.wait(), KEEPALIVE)
+                    except asyncio.TimeoutError:
+                        pass # Resend the last frame as a keepalive
+            if disconnected.is_set():
+                break
+            with broadcaster.cond:
+                seq, chunk = broadcaster.seq, broadcaster.chunk
+            if chunk:
+                # Blocks while the client's socket is full; frames published meanwhile are skipped
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    except OSError:
+        pass # Client went away mid-send
+    finally:
+        waiters.discard(event)
+        with broadcaster.cond:
+            broadcaster.local_viewers -= 1
+        watcher.cancel()
+
+
+async def serve_events(station, name, scope, receive, send):
+    # Native version of server.state_events: one coroutine per subscriber instead of a pool thread
+    document = station.live_documents[name]
+    waiters = fanout(document).waiters
+    event = asyncio.Event()
+    disconnected = asyncio.Event()
+    query = urllib.parse.parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    headers = dict(scope['headers'])
+    last_id = headers.get(b'last-event-id', b'').decode('latin-1') or query.get('last_event_id', [None])[0]
+    last_version, interval = server.events_params(last_id, query.get('max_rate', [None])[0])
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+        event.set()
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no')]
+    })
+
+    waiters.add(event)
+    with document.cond:
+        document.local_subscribers += 1
+    watcher = asyncio.ensure_future(watch_disconnect())
+    try:
+        await send({'type': 'http.response.body', 'body': f"retry: {server.EVENTS_RETRY_MS}\n\n".encode(), 'more_body': True})
+        version = -1 if last_version is None else last_version
+        sent_at = 0.0
+        while not disconnected.is_set():
+            delay = sent_at + interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay) # Changes in the meantime are coalesced into the next event
+            if document.version == version:
+                event.clear()
+                if document.version == version:
+                    try:
+                        await asyncio.wait_for(event.wait(), server.EVENTS_KEEPALIVE)
+                    except asyncio.TimeoutError:
+                        await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+                        continue
+            if disconnected.is_set():
+                break
+            version, chunk = document.event()
+            sent_at = time.monotonic()
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    except OSError:
+        pass
+    finally:
+        waiters.discard(event)
+        with document.cond:
+            document.local_subscribers -= 1
+        watcher.cancel()
+
+
+def request_headers(scope):
+    return {name.decode('latin-1'): value.decode('latin-1') for name, value in scope['headers']}
+
+
+async def send_file_range(scope, receive, send, path, etag, response_headers):
+    """
+    A file with ETag revalidation (304) and single byte ranges (206, what video players ask for
+    when seeking). Read in FILE_CHUNK steps off the loop, and only until the client goes away:
+    a player drops the open-ended range it was reading when the user seeks again.
+    """
+    headers = request_headers(scope)
+    loop = asyncio.get_running_loop()
+    response_headers = response_headers + [(b'etag', f'"{etag}"'.encode()), (b'accept-ranges', b'bytes')]
+    if parse_etags(headers.get('if-none-match')).contains(etag):
+        await send({'type': 'http.response.start', 'status': 304, 'headers': response_headers})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    with await loop.run_in_executor(wsgi_executor, open, path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        status, start, length = 200, 0, size
+        byte_range = parse_range_header(headers.get('range'))
+        if byte_range and headers.get('if-range', f'"{etag}"') == f'"{etag}"': # Changed since: the whole file
+            span = byte_range.range_for_length(size)
+            if span is not None:
+                status, start, length = 206, span[0], span[1] - span[0]
+                response_headers.append((b'content-range', f"bytes {span[0]}-{span[1] - 1}/{size}".encode()))
+            elif len(byte_range.ranges) == 1:
+                return await send_simple(send, 416, b"Range not satisfiable", [(b'content-range', f"bytes */{size}".encode())])
+            # Several ranges: the whole file
+        response_headers.append((b'content-length', str(length).encode()))
+        await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+        if scope['method'] == 'HEAD' or not length:
+            return await send({'type': 'http.response.body', 'body': b''})
+        if 'http.response.zerocopysend' in scope.get('extensions', {}):
+            return await send({'type': 'http.response.zerocopysend', 'file': f, 'offset': start, 'count': length})
+
+        # uvicorn has no zero-copy send: big reads off the loop, written as they come
+        disconnected = asyncio.Event()
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            f.seek(start)
+            while length > 0 and not disconnected.is_set():
+                chunk = await loop.run_in_executor(wsgi_executor, f.read, min(FILE_CHUNK, length))
+                if not chunk:
+                    break # Truncated meanwhile
+                length -= len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        except OSError:
+            pass # Client went away mid-send
+        finally:
+            watcher.cancel()
+
+
+async def serve_static(scope, receive, send):
+    # False for unknown files: Flask answers those
+    headers = request_headers(scope)
+    prefix = next(p for p in STATIC_PATHS if scope['path'].startswith(p))
+    name = STATIC_PATHS[prefix] + scope['path'][len(prefix):]
+    loop = asyncio.get_running_loop()
+    asset, immutable = await loop.run_in_executor(wsgi_executor, server.static_assets.find, name)
+    if asset is None:
+        return False
+    path, etag, extra = server.static_assets.select(asset, parse_accept_header(headers.get('accept-encoding')), immutable)
+    content_type = asset.mimetype + ('; charset=utf-8' if asset.mimetype.startswith('text/') else '')
+    response_headers = [(b'content-type', content_type.encode())]
+    response_headers += [(k.lower().encode(), v.encode()) for k, v in extra.items()]
+    await send_file_range(scope, receive, send, path, etag, response_headers)
+    return True
+
+
+async def serve_upload(scope, receive, send):
+    # Recordings and images under /uploads/; False for missing files (Flask answers those)
+    path = safe_join(server.UPLOAD_FOLDER, scope['path'][len(UPLOADS_PREFIX):])
+    try:
+        stat = os.stat(path) if path else None
+    except OSError:
+        stat = None
+    if stat is None or not os.path.isfile(path):
+        return False
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    response_headers = [(b'content-type', content_type.encode()), (b'cache-control', b'no-cache')]
+    await send_file_range(scope, receive, send, path, f"{stat.st_mtime_ns:x}-{stat.st_size:x}", response_headers)
+    return True
+
+
+def start_primary():
+    # Everything that runs once per server, in the process that owns the recorders
+    server.init_db()
+    server.media_jobs.start()
+    server.telemetry.start()
+    server.media_catalogue.start()
+    server.static_assets.start()
+    server.default_station.recorder.prewarm()
+
+
+class ReceiveStream(io.RawIOBase):
+    """wsgi.input that pulls the request body from the event loop as the Flask thread reads it"""
+
+    def __init__(self, receive, loop):
+        self.receive = receive
+        self.loop = loop
+        self.pending = memoryview(b'')
+        self.done = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending and not self.done:
+            message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+            if message['type'] == 'http.disconnect':
+                self.done = True # Reads return b'', werkzeug raises ClientDisconnected before Content-Length
+            else:
+                self.pending = memoryview(message.get('body', b''))
+                self.done = not message.get('more_body', False)
+        n = min(len(buffer), len(self.pending))
+        buffer[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+
+
+def build_environ(scope, body, length):
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'SERVER_NAME': (scope.get('server') or ('localhost', 0))[0],
+        'SERVER_PORT': str((scope.get('server') or ('localhost', 0))[1]),
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': length is None, # Chunked: read until the end
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }
+    if length is not None:
+        environ['CONTENT_LENGTH'] = str(length)
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = 'HTTP_' + name
+            environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+async def call_flask(scope, receive, send):
+    loop = asyncio.get_running_loop()
+    headers = request_headers(scope)
+    length = int(headers['content-length']) if headers.get('content-length', '').isdigit() else None
+    if length is None and 'chunked' in headers.get('transfer-encoding', '') or (length or 0) > BUFFERED_BODY_MAX:
+        # Video uploads: streamed to the handler instead of held in memory whole
+        environ = build_environ(scope, ReceiveStream(receive, loop), length)
+    else:
+        body = await read_body(receive)
+        if body is None:
+            return
+        environ = build_environ(scope, io.BytesIO(body), len(body))
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+    # The response body is pulled chunk by chunk on the pool, so big files are not read into memory
+    result = await loop.run_in_executor(wsgi_executor, server.app, environ, start_response)
+    chunks = iter(result)
+    try:
+        chunk = await loop.run_in_executor(wsgi_executor, next, chunks, None)
+        await send({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+        while chunk is not None:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            chunk = await loop.run_in_executor(wsgi_executor, next, chunks, None)
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(result, 'close'):
+            await loop.run_in_executor(wsgi_executor, result.close)
+
+
+async def app(scope, receive, send):
+    global loop
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                loop = asyncio.get_running_loop()
+                server.stations.on_remove.append(drop_station_fanouts)
+                if HUB_ENV in os.environ:
+                    # Worker of --workers N: the supervisor has the database setup, jobs and recorders
+                    server.shared = shared_state.HubClient(os.environ[HUB_ENV], bytes.fromhex(os.environ[HUB_KEY_ENV]))
+                else:
+                    start_primary()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                wsgi_executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] == 'websocket':
+        name, path = split_station(scope['path'])
+        station = await get_station(name) if path in WS_PATHS else None
+        if station is not None:
+            return await ingest_ws(station, WS_PATHS[path], receive, send)
+        await receive()
+        return await send({'type': 'websocket.close', 'code': 1008})
+
+    if scope['type'] != 'http':
+        return
+
+    if scope['method'] in ('GET', 'HEAD'):
+        if scope['path'].startswith(tuple(STATIC_PATHS)) and await serve_static(scope, receive, send):
+            return
+        if scope['path'].startswith(UPLOADS_PREFIX) and await serve_upload(scope, receive, send):
+            return
+
+    name, path = split_station(scope['path'])
+    native = (scope['method'] == 'POST' and path in INGEST_PATHS
+              or scope['method'] == 'GET' and (path in MJPEG_PATHS or path in EVENT_PATHS))
+    station = await get_station(name) if native else None
+    if station is None:
+        return await call_flask(scope, receive, send)
+    if path in INGEST_PATHS:
+        return await ingest(station, INGEST_PATHS[path], receive, send)
+    if path in MJPEG_PATHS:
+        return await serve_mjpeg(station, MJPEG_PATHS[path], receive, send)
+    return await serve_events(station, EVENT_PATHS[path], scope, receive, send)
+
+
+def adhoc_certificate():
+    # Same self-signed setup as ssl_context='adhoc' in server.py (wymaga pyopenssl/cryptography)
+    from werkzeug.serving import make_ssl_devcert
+    return make_ssl_devcert(os.path.join(tempfile.gettempdir(), 'ptak_adhoc'), host='localhost')
+
+
+if __name__ == '__main__':
+    import uvicorn
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    parser = argparse.ArgumentParser(description="Ptak server, asyncio (ASGI) mode")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--no-ssl', action='store_true')
+    parser.add_argument('--workers', type=int, default=1, help="server processes (the live state is shared, see shared_state.py)")
+    args = parser.parse_args()
+
+    print("===============================================================")
+    print(" SERWER GRY URUCHOMIONY (ASGI, %s)" % ("HTTP" if args.no_ssl else "HTTPS"))
+    print(" Gra dostepna pod adresem: %s://192.168.0.110:%d" % ("http" if args.no_ssl else "https", args.port))
+    print("===============================================================")
+    kwargs = {}
+    if not args.no_ssl:
+        cert, key = adhoc_certificate()
+        kwargs = {'ssl_certfile': cert, 'ssl_keyfile': key}
+    if args.workers > 1:
+        # This process is the state hub; the workers import asgi:app and connect to it on startup
+        hub = shared_state.StateHub(shared_state.hub_address(), os.urandom(16))
+        server.shared = hub
+        start_primary()
+        hub.start()
+        os.environ.update({HUB_ENV: hub.address, HUB_KEY_ENV: hub.authkey.hex(), 'PTAK_BOOT_ID': server.BOOT_ID})
+        uvicorn.run('asgi:app', workers=args.workers, host=args.host, port=args.port, lifespan='on',
+                    log_level='warning', **kwargs)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port, lifespan='on', log_level='warning', **kwargs)
@@ -0,0 +1,1051 @@
+"""
+Testy obciazeniowe serwera Ptak (uruchamiane recznie przeciwko dzialajacemu serwerowi).
+
+    python bench.py viewers --url https://127.0.0.1:5001 --pid <server pid> --viewers 10,50,100,200
+    python bench.py ingest --url https://127.0.0.1:5001 --pid <server pid>
+    python bench.py db --readers 8 --rows 100000
+    python bench.py leaderboard --rows 1000000
+    python bench.py poll --url https://127.0.0.1:5001 --pid <server pid>
+    python bench.py events --url https://127.0.0.1:5001 --pid <server pid> --clients 20
+    python bench.py landmarks --url https://127.0.0.1:5001 --pid <server pid>
+    python bench.py telemetry --games 20 --seconds 60
+    python bench.py stations --url https://127.0.0.1:5001 --pid <server pid> --kiosks 1,5,20
+    python bench.py workers --workers 1,2,4,8     (starts asgi.py itself, on --port 5099)
+    python bench.py assets --url https://127.0.0.1:5001
+    python bench.py media --url https://127.0.0.1:5001 --pid <server pid> --uploads 8 --size-mb 50
+    python bench.py catalogue --files 1000,10000,100000
+
+Only the standard library is used, so the load generator has no extra dependencies
+(`db`, `leaderboard`, `telemetry` and `catalogue` run in-process and import server.py).
+"""
+import argparse
+import asyncio
+import base64
+import gzip
+import json
+import multiprocessing
+import os
+import random
+import re
+import signal
+import sqlite3
+import ssl
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def cpu_seconds(pid):
+    # utime + stime of a process from /proc (Linux)
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def process_tree(pid):
+    # pid and all its descendants, e.g. the uvicorn supervisor and its workers (Linux /proc)
+    pids = [pid]
+    for parent in pids: # Grows while iterating
+        try:
+            for task in os.listdir(f"/proc/{parent}/task"):
+                with open(f"/proc/{parent}/task/{task}/children") as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def tree_cpu_seconds(pid):
+    total = 0.0
+    for p in process_tree(pid):
+        try:
+            total += cpu_seconds(p)
+        except OSError:
+            pass # Exited meanwhile
+    return total
+
+
+def rss_mb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+class Target:
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.ssl = None
+        if parts.scheme == 'https':
+            # Self-signed adhoc certificate, like the kiosks
+            self.ssl = ssl.create_default_context()
+            self.ssl.check_hostname = False
+            self.ssl.verify_mode = ssl.CERT_NONE
+        self.bytes_read = 0 # Response bytes (status line, headers, body) over all requests
+
+    async def open(self):
+        return await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+
+    async def request(self, method, path, body=b'', headers=None, conn=None):
+        """Minimal HTTP/1.1 keep-alive request; returns (status, headers, body, conn)"""
+        reader, writer = conn or await self.open()
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(body)}\r\n"
+        for k, v in (headers or {}).items():
+            head += f"{k}: {v}\r\n"
+        writer.write(head.encode() + b"\r\n" + body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        status = int(status_line.split()[1])
+        self.bytes_read += len(status_line)
+        resp_headers = {}
+        while True:
+            line = await reader.readline()
+            self.bytes_read += len(line)
+            if line in (b'\r\n', b''):
+                break
+            k, v = line.decode('latin-1').split(':', 1)
+            resp_headers[k.strip().lower()] = v.strip()
+        if status in (204, 304):
+            data = b'' # Never a body, with or without Content-Length
+        elif 'content-length' in resp_headers:
+            data = await reader.readexactly(int(resp_headers['content-length']))
+        elif resp_headers.get('transfer-encoding') == 'chunked':
+            data = b''
+            while True:
+                size = int((await reader.readline()).strip(), 16)
+                chunk = await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                data += chunk[:-2]
+        else:
+            data = await reader.read()
+        self.bytes_read += len(data)
+        if resp_headers.get('connection', '').lower() == 'close':
+            writer.close() # e.g. the werkzeug dev server (HTTP/1.0 style)
+            return status, resp_headers, data, None
+        return status, resp_headers, data, (reader, writer)
+
+
+class WebSocketClient:
+    """Just enough of RFC 6455 to push binary frames (client frames must be masked)"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, target, path):
+        reader, writer = await target.open()
+        key = base64.b64encode(os.urandom(16)).decode()
+        writer.write((f"GET {path} HTTP/1.1\r\nHost: {target.host}\r\nUpgrade: websocket\r\n"
+                      f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+        await writer.drain()
+        status = await reader.readline()
+        if b' 101 ' not in status:
+            raise ConnectionError(f"WebSocket upgrade failed: {status!r}")
+        while (await reader.readline()) not in (b'\r\n', b''):
+            pass
+        return cls(reader, writer)
+
+    async def send_binary(self, payload):
+        mask = os.urandom(4)
+        n = len(payload)
+        if n < 126:
+            head = struct.pack('!BB', 0x82, 0x80 | n)
+        elif n < 65536:
+            head = struct.pack('!BBH', 0x82, 0x80 | 126, n)
+        else:
+            head = struct.pack('!BBQ', 0x82, 0x80 | 127, n)
+        # XOR with the repeated mask in one big-int operation (much faster than per byte)
+        full_mask = (mask * (n // 4 + 1))[:n]
+        masked = (int.from_bytes(payload, 'big') ^ int.from_bytes(full_mask, 'big')).to_bytes(n, 'big')
+        self.writer.write(head + mask + masked)
+        await self.writer.drain()
+
+    def close(self):
+        self.writer.close()
+
+
+async def mjpeg_viewer(target, path, counts, index, stop):
+    try:
+        reader, writer = await target.open()
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {target.host}\r\n\r\n".encode())
+        await writer.drain()
+        tail = b''
+        while not stop.is_set():
+            data = await reader.read(65536)
+            if not data:
+                break
+            buf = tail + data
+            counts[index] += buf.count(b'--frame\r\n')
+            tail = buf[-9:] # Boundary split across reads
+        writer.close()
+    except (OSError, asyncio.IncompleteReadError):
+        pass
+
+
+async def publisher(target, path, fps, frame, stop, sent):
+    conn = None
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            _, _, _, conn = await target.request('POST', path, frame, {'Content-Type': 'image/jpeg'}, conn)
+            sent[0] += 1
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+            conn = None
+        await asyncio.sleep(max(0, 1.0 / fps - (time.perf_counter() - start)))
+
+
+async def run_viewers(args):
+    target = Target(args.url)
+    frame = b'\xff\xd8' + os.urandom(args.frame_kb * 1024) + b'\xff\xd9'
+    print(f"{'viewers':>8} {'sent fps':>9} {'recv fps (avg/min)':>20} {'server CPU':>11}")
+    for n in [int(x) for x in args.viewers.split(',')]:
+        stop = asyncio.Event()
+        counts = [0] * n
+        sent = [0]
+        tasks = [asyncio.ensure_future(mjpeg_viewer(target, args.stream + '/mjpeg', counts, i, stop)) for i in range(n)]
+        await asyncio.sleep(1.0) # Let everyone connect
+        pub = asyncio.ensure_future(publisher(target, args.stream, args.fps, frame, stop, sent))
+        await asyncio.sleep(0.5)
+
+        counts[:] = [0] * n
+        sent[0] = 0
+        cpu0 = cpu_seconds(args.pid) if args.pid else None
+        t0 = time.perf_counter()
+        await asyncio.sleep(args.seconds)
+        elapsed = time.perf_counter() - t0
+        cpu = (cpu_seconds(args.pid) - cpu0) / elapsed * 100 if args.pid else float('nan')
+        received = [c / elapsed for c in counts]
+
+        stop.set()
+        for t in tasks:
+            t.cancel()
+        pub.cancel()
+        await asyncio.gather(*tasks, pub, return_exceptions=True)
+
+        print(f"{n:>8} {sent[0] / elapsed:>9.1f} {sum(received) / n:>11.1f} / {min(received):<6.1f} {cpu:>10.0f}%")
+        if args.pid and cpu > args.cpu_budget:
+            print(f"CPU budget of {args.cpu_budget}% exceeded at {n} viewers")
+            break
+        await asyncio.sleep(1.0)
+
+
+async def run_ingest(args):
+    # Same JPEG pushed as fast as the server accepts it: per-frame POSTs vs one WebSocket
+    target = Target(args.url)
+    frame = b'\xff\xd8' + os.urandom(args.frame_kb * 1024) + b'\xff\xd9'
+    print(f"{'mode':>6} {'frames/s':>9} {'server CPU':>11} {'CPU ms/frame':>13}")
+    for mode in ('post', 'ws'):
+        sent = 0
+        cpu0 = cpu_seconds(args.pid) if args.pid else None
+        t0 = time.perf_counter()
+        try:
+            if mode == 'post':
+                conn = None
+                while time.perf_counter() - t0 < args.seconds:
+                    _, _, _, conn = await target.request('POST', args.stream, frame, {'Content-Type': 'image/jpeg'}, conn)
+                    sent += 1
+            else:
+                ws = await WebSocketClient.connect(target, args.stream + '/ws')
+                payload_head = struct.Struct('<Id')
+                while time.perf_counter() - t0 < args.seconds:
+                    await ws.send_binary(payload_head.pack(sent, time.time() * 1000) + frame)
+                    sent += 1
+                ws.close()
+        except (OSError, ConnectionError, asyncio.IncompleteReadError) as e:
+            print(f"{mode:>6} failed: {e}")
+            continue
+        elapsed = time.perf_counter() - t0
+        await asyncio.sleep(0.5) # Let the server finish what is still buffered
+        cpu = cpu_seconds(args.pid) - cpu0 if args.pid else float('nan')
+        print(f"{mode:>6} {sent / elapsed:>9.1f} {cpu / elapsed * 100:>10.0f}% {cpu / max(sent, 1) * 1000:>13.3f}")
+
+
+READ_QUERIES = [
+    ('SELECT name, score, id, video_path, thumb_path FROM scores WHERE score > 0 ORDER BY score DESC, id LIMIT ?', (100,)),
+    ('SELECT name, score, id, video_path, date FROM scores ORDER BY date DESC, id DESC LIMIT ?', (50,)),
+    ('SELECT name, score, video_path, image1_path, image2_path, image3_path, id, poster_path FROM scores ORDER BY id DESC LIMIT 1', ())
+]
+
+
+def legacy_read(path, sql, args):
+    # What every handler used to do: open, query, close (rollback journal)
+    conn = sqlite3.connect(path)
+    rows = conn.execute(sql, args).fetchall()
+    conn.close()
+    return rows
+
+
+def legacy_write(path, sql, args):
+    conn = sqlite3.connect(path)
+    conn.execute(sql, args)
+    conn.commit()
+    conn.close()
+
+
+def run_db_mode(args, mode):
+    import server
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    server.DB_PATH = path
+    server.init_db()
+    conn = sqlite3.connect(path)
+    if mode == 'legacy':
+        conn.execute("PRAGMA journal_mode = DELETE")
+    conn.executemany('INSERT INTO scores (name, score) VALUES (?, ?)',
+                     ((f"p{i}", (i * 7919) % 1000) for i in range(args.rows)))
+    conn.commit()
+    conn.close()
+
+    pool = server.Database(path)
+    read = pool.query if mode == 'pool' else (lambda sql, a: legacy_read(path, sql, a))
+    write = pool.execute if mode == 'pool' else (lambda sql, a: legacy_write(path, sql, a))
+
+    stop = threading.Event()
+    reads = [0] * args.readers
+    writes, write_ms, errors = [0], [], [0]
+
+    def reader(i):
+        n = 0
+        while not stop.is_set():
+            sql, a = READ_QUERIES[n % len(READ_QUERIES)]
+            try:
+                read(sql, a)
+                reads[i] += 1
+            except sqlite3.OperationalError:
+                errors[0] += 1
+            n += 1
+
+    def writer():
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                write('INSERT INTO scores (name, score) VALUES (?, ?)', ("bench", writes[0] % 1000))
+                writes[0] += 1
+                write_ms.append((time.perf_counter() - start) * 1000)
+            except sqlite3.OperationalError:
+                errors[0] += 1
+            time.sleep(max(0, 1.0 / args.write_rate - (time.perf_counter() - start)))
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(args.readers)] + [threading.Thread(target=writer)]
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    pool.close()
+
+    write_ms.sort()
+    p99 = write_ms[int(len(write_ms) * 0.99)] if write_ms else float('nan')
+    print(f"{mode:>7} {sum(reads) / args.seconds:>10.0f} {writes[0] / args.seconds:>9.1f} {p99:>14.1f} {errors[0]:>7}")
+
+
+async def run_db(args):
+    print(f"{'mode':>7} {'reads/s':>10} {'writes/s':>9} {'write p99 ms':>14} {'errors':>7}")
+    for mode in ('legacy', 'pool'):
+        run_db_mode(args, mode)
+
+
+def time_calls(func, seconds=2.0):
+    # Returns (calls/sec, mean ms per call)
+    n, start = 0, time.perf_counter()
+    while time.perf_counter() - start < seconds or n < 3:
+        func()
+        n += 1
+    elapsed = time.perf_counter() - start
+    return n / elapsed, elapsed / n * 1000
+
+
+async def run_leaderboard(args):
+    # The polled leaderboard reads on a big scores table: no index, covering indexes, in-memory cache
+    import server
+    path = os.path.join(tempfile.mkdtemp(), 'leaderboard.db')
+    server.DB_PATH = path
+    server.db = server.Database(path)
+    server.init_db()
+    with server.db.transaction() as conn:
+        conn.execute("DROP INDEX idx_scores_top")
+        conn.execute("DROP INDEX idx_scores_date")
+        conn.executemany("INSERT INTO scores (name, score, date) VALUES (?, ?, datetime(?, 'unixepoch'))",
+                         ((f"p{i}", (i * 7919) % 100000, 1.7e9 + i * 60) for i in range(args.rows)))
+    print(f"{args.rows} rows, {os.path.getsize(path) / 1e6:.0f} MB")
+    top_sql, top_args = READ_QUERIES[0]
+    history_sql, history_args = READ_QUERIES[1]
+    client = server.app.test_client()
+
+    print(f"{'':>20} {'top 100 q/s':>12} {'ms':>8} {'history 50 q/s':>15} {'ms':>8}")
+    def row(label, top, history):
+        (tq, tms), (hq, hms) = time_calls(top), time_calls(history)
+        print(f"{label:>20} {tq:>12.0f} {tms:>8.3f} {hq:>15.0f} {hms:>8.3f}")
+
+    row("no index", lambda: server.db.query(top_sql, top_args), lambda: server.db.query(history_sql, history_args))
+    start = time.perf_counter()
+    server.init_db() # Recreates the indexes
+    print(f"{'':>20} (index build {time.perf_counter() - start:.1f} s, db now {os.path.getsize(path) / 1e6:.0f} MB)")
+    row("covering index", lambda: server.db.query(top_sql, top_args), lambda: server.db.query(history_sql, history_args))
+    row("cache", lambda: server.score_cache.top_scores(100), lambda: server.score_cache.recent_games(50))
+    row("cache, HTTP handler", lambda: client.get('/api/scores?limit=100'), lambda: client.get('/api/history?limit=50'))
+    _, add_ms = time_calls(lambda: client.post('/api/scores', json={'name': 'bench', 'score': 5}), 1.0)
+    print(f"add_score with the cache and indexes to update: {add_ms:.2f} ms")
+
+
+def scan_media_listing(server):
+    # /api/media before the catalogue: every game with a video, each file checked on disk
+    rows = server.db.query('SELECT id, name, score, video_path, date, thumb_path FROM scores WHERE video_path IS NOT NULL ORDER BY id DESC')
+    return [row for row in rows if os.path.exists(os.path.join(server.UPLOAD_FOLDER, os.path.basename(row[3])))]
+
+
+async def run_catalogue(args):
+    # /api/media cost against the number of files: scan of every game vs one page of the media table
+    import server
+    client = server.app.test_client()
+    print(f"{'files':>8} {'scan ms':>9} {'page ms':>9} {'deep page ms':>13} {'HTTP page ms':>13} {'reconcile s':>12}")
+    for files in (int(n) for n in args.files.split(',')):
+        folder = tempfile.mkdtemp()
+        server.UPLOAD_FOLDER = os.path.join(folder, 'uploads')
+        os.makedirs(server.UPLOAD_FOLDER)
+        server.DB_PATH = os.path.join(folder, 'leaderboard.db')
+        server.db = server.Database(server.DB_PATH)
+        server.init_db()
+        with server.db.transaction() as conn:
+            conn.execute("DROP TABLE media") # Backfilled from the scores below by the next init_db
+            conn.executemany("INSERT INTO scores (name, score, video_path) VALUES (?, ?, ?)",
+                             ((f"p{i}", i % 1000, f"/uploads/game_{i}.webm") for i in range(files)))
+        for i in range(files):
+            open(os.path.join(server.UPLOAD_FOLDER, f"game_{i}.webm"), 'wb').close()
+        server.init_db()
+        start = time.perf_counter()
+        while server.media_catalogue.reconcile_step():
+            pass
+        reconcile = time.perf_counter() - start
+        middle = files // 2
+        _, scan_ms = time_calls(lambda: scan_media_listing(server), 1.0)
+        _, page_ms = time_calls(lambda: server.media_catalogue.page(limit=args.limit), 1.0)
+        _, deep_ms = time_calls(lambda: server.media_catalogue.page(cursor=middle, limit=args.limit), 1.0)
+        _, http_ms = time_calls(lambda: client.get(f"/api/media?limit={args.limit}"), 1.0)
+        print(f"{files:>8} {scan_ms:>9.2f} {page_ms:>9.3f} {deep_ms:>13.3f} {http_ms:>13.3f} {reconcile:>12.1f}")
+
+
+def sample_ptak_state(score=0):
+    # What ptak.html posts every 100 ms: 33 MediaPipe pose landmarks as JSON floats
+    landmarks = [{'x': 0.5 + i * 0.0123456, 'y': 0.3 + i * 0.0098765, 'z': -0.1234567 + i * 0.001,
+                  'visibility': 0.99876} for i in range(33)]
+    return {'player_y': 12.5, 'score': score, 'is_playing': True, 'game_state': 'PLAYING',
+            'pipes': [{'z': -20.5 * i, 'gapY': 10.0, 'gapHeight': 8.0} for i in range(4)], 'landmarks': landmarks}
+
+
+async def run_poll(args):
+    # Bytes and server CPU per poll of unchanged data: plain GET vs revalidation with If-None-Match
+    target = Target(args.url)
+    body = json.dumps(sample_ptak_state()).encode()
+    _, _, _, conn = await target.request('POST', '/api/ptak/state', body, {'Content-Type': 'application/json'})
+    _, _, _, conn = await target.request('POST', '/api/snake/state', json.dumps({'score': 3, 'n_games': 10}).encode(),
+                                         {'Content-Type': 'application/json'}, conn)
+
+    print(f"{'endpoint':>24} {'mode':>6} {'bytes/poll':>11} {'CPU ms/poll':>12} {'status':>7}")
+    for path in args.paths.split(','):
+        status, headers, _, conn = await target.request('GET', path, conn=conn)
+        for mode in ('plain', 'etag'):
+            extra = {'If-None-Match': headers['etag']} if mode == 'etag' and 'etag' in headers else {}
+            target.bytes_read = 0
+            cpu0 = cpu_seconds(args.pid) if args.pid else None
+            for _ in range(args.requests):
+                status, _, _, conn = await target.request('GET', path, headers=extra, conn=conn)
+            cpu = (cpu_seconds(args.pid) - cpu0) / args.requests * 1000 if args.pid else float('nan')
+            print(f"{path:>24} {mode:>6} {target.bytes_read / args.requests:>11.0f} {cpu:>12.3f} {status:>7}")
+
+
+async def state_poster(target, rate, posted, stop, api='/api'):
+    # The kiosk: ptak state at `rate` Hz, the score counts the updates so clients can match them
+    conn = None
+    n = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        n += 1
+        posted[n] = start
+        try:
+            _, _, _, conn = await target.request('POST', api + '/ptak/state', json.dumps(sample_ptak_state(n)).encode(),
+                                                 {'Content-Type': 'application/json'}, conn)
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+            conn = None
+        await asyncio.sleep(max(0, 1.0 / rate - (time.perf_counter() - start)))
+
+
+async def event_subscriber(target, max_rate, posted, latencies, stop, api='/api'):
+    reader, writer = await target.open()
+    writer.write(f"GET {api}/ptak/events?max_rate={max_rate} HTTP/1.1\r\nHost: {target.host}\r\n\r\n".encode())
+    await writer.drain()
+    try:
+        while not stop.is_set():
+            line = await reader.readline()
+            if not line:
+                break
+            if line.startswith(b'data: '):
+                score = json.loads(line[6:])['score']
+                if score in posted:
+                    latencies.append(time.perf_counter() - posted[score])
+    except (OSError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def state_poller(target, interval, posted, latencies, requests, stop):
+    conn = None
+    seen = None
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            _, _, data, conn = await target.request('GET', '/api/ptak/state', conn=conn)
+            requests[0] += 1
+            score = json.loads(data)['score']
+            if score != seen and score in posted:
+                latencies.append(time.perf_counter() - posted[score])
+            seen = score
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+            conn = None
+        await asyncio.sleep(max(0, interval - (time.perf_counter() - start)))
+
+
+async def run_events(args):
+    # Display latency (kiosk POST -> client has the state) and server load: SSE vs timer polling
+    target = Target(args.url)
+    print(f"{'mode':>6} {'clients':>8} {'updates/s per client':>21} {'latency p50/p99 ms':>19} {'GET/s':>7} {'server CPU':>11}")
+    for mode in ('poll', 'sse'):
+        stop = asyncio.Event()
+        posted = {}
+        latencies = []
+        requests = [0]
+        if mode == 'sse':
+            clients = [event_subscriber(target, args.max_rate, posted, latencies, stop) for _ in range(args.clients)]
+        else:
+            clients = [state_poller(target, args.interval, posted, latencies, requests, stop) for _ in range(args.clients)]
+        tasks = [asyncio.ensure_future(c) for c in clients]
+        await asyncio.sleep(1.0)
+        latencies.clear()
+        requests[0] = 0
+        cpu0 = cpu_seconds(args.pid) if args.pid else None
+        t0 = time.perf_counter()
+        poster = asyncio.ensure_future(state_poster(target, args.rate, posted, stop))
+        await asyncio.sleep(args.seconds)
+        elapsed = time.perf_counter() - t0
+        cpu = (cpu_seconds(args.pid) - cpu0) / elapsed * 100 if args.pid else float('nan')
+        stop.set()
+        for t in tasks + [poster]:
+            t.cancel()
+        await asyncio.gather(*tasks, poster, return_exceptions=True)
+
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1000 if latencies else float('nan')
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else float('nan')
+        print(f"{mode:>6} {args.clients:>8} {len(latencies) / elapsed / args.clients:>21.1f} "
+              f"{p50:>9.1f} / {p99:<7.1f} {requests[0] / elapsed:>7.0f} {cpu:>10.0f}%")
+        await asyncio.sleep(1.0)
+
+
+def browser_landmarks():
+    # MediaPipe output as JSON.stringify sends it: full double precision
+    return [{'x': random.random(), 'y': random.random(), 'z': random.uniform(-1, 1), 'visibility': random.random()}
+            for _ in range(33)]
+
+
+def encode_landmarks(landmarks):
+    # Same bytes as encodePoseLandmarks() in js/pose_landmarks.js (body landmarks 11..32, with visibility)
+    out = bytearray(struct.pack('<BBBB', 1, 1, 11, 22))
+    for lm in landmarks[11:33]:
+        out += struct.pack('<hhhB', *(max(-32768, min(32767, round(lm[k] * 8192))) for k in ('x', 'y', 'z')),
+                           round(lm['visibility'] * 255))
+    return bytes(out)
+
+
+async def run_landmarks(args):
+    # Ptak state updates: landmarks as JSON floats vs the binary `pose` field (base64, passed through)
+    target = Target(args.url)
+    json_type = {'Content-Type': 'application/json'}
+    print(f"{'mode':>7} {'upload B/update':>16} {'GET state B':>12} {'server CPU ms/update':>21}")
+    for mode in ('json', 'pose'):
+        conn = None
+        state = sample_ptak_state()
+        cpu0 = cpu_seconds(args.pid) if args.pid else None
+        uploaded = 0
+        for n in range(args.updates):
+            landmarks = browser_landmarks()
+            state['score'] = n
+            if mode == 'json':
+                update = dict(state, landmarks=landmarks)
+            else:
+                update = dict(state, landmarks=None, pose=base64.b64encode(encode_landmarks(landmarks)).decode())
+            body = json.dumps(update, separators=(',', ':')).encode()
+            _, _, _, conn = await target.request('POST', '/api/ptak/state', body, json_type, conn)
+            uploaded += len(body)
+        cpu = (cpu_seconds(args.pid) - cpu0) / args.updates * 1000 if args.pid else float('nan')
+        _, _, state_body, conn = await target.request('GET', '/api/ptak/state', conn=conn)
+        print(f"{mode:>7} {uploaded / args.updates:>16.0f} {len(state_body):>12} {cpu:>21.3f}")
+
+
+async def run_telemetry(args):
+    # Per-game telemetry: cost of recording an update, bytes and writes per game, series fetch time
+    import server
+    folder = tempfile.mkdtemp()
+    server.DB_PATH = os.path.join(folder, 'leaderboard.db')
+    server.db = server.Database(server.DB_PATH)
+    server.init_db()
+    server.TELEMETRY_FOLDER = os.path.join(folder, 'telemetry')
+    server.telemetry.start()
+    client = server.app.test_client()
+
+    writes = [0]
+    append = server.TelemetryStore._append
+    def counting_append(path, chunk):
+        writes[0] += 1
+        append(path, chunk)
+    server.telemetry._append = counting_append
+
+    samples = int(args.seconds * 10) # ptak.html posts at 10 Hz
+    pose = base64.b64encode(encode_landmarks(browser_landmarks())).decode()
+    states = [dict(sample_ptak_state(n), landmarks=None, pose=pose) for n in range(samples)]
+    json_bytes = sum(len(json.dumps(dict(state, landmarks=browser_landmarks()))) for state in states)
+    record_s = 0.0
+    for game in range(args.games):
+        start = time.perf_counter()
+        for state in states:
+            server.telemetry.record(state)
+        server.telemetry.record(dict(states[-1], is_playing=False, game_state='GAME_OVER'))
+        record_s += time.perf_counter() - start
+    server.telemetry.writes.join()
+
+    disk = sum(os.path.getsize(os.path.join(server.TELEMETRY_FOLDER, f)) for f in os.listdir(server.TELEMETRY_FOLDER))
+    updates = args.games * (samples + 1)
+    print(f"{args.games} games x {args.seconds:.0f} s: {updates} updates, record {record_s / updates * 1e6:.1f} us/update")
+    print(f"on disk {disk / args.games / 1e3:.1f} kB/game in {writes[0] / args.games:.1f} write(s)/game "
+          f"(the same updates as JSON with landmarks: {json_bytes / 1e3:.0f} kB/game)")
+    session = server.telemetry.sessions(1)[0]['id']
+    for points in (100, 1000):
+        _, ms = time_calls(lambda: client.get(f'/api/telemetry/{session}?points={points}'), 1.0)
+        print(f"GET /api/telemetry/<session>?points={points}: {ms:.2f} ms")
+
+
+async def run_stations(args):
+    # N kiosks on one server, each in its own station: state at 10 Hz + camera frames, one SSE subscriber
+    # and one MJPEG viewer per kiosk. Per-kiosk rates should stay flat as N grows.
+    target = Target(args.url)
+    frame = b'\xff\xd8' + os.urandom(args.frame_kb * 1024) + b'\xff\xd9'
+    print(f"{'kiosks':>7} {'updates/s per kiosk':>20} {'frames/s per kiosk':>19} {'latency p50/p99 ms':>19} "
+          f"{'server CPU':>11} {'RSS MB':>7}")
+    for n in [int(x) for x in args.kiosks.split(',')]:
+        stop = asyncio.Event()
+        apis = [f"/api/s/{args.prefix}{i}" for i in range(n)]
+        posted = [{} for _ in range(n)]
+        latencies = [[] for _ in range(n)]
+        counts = [0] * n
+        sent = [0]
+        tasks = [asyncio.ensure_future(event_subscriber(target, args.max_rate, posted[i], latencies[i], stop, api))
+                 for i, api in enumerate(apis)]
+        tasks += [asyncio.ensure_future(mjpeg_viewer(target, api + '/stream/ptak/camera/mjpeg', counts, i, stop))
+                  for i, api in enumerate(apis)]
+        await asyncio.sleep(1.0)
+        for per_kiosk in latencies:
+            per_kiosk.clear()
+        counts[:] = [0] * n
+        cpu0 = cpu_seconds(args.pid) if args.pid else None
+        t0 = time.perf_counter()
+        tasks += [asyncio.ensure_future(state_poster(target, args.rate, posted[i], stop, api)) for i, api in enumerate(apis)]
+        tasks += [asyncio.ensure_future(publisher(target, api + '/stream/ptak/camera', args.fps, frame, stop, sent))
+                  for api in apis]
+        await asyncio.sleep(args.seconds)
+        elapsed = time.perf_counter() - t0
+        cpu = (cpu_seconds(args.pid) - cpu0) / elapsed * 100 if args.pid else float('nan')
+        rss = rss_mb(args.pid) if args.pid else float('nan')
+        stop.set()
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        merged = sorted(x for per_kiosk in latencies for x in per_kiosk)
+        p50 = merged[len(merged) // 2] * 1000 if merged else float('nan')
+        p99 = merged[int(len(merged) * 0.99)] * 1000 if merged else float('nan')
+        updates = min(len(per_kiosk) for per_kiosk in latencies) / elapsed
+        print(f"{n:>7} {len(merged) / elapsed / n:>12.1f} (min {updates:<4.1f}) {sum(counts) / elapsed / n:>10.1f} "
+              f"(min {min(counts) / elapsed:<4.1f}) {p50:>9.1f} / {p99:<7.1f} {cpu:>10.0f}% {rss:>7.0f}")
+        await asyncio.sleep(1.0)
+
+
+# Request mix of the worker bench: the polled reads of the pages plus a state change (a hub op with --workers)
+WORKER_REQUESTS = ['/api/ptak/state', '/api/scores?limit=100', '/api/snake/state', '/api/stream/viewers', 'POST']
+
+
+def load_process(url, clients, seconds, results):
+    # One load generator process: `clients` keep-alive connections, as fast as the server answers
+    async def client(index, latencies, errors):
+        target = Target(url)
+        conn = None
+        n = 0
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            path = WORKER_REQUESTS[n % len(WORKER_REQUESTS)]
+            n += 1
+            start = time.perf_counter()
+            try:
+                if path == 'POST':
+                    # is_playing off: no telemetry sessions in the database
+                    body = json.dumps({'player_y': 10, 'score': n, 'is_playing': False, 'client': index}).encode()
+                    status, _, _, conn = await target.request('POST', '/api/ptak/state', body,
+                                                              {'Content-Type': 'application/json'}, conn)
+                else:
+                    status, _, _, conn = await target.request('GET', path, conn=conn)
+                if status >= 400:
+                    errors[0] += 1
+                latencies.append(time.perf_counter() - start)
+            except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+                errors[0] += 1
+                conn = None
+
+    async def main():
+        latencies = []
+        errors = [0]
+        await asyncio.gather(*(client(i, latencies, errors) for i in range(clients)))
+        return latencies, errors[0]
+
+    results.put(asyncio.run(main()))
+
+
+async def wait_for_server(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            status, _, _, (_, writer) = await Target(url).request('GET', '/api/ptak/state')
+            writer.close()
+            if status == 200:
+                return True
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+            pass
+        await asyncio.sleep(0.2)
+    return False
+
+
+async def run_workers(args):
+    # Requests/sec of asgi.py at 1, 2, 4, 8 worker processes (started here, one after the other)
+    url = f"http://127.0.0.1:{args.port}"
+    asgi_path = os.path.join(args.app_dir, 'asgi.py')
+    print(f"{os.cpu_count()} CPUs, {args.procs} load processes x {args.clients} connections")
+    print(f"{'workers':>8} {'requests/s':>11} {'latency p50/p99 ms':>19} {'errors':>7} {'server CPU':>11}")
+    for n in [int(x) for x in args.workers.split(',')]:
+        server_proc = subprocess.Popen([sys.executable, asgi_path, '--no-ssl', '--host', '127.0.0.1',
+                                        '--port', str(args.port), '--workers', str(n)],
+                                       cwd=args.app_dir, stdout=subprocess.DEVNULL)
+        try:
+            if not await wait_for_server(url):
+                print(f"{n:>8} server did not start")
+                continue
+            await asyncio.sleep(2.0) # Every worker up and connected to the hub
+
+            results = multiprocessing.Queue()
+            loaders = [multiprocessing.Process(target=load_process, args=(url, args.clients, args.seconds, results))
+                       for _ in range(args.procs)]
+            cpu0 = tree_cpu_seconds(server_proc.pid)
+            t0 = time.perf_counter()
+            for loader in loaders:
+                loader.start()
+            gathered = [results.get() for _ in loaders] # Before join: the queue has to be drained first
+            elapsed = time.perf_counter() - t0
+            cpu = (tree_cpu_seconds(server_proc.pid) - cpu0) / elapsed * 100
+            for loader in loaders:
+                loader.join()
+        finally:
+            server_proc.send_signal(signal.SIGINT)
+            try:
+                server_proc.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                server_proc.kill()
+
+        latencies = sorted(x for per_process, _ in gathered for x in per_process)
+        errors = sum(e for _, e in gathered)
+        p50 = latencies[len(latencies) // 2] * 1000 if latencies else float('nan')
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else float('nan')
+        print(f"{n:>8} {len(latencies) / elapsed:>11.0f} {p50:>9.1f} / {p99:<7.1f} {errors:>7} {cpu:>10.0f}%")
+
+
+# What a kiosk loads on startup besides the page: its scripts and stylesheets, the files the stylesheets
+# reference, and the MediaPipe files Pose fetches (the SIMD build, the lite model)
+PAGE_ASSET = re.compile(r'''(?:src|href)=["'](/?static/[^"']+)''')
+CSS_ASSET = re.compile(r'''url\(['"]?(/static/[^'")]+)''')
+MEDIAPIPE_ENTRY = re.compile(r"'([\w.]+)': '(/static/js/mediapipe/[^']+)'")
+KIOSK_MEDIAPIPE = ('pose_solution_packed_assets_loader.js', 'pose_solution_simd_wasm_bin.js',
+                   'pose_solution_packed_assets.data', 'pose_landmark_lite.tflite', 'pose_web.binarypb')
+BROWSER_CONNECTIONS = 6 # Parallel connections per host, like a browser
+
+
+async def kiosk_load(target, page, cache, accept_encoding):
+    """
+    One load of the page the way a browser with an HTTP cache does it: fresh (immutable / max-age)
+    entries aren't requested, the others are revalidated with If-None-Match.
+    Returns (requests, 304s, bytes received, seconds).
+    """
+    counts = {'requests': 0, 'not_modified': 0}
+    bytes_before = target.bytes_read
+
+    async def fetch(url, conn=None):
+        entry = cache.get(url)
+        if entry and entry['fresh']:
+            return entry['body'], conn
+        headers = {'Accept-Encoding': accept_encoding}
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        status, resp_headers, body, conn = await target.request('GET', url, headers=headers, conn=conn)
+        counts['requests'] += 1
+        if status == 304:
+            counts['not_modified'] += 1
+            return entry['body'], conn
+        if resp_headers.get('content-encoding') == 'gzip':
+            body = gzip.decompress(body)
+        control = resp_headers.get('cache-control', '')
+        max_age = re.search(r'max-age=(\d+)', control)
+        cache[url] = {'etag': resp_headers.get('etag'), 'body': body,
+                      'fresh': 'no-cache' not in control and bool(max_age and int(max_age.group(1)) > 0)}
+        return body, conn
+
+    async def fetch_all(urls):
+        pending = list(urls)
+        bodies = {}
+
+        async def connection():
+            conn = None
+            while pending:
+                url = pending.pop(0)
+                bodies[url], conn = await fetch(url, conn)
+            if conn:
+                conn[1].close()
+
+        await asyncio.gather(*(connection() for _ in range(BROWSER_CONNECTIONS)))
+        return bodies
+
+    t0 = time.perf_counter()
+    html, conn = await fetch(page)
+    if conn:
+        conn[1].close()
+    html = html.decode()
+    mediapipe = dict(MEDIAPIPE_ENTRY.findall(html))
+    urls = ['/' + url.lstrip('/') for url in PAGE_ASSET.findall(html)]
+    urls += [mediapipe.get(name, f"/static/js/mediapipe/{name}") for name in KIOSK_MEDIAPIPE]
+    bodies = await fetch_all(dict.fromkeys(urls))
+    css_urls = [url for u, body in bodies.items() if u.split('?')[0].endswith('.css')
+                for url in CSS_ASSET.findall(body.decode())]
+    await fetch_all(dict.fromkeys(css_urls))
+    return counts['requests'], counts['not_modified'], target.bytes_read - bytes_before, time.perf_counter() - t0
+
+
+async def run_assets(args):
+    # Kiosk cold start (empty cache) and reloads (warm cache), without and with compression
+    target = Target(args.url)
+    print(f"{'':28} {'requests':>9} {'304':>5} {'bytes':>12} {'time ms':>9} {f'at {args.mbps:g} Mbit/s':>15}")
+    for accept_encoding in ('identity', 'gzip'): # The bench can't decode br (standard library only)
+        cache = {}
+        for label in ['cold start'] + ['reload'] * args.reloads:
+            requests, not_modified, received, seconds = await kiosk_load(target, args.page, cache, accept_encoding)
+            wire = received * 8 / (args.mbps * 1e6)
+            print(f"{label + ' (' + accept_encoding + ')':28} {requests:>9} {not_modified:>5} {received:>12,} "
+                  f"{seconds * 1000:>9.0f} {wire * 1000:>12.0f} ms")
+
+
+def multipart_body(field, filename, data, boundary="ptakbench"):
+    head = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; filename=\"{filename}\"\r\n"
+            f"Content-Type: video/webm\r\n\r\n").encode()
+    return head + data + f"\r\n--{boundary}--\r\n".encode(), f"multipart/form-data; boundary={boundary}"
+
+
+async def seek(target, path, offset, read_bytes):
+    # One seek of a video player: an open-ended range, a few hundred KB read, then the request is dropped
+    reader, writer = await target.open()
+    t0 = time.perf_counter()
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {target.host}\r\nRange: bytes={offset}-\r\n\r\n".encode())
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    while (await reader.readline()) not in (b'\r\n', b''):
+        pass
+    await reader.readexactly(1)
+    first_byte = time.perf_counter() - t0
+    await reader.readexactly(read_bytes - 1)
+    writer.close()
+    return status, first_byte
+
+
+async def run_media(args):
+    # Server memory during concurrent video uploads, then concurrent playback seeks (Range requests) on the result
+    target = Target(args.url)
+    size = int(args.size_mb * 1024 * 1024)
+    body, content_type = multipart_body('video', 'bench.webm', os.urandom(size)) # What upload_media has always taken
+
+    rss0 = rss_mb(args.pid) if args.pid else float('nan')
+    peak = [rss0]
+    done = asyncio.Event()
+
+    async def sample_rss():
+        while not done.is_set():
+            peak[0] = max(peak[0], rss_mb(args.pid))
+            await asyncio.sleep(0.02)
+
+    sampler = asyncio.ensure_future(sample_rss()) if args.pid else None
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*(target.request('POST', f"/api/upload_media/{args.score_id}", body,
+                                                    {'Content-Type': content_type}) for _ in range(args.uploads)))
+    elapsed = time.perf_counter() - t0
+    done.set()
+    if sampler:
+        await sampler
+    statuses = sorted({status for status, _, _, _ in results})
+    print(f"uploads: {args.uploads} x {args.size_mb:g} MB in {elapsed:.2f} s ({args.uploads * size / elapsed / 1e6:.0f} MB/s), "
+          f"status {statuses}, server RSS {rss0:.0f} -> peak {peak[0]:.0f} MB (+{peak[0] - rss0:.0f})")
+
+    # The last upload's job turns it into /uploads/game_<score id>.webm
+    job_id = json.loads(results[-1][2])['job_id']
+    for _ in range(100):
+        _, _, job, _ = await target.request('GET', f"/api/jobs/{job_id}")
+        job = json.loads(job)
+        if job['status'] in ('done', 'failed'):
+            break
+        await asyncio.sleep(0.1)
+    path = job['result']['video_path']
+
+    latencies = []
+    statuses = set()
+
+    async def player():
+        deadline = time.perf_counter() + args.seconds
+        while time.perf_counter() < deadline:
+            offset = random.randrange(0, size - args.read_kb * 1024)
+            status, first_byte = await seek(target, path, offset, args.read_kb * 1024)
+            statuses.add(status)
+            latencies.append(first_byte)
+
+    cpu0 = cpu_seconds(args.pid) if args.pid else None
+    t0 = time.perf_counter()
+    await asyncio.gather(*(player() for _ in range(args.players)))
+    elapsed = time.perf_counter() - t0
+    cpu = (cpu_seconds(args.pid) - cpu0) / elapsed * 100 if args.pid else float('nan')
+    latencies.sort()
+    print(f"seeks: {args.players} players, {len(latencies) / elapsed:.0f} seeks/s, status {sorted(statuses)}, "
+          f"first byte p50 {latencies[len(latencies) // 2] * 1000:.1f} / p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms, "
+          f"server CPU {cpu:.0f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('viewers', help="MJPEG viewers + one 30 FPS uploader, per-viewer FPS and server CPU")
+    p.add_argument('--url', default="https://127.0.0.1:5001")
+    p.add_argument('--pid', type=int, help="server process id, to measure its CPU use")
+    p.add_argument('--stream', default="/api/stream/snake")
+    p.add_argument('--viewers', default="10,50,100,200")
+    p.add_argument('--fps', type=float, default=30)
+    p.add_argument('--frame-kb', type=int, default=40)
+    p.add_argument('--seconds', type=float, default=5)
+    p.add_argument('--cpu-budget', type=float, default=100, help="percent of one core")
+    p.set_defaults(run=run_viewers)
+
+    p = sub.add_parser('ingest', help="frames/sec and server CPU: one POST per frame vs one WebSocket")
+    p.add_argument('--url', default="https://127.0.0.1:5001")
+    p.add_argument('--pid', type=int, help="server process id, to measure its CPU use")
+    p.add_argument('--stream', default="/api/stream/snake")
+    p.add_argument('--frame-kb', type=int, default=40)
+    p.add_argument('--seconds', type=float, default=5)
+    p.set_defaults(run=run_ingest)
+
+    p = sub.add_parser('db', help="SQLite queries/sec: concurrent leaderboard readers + one score writer")
+    p.add_argument('--readers', type=int, default=8)
+    p.add_argument('--rows', type=int, default=100000)
+    p.add_argument('--write-rate', type=float, default=50, help="score inserts per second")
+    p.add_argument('--seconds', type=float, default=5)
+    p.set_defaults(run=run_db)
+
+    p = sub.add_parser('leaderboard', help="leaderboard read cost on a big table: no index / covering index / cache")
+    p.add_argument('--rows', type=int, default=1000000)
+    p.set_defaults(run=run_leaderboard)
+
+    p = sub.add_parser('poll', help="bytes and server CPU per poll of unchanged JSON, with and without ETags")
+    p.add_argument('--url', default="https://127.0.0.1:5001")
+    p.add_argument('--pid', type=int, help="server process id, to measure its CPU use")
+    p.add_argument('--paths', default="/api/ptak/state,/api/snake/state,/api/scores?limit=100,/api/latest_game")
+    p.add_argument('--requests', type=int, default=2000)
+    p.set_defaults(run=run_poll)
+
+    p = sub.add_parser('events', help="ptak state display latency and server CPU: 200 ms polling vs SSE")
+    p.add_argument('--url', default="https://127.0.0.1:5001")
+    p.add_argument('--pid', type=int, help="server process id, to measure its CPU use")
+    p.add_argument('--clients', type=int, default=20)
+    p.add_argument('--rate', type=float, default=10, help="state updates per second (ptak.html posts at 10)")
+    p.add_argument('--interval', type=float, default=0.2, help="polling interval of the current pages")
+    p.add_argument('--max-rate', type=float, default=20, help="SSE max_rate per subscriber")
+    p.add_argument('--seconds', type=float, default=10)
+    p.set_defaults(run=run_events)
+
+    p = sub.add_parser('landmarks', help="ptak state update size and server CPU: JSON landmarks vs binary pose field")
+    p.add_argument('--url', default="https://127.0.0.1:5001")
+    p.add_argument('--pid', type=int, help="server process id, to measure its CPU use")
+    p.add_argument('--updates', type=int, default=2000)
+    p.set_defaults(run=run_landmarks)
+
+    p = sub.add_parser('telemetry', help="ptak telemetry: record cost, bytes and writes per game, series fetch time")
+    p.add_argument('--games', type=int, default=20)
+    p.add_argument('--seconds', type=float, default=60, help="length of each game")
+    p.set_defaults(run=run_telemetry)
+
+    p = sub.add_parser('stations', help="N kiosks in their own stations: per-kiosk updates, frames, latency, server CPU and RSS")
+    p.add_argument('--url', default="https://127.0.0.1:5001")
+    p.add_argument('--pid', type=int, help="server process id, to measure its CPU use and memory")
+    p.add_argument('--kiosks', default="1,5,20")
+    p.add_argument('--prefix', default="kiosk", help="station names are <prefix>0, <prefix>1, ...")
+    p.add_argument('--rate', type=float, default=10, help="state updates per second per kiosk")
+    p.add_argument('--fps', type=float, default=15, help="camera frames per second per kiosk")
+    p.add_argument('--frame-kb', type=int, default=20)
+    p.add_argument('--max-rate', type=float, default=20, help="SSE max_rate per subscriber")
+    p.add_argument('--seconds', type=float, default=10)
+    p.set_defaults(run=run_stations)
+
+    p = sub.add_parser('assets', help="kiosk cold start and reload: requests, bytes and time for the page and its static files")
+    p.add_argument('--url', default="https://127.0.0.1:5001")
+    p.add_argument('--page', default="/")
+    p.add_argument('--reloads', type=int, default=2)
+    p.add_argument('--mbps', type=float, default=20, help="link speed for the transfer time estimate (kiosk Wi-Fi)")
+    p.set_defaults(run=run_assets)
+
+    p = sub.add_parser('media', help="server memory during concurrent video uploads, then concurrent seeks in the video")
+    p.add_argument('--url', default="https://127.0.0.1:5001")
+    p.add_argument('--pid', type=int, help="server process id, to measure its CPU use and memory")
+    p.add_argument('--score-id', type=int, default=0, help="score the uploads are attached to (0: none, no row changes)")
+    p.add_argument('--uploads', type=int, default=8)
+    p.add_argument('--size-mb', type=float, default=50)
+    p.add_argument('--players', type=int, default=8)
+    p.add_argument('--read-kb', type=int, default=512, help="bytes read per seek before it is dropped")
+    p.add_argument('--seconds', type=float, default=10)
+    p.set_defaults(run=run_media)
+
+    p = sub.add_parser('catalogue', help="/api/media cost for 1k..100k files: scan of every game vs a page of the media table")
+    p.add_argument('--files', default="1000,10000,100000")
+    p.add_argument('--limit', type=int, default=50, help="items per page")
+    p.set_defaults(run=run_catalogue)
+
+    p = sub.add_parser('workers', help="requests/sec of asgi.py --workers N (started by the bench) for each N")
+    p.add_argument('--workers', default="1,2,4,8")
+    p.add_argument('--app-dir', default=os.path.dirname(os.path.abspath(__file__)), help="directory with asgi.py")
+    p.add_argument('--port', type=int, default=5099)
+    p.add_argument('--procs', type=int, default=max(2, (os.cpu_count() or 2) // 2), help="load generator processes")
+    p.add_argument('--clients', type=int, default=32, help="connections per load generator process")
+    p.add_argument('--seconds', type=float, default=10)
+    p.set_defaults(run=run_workers)
+
+    args = parser.parse_args()
+    asyncio.run(args.run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+// Compact binary pose landmarks (MediaPipe Pose). ptak.html sends them base64-encoded in the
+// `pose` field of /api/ptak/state; the server stores and forwards the string as-is, it never
+// parses the coordinates. ~210 characters instead of ~3.3 KB of JSON floats.
+//
+// All values little-endian.
+// Header (4 bytes): u8 version, u8 flags (bit 0 = visibility present), u8 first index, u8 count
+// Per landmark:     i16 x, i16 y, i16 z   - fixed point, value * 8192 (-4..4 in steps of 0.00012)
+//                   u8 visibility * 255   - only with flag bit 0
+// Only the body landmarks (11..32) are sent: the face ones are masked out on the kiosk and never drawn.
+const POSE_LANDMARKS_VERSION = 1;
+const POSE_FIRST_LANDMARK = 11;
+const POSE_LANDMARK_COUNT = 22;
+const POSE_FIXED_SCALE = 8192;
+const POSE_FLAG_VISIBILITY = 1;
+
+// Body part of MediaPipe's POSE_CONNECTIONS (for pages that don't load the MediaPipe drawing utils)
+const POSE_BODY_CONNECTIONS = [
+    [11, 12], [11, 13], [13, 15], [15, 17], [15, 19], [15, 21], [17, 19],
+    [12, 14], [14, 16], [16, 18], [16, 20], [16, 22], [18, 20],
+    [11, 23], [12, 24], [23, 24],
+    [23, 25], [25, 27], [27, 29], [27, 31], [29, 31],
+    [24, 26], [26, 28], [28, 30], [28, 32], [30, 32]
+];
+
+function encodePoseLandmarks(landmarks, withVisibility = true) {
+    const stride = withVisibility ? 7 : 6;
+    const buffer = new ArrayBuffer(4 + POSE_LANDMARK_COUNT * stride);
+    const view = new DataView(buffer);
+    const fixed = v => Math.max(-32768, Math.min(32767, Math.round((v || 0) * POSE_FIXED_SCALE)));
+
+    view.setUint8(0, POSE_LANDMARKS_VERSION);
+    view.setUint8(1, withVisibility ? POSE_FLAG_VISIBILITY : 0);
+    view.setUint8(2, POSE_FIRST_LANDMARK);
+    view.setUint8(3, POSE_LANDMARK_COUNT);
+    let o = 4;
+    for (let i = 0; i < POSE_LANDMARK_COUNT; i++, o += stride) {
+        const lm = landmarks[POSE_FIRST_LANDMARK + i] || {};
+        view.setInt16(o, fixed(lm.x), true);
+        view.setInt16(o + 2, fixed(lm.y), true);
+        view.setInt16(o + 4, fixed(lm.z), true);
+        if (withVisibility) {
+            view.setUint8(o + 6, Math.round(Math.max(0, Math.min(1, lm.visibility || 0)) * 255));
+        }
+    }
+    return buffer;
+}
+
+// Returns a 33-entry array indexed like MediaPipe's poseLandmarks (null where nothing was sent),
+// or null if the buffer is empty or of an unknown version
+function decodePoseLandmarks(buffer) {
+    const view = new DataView(buffer);
+    if (view.byteLength < 4 || view.getUint8(0) !== POSE_LANDMARKS_VERSION) return null;
+    const withVisibility = (view.getUint8(1) & POSE_FLAG_VISIBILITY) !== 0;
+    const first = view.getUint8(2);
+    const count = view.getUint8(3);
+    const stride = withVisibility ? 7 : 6;
+
+    const landmarks = new Array(33).fill(null);
+    let o = 4;
+    for (let i = 0; i < count && o + stride <= view.byteLength; i++, o += stride) {
+        landmarks[first + i] = {
+            x: view.getInt16(o, true) / POSE_FIXED_SCALE,
+            y: view.getInt16(o + 2, true) / POSE_FIXED_SCALE,
+            z: view.getInt16(o + 4, true) / POSE_FIXED_SCALE,
+            visibility: withVisibility ? view.getUint8(o + 6) / 255 : 1
+        };
+    }
+    return landmarks;
+}
+
+function poseLandmarksToBase64(landmarks) {
+    return btoa(String.fromCharCode(...new Uint8Array(encodePoseLandmarks(landmarks))));
+}
+
+function poseLandmarksFromBase64(text) {
+    if (!text) return null;
+    return decodePoseLandmarks(Uint8Array.from(atob(text), c => c.charCodeAt(0)).buffer);
+}
+
+// Skeleton on a canvas; rect is the area of the camera image inside the canvas ({x, y, w, h})
+function drawPoseLandmarks(canvas, landmarks, rect, color = '#00FFFF') {
+    const ctx = canvas.getContext('2d');
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+    if (!landmarks) return;
+    const visible = lm => lm && lm.visibility > 0.5;
+    const px = lm => [rect.x + lm.x * rect.w, rect.y + lm.y * rect.h];
+
+    ctx.strokeStyle = color;
+    ctx.lineWidth = 3;
+    ctx.beginPath();
+    POSE_BODY_CONNECTIONS.forEach(([a, b]) => {
+        if (!visible(landmarks[a]) || !visible(landmarks[b])) return;
+        ctx.moveTo(...px(landmarks[a]));
+        ctx.lineTo(...px(landmarks[b]));
+    });
+    ctx.stroke();
+
+    ctx.fillStyle = color;
+    landmarks.forEach(lm => {
+        if (!visible(lm)) return;
+        const [x, y] = px(lm);
+        ctx.beginPath();
+        ctx.arc(x, y, 3, 0, Math.PI * 2);
+        ctx.fill();
+    });
+}
@@ -0,0 +1,129 @@
+// Decoder for the binary Snake board stream (format described in Snake/board_stream.py)
+class SnakeBoardStream {
+    constructor() {
+        this.seq = null;
+        this.nGames = 0;
+        this.fps = 0;
+        this.focused = 0;
+        this.boards = [];
+    }
+
+    // Applies a response of length-prefixed messages. Returns false if the delta chain broke
+    // (caller should then poll again without ?since= to get a keyframe).
+    apply(buffer) {
+        const view = new DataView(buffer);
+        let offset = 0;
+        while (offset + 4 <= view.byteLength) {
+            const length = view.getUint32(offset, true);
+            offset += 4;
+            if (!this._applyMessage(view, offset)) {
+                this.seq = null;
+                return false;
+            }
+            offset += length;
+        }
+        return true;
+    }
+
+    _applyMessage(view, o) {
+        const kind = view.getUint8(o + 1);
+        const seq = view.getUint32(o + 2, true);
+        if (kind === 1 && (this.seq === null || seq !== ((this.seq + 1) >>> 0))) return false;
+
+        this.seq = seq;
+        this.nGames = view.getUint32(o + 6, true);
+        this.fps = view.getUint16(o + 10, true);
+        const nBoards = view.getUint8(o + 12);
+        this.focused = view.getUint8(o + 13);
+        o += 14;
+
+        const boards = [];
+        for (let i = 0; i < nBoards; i++) {
+            const boardKind = view.getUint8(o);
+            const prev = this.boards[i];
+            const board = {
+                score: view.getUint16(o + 1, true),
+                dead: (view.getUint8(o + 3) & 1) === 1,
+                food: view.getUint8(o + 4) === 255 ? null : { x: view.getUint8(o + 4) - 1, y: view.getUint8(o + 5) - 1 },
+                w: prev ? prev.w : 0,
+                h: prev ? prev.h : 0,
+                snake: []
+            };
+            o += 6;
+
+            if (boardKind === 0) {
+                board.w = view.getUint8(o);
+                board.h = view.getUint8(o + 1);
+                const length = view.getUint16(o + 2, true);
+                o += 4;
+                for (let j = 0; j < length; j++, o += 2) {
+                    board.snake.push({ x: view.getUint8(o) - 1, y: view.getUint8(o + 1) - 1 });
+                }
+            } else {
+                if (!prev) return false;
+                const added = view.getUint8(o);
+                const removed = view.getUint16(o + 1, true);
+                o += 3;
+                for (let j = 0; j < added; j++, o += 2) {
+                    board.snake.push({ x: view.getUint8(o) - 1, y: view.getUint8(o + 1) - 1 });
+                }
+                board.snake = board.snake.concat(prev.snake.slice(0, prev.snake.length - removed));
+            }
+            boards.push(board);
+        }
+        this.boards = boards;
+        return true;
+    }
+}
+
+// Draws all boards in a grid on a canvas (Google Snake colors, like the trainer window)
+function drawSnakeBoards(canvas, stream) {
+    const ctx = canvas.getContext('2d');
+    ctx.fillStyle = '#1e1e2e';
+    ctx.fillRect(0, 0, canvas.width, canvas.height);
+    const boards = stream.boards;
+    if (!boards.length) return;
+
+    const cols = Math.ceil(Math.sqrt(boards.length));
+    const rows = Math.ceil(boards.length / cols);
+    const cellW = canvas.width / cols;
+    const cellH = canvas.height / rows;
+
+    boards.forEach((board, i) => {
+        if (!board.w || !board.h) return;
+        const block = Math.min((cellW - 8) / board.w, (cellH - 8) / board.h);
+        const x0 = (i % cols) * cellW + (cellW - block * board.w) / 2;
+        const y0 = Math.floor(i / cols) * cellH + (cellH - block * board.h) / 2;
+
+        ctx.fillStyle = '#a2d149';
+        ctx.fillRect(x0, y0, block * board.w, block * board.h);
+        ctx.fillStyle = '#aad751';
+        for (let r = 0; r < board.h; r++) {
+            for (let c = (r % 2); c < board.w; c += 2) {
+                ctx.fillRect(x0 + c * block, y0 + r * block, block, block);
+            }
+        }
+
+        if (board.food) {
+            ctx.fillStyle = '#e7471d';
+            ctx.beginPath();
+            ctx.arc(x0 + (board.food.x + 0.5) * block, y0 + (board.food.y + 0.5) * block, block * 0.45, 0, Math.PI * 2);
+            ctx.fill();
+        }
+
+        ctx.fillStyle = board.dead ? '#eb5757' : '#4285f4';
+        board.snake.forEach((p, j) => {
+            if (p.x < 0 || p.y < 0 || p.x >= board.w || p.y >= board.h) return;
+            const inset = j === 0 ? 0 : block * 0.1;
+            ctx.fillRect(x0 + p.x * block + inset, y0 + p.y * block + inset, block - inset * 2, block - inset * 2);
+        });
+
+        ctx.strokeStyle = i === stream.focused ? '#f9e2af' : '#578a34';
+        ctx.lineWidth = i === stream.focused ? 3 : 2;
+        ctx.strokeRect(x0, y0, block * board.w, block * board.h);
+
+        ctx.fillStyle = '#ffffff';
+        ctx.font = `${Math.max(10, Math.floor(block * 0.8))}px Arial`;
+        ctx.fillText(`#${i + 1}  ${board.score}`, x0 + 4, y0 + block * 0.9);
+    });
+}
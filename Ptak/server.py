@@ -1,12 +1,39 @@
 import sqlite3
-from flask import Flask, request, jsonify, send_from_directory, render_template_string, Response
+from flask import Flask, request, jsonify, send_from_directory, send_file, render_template_string, Response, g, abort, make_response
+from werkzeug.exceptions import ClientDisconnected
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, NEED_DATA, Data, Epilogue, Field, File
 import os
+import re
 import time
 import io
 import threading
 import subprocess
 import shutil
 import uuid
+import json
+import struct
+import collections
+import bisect
+import contextlib
+import queue
+import array
+import base64
+import binascii
+import gzip
+import hashlib
+import itertools
+import mimetypes
+
+try:
+    from flask_sock import Sock # Opcjonalnie: WebSocket ingest w trybie Flask (pip install flask-sock)
+except ImportError:
+    Sock = None
+
+try:
+    import brotli # Opcjonalnie: kopie .br plikow statycznych (pip install brotli)
+except ImportError:
+    brotli = None
 
 app = Flask(__name__, static_folder=None)
 app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 0
@@ -21,118 +48,1880 @@ CSS_FOLDER = os.path.join(BASE_DIR, 'css')
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
-# Globalne zmienne dla Snake
-snake_state = {
+# --- DATABASE ---
+DB_POOL_SIZE = 16 # Idle connections kept open
+DB_BUSY_TIMEOUT = 10 # Seconds a writer waits for the lock before "database is locked"
+
+class Database:
+    """
+    Small pool of long-lived SQLite connections.
+    Handlers check a connection out instead of opening the file per request, so the per-connection
+    setup (pragmas, schema parsing) and sqlite3's prepared-statement cache are reused. A pool rather
+    than thread-locals because the werkzeug server runs every request on a fresh thread.
+    The database runs in WAL mode (set once in init_db): readers never wait for the writer.
+    """
+
+    def __init__(self, path, size=DB_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self.idle = queue.LifoQueue() # LIFO keeps the hottest connections (and their caches) in use
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=DB_BUSY_TIMEOUT, check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA synchronous = NORMAL") # Durable in WAL mode, no fsync per commit
+        conn.execute("PRAGMA cache_size = -16000") # 16 MB page cache per connection
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute("PRAGMA mmap_size = 67108864")
+        return conn
+
+    @contextlib.contextmanager
+    def connection(self):
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            conn = self._open()
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            if conn.in_transaction:
+                conn.rollback() # Never hand out a connection with an open transaction
+            if self.idle.qsize() < self.size:
+                self.idle.put(conn)
+            else:
+                conn.close()
+
+    @contextlib.contextmanager
+    def transaction(self, immediate=False):
+        """Commits on success, rolls back on error. immediate=True takes the write lock up front."""
+        with self.connection() as conn:
+            if immediate:
+                conn.execute("BEGIN IMMEDIATE")
+            with conn:
+                yield conn
+
+    def query(self, sql, args=()):
+        with self.connection() as conn:
+            return conn.execute(sql, args).fetchall()
+
+    def query_one(self, sql, args=()):
+        with self.connection() as conn:
+            return conn.execute(sql, args).fetchone()
+
+    def execute(self, sql, args=()):
+        # Single write statement in its own transaction, returns lastrowid
+        with self.transaction() as conn:
+            return conn.execute(sql, args).lastrowid
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+db = Database(DB_PATH)
+
+# --- VERSIONED STATE ---
+# In every ETag, so tags from before a restart never match (worker processes get the supervisor's, see asgi.py)
+BOOT_ID = os.environ.get('PTAK_BOOT_ID') or uuid.uuid4().hex[:8]
+LONGPOLL_MAX_WAIT = 25 # Seconds a ?since= request may be held open
+
+def compact_json(data):
+    # Same bytes as jsonify() outside debug mode, for bodies that are built once and reused
+    return app.json.dumps(data, separators=(',', ':'))
+
+class Versioned:
+    """Version counter that pollers can revalidate against (ETag) or wait on (?since=)"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.version = 0
+        self.listeners = [] # Callables run after each change (e.g. to wake asyncio subscribers)
+
+    def bump(self):
+        with self.cond:
+            self.version += 1
+            self.cond.notify_all()
+        self._notify_listeners()
+
+    def _notify_listeners(self):
+        for listener in self.listeners:
+            listener()
+
+    def wait(self, since, timeout):
+        # Returns as soon as the version differs from since (or after timeout)
+        with self.cond:
+            self.cond.wait_for(lambda: self.version != since, timeout=timeout)
+            return self.version
+
+    def etag(self, version):
+        return f"{BOOT_ID}-{version}"
+
+class LiveDocument(Versioned):
+    """
+    Dict-like live state (snake_state, ptak_state). The version only moves when a value
+    actually changes, so an idle kiosk re-posting the same state doesn't wake pollers, and
+    the JSON body is serialized once per version instead of once per poll.
+    """
+
+    def __init__(self, initial):
+        super().__init__()
+        self.data = dict(initial)
+        self.body = None
+        self.event_chunk = None
+        self.local_subscribers = 0 # Open event streams in this process
+        self.remote_subscribers = 0 # In the other worker processes (see shared_state.py)
+
+    @property
+    def subscribers(self):
+        return self.local_subscribers + self.remote_subscribers
+
+    def update(self, changes, now=None):
+        # now: time of the change, passed in so that every worker's copy gets the same timestamp
+        with self.cond:
+            changed = {k: v for k, v in changes.items() if k not in self.data or self.data[k] != v}
+            if not changed:
+                return False
+            self.data.update(changed)
+            self.data['timestamp'] = now or time.time() # Time of the last change
+            self.body = None
+            self.event_chunk = None
+            self.version += 1
+            self.cond.notify_all()
+        self._notify_listeners()
+        return True
+
+    def snapshot(self):
+        # (version, JSON bytes) of the same moment
+        with self.cond:
+            if self.body is None:
+                self.body = compact_json(self.data).encode()
+            return self.version, self.body
+
+    def event(self):
+        # (version, server-sent event) of the same moment; built once and shared by all subscribers
+        with self.cond:
+            if self.event_chunk is None:
+                version, body = self.snapshot()
+                self.event_chunk = f"id: {self.etag(version)}\ndata: ".encode() + body + b'\n\n'
+            return self.version, self.event_chunk
+
+    def restore(self, version, data):
+        # Copy of another process's document (a worker joining, see shared_state.py)
+        with self.cond:
+            self.data = dict(data)
+            self.version = version
+            self.body = None
+            self.event_chunk = None
+            self.cond.notify_all()
+        self._notify_listeners()
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+def versioned_response(versioned, make_body=None):
+    """
+    JSON response for a polled endpoint:
+    If-None-Match with the current ETag -> empty 304; ?since=<version> -> held until the
+    version moves past it (at most ?timeout= / LONGPOLL_MAX_WAIT seconds).
+    make_body() returns the JSON bytes for the current version (not needed for a LiveDocument).
+    """
+    since = request.args.get('since', None, type=int)
+    if since is not None:
+        timeout = min(request.args.get('timeout', LONGPOLL_MAX_WAIT, type=float), LONGPOLL_MAX_WAIT)
+        versioned.wait(since, timeout)
+    if make_body is None:
+        version, body = versioned.snapshot()
+    else:
+        version, body = versioned.version, None
+    etag = versioned.etag(version)
+    headers = {'X-Version': str(version), 'Cache-Control': 'no-cache'} # Browsers revalidate every poll
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304, headers=headers)
+    else:
+        response = Response(body if body is not None else make_body(), mimetype='application/json', headers=headers)
+    response.set_etag(etag)
+    return response
+
+# --- LEADERBOARD CACHE ---
+SCORE_CACHE_TOP = 200 # Best scores kept in memory (pages ask for at most 100)
+SCORE_CACHE_RECENT = 100 # Latest games kept in memory
+SCORE_COLUMNS = ('id', 'name', 'score', 'date', 'video_path', 'image1_path', 'image2_path', 'image3_path',
+                 'poster_path', 'thumb_path')
+
+class ScoreCache:
+    """
+    Top-N (by score) and recent-N (by date) rows of `scores`, kept in memory so the polled
+    leaderboard reads never touch SQLite. Loaded once from the indexes, then kept current by
+    add_score (add) and the media jobs (update). Requests for more rows than are cached
+    return None and the caller falls back to the database.
+    """
+
+    def __init__(self, top_size=SCORE_CACHE_TOP, recent_size=SCORE_CACHE_RECENT):
+        self.top_size = top_size
+        self.recent_size = recent_size
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.top = [] # Rows with score > 0, best first (ties: earlier id first)
+        self.top_keys = [] # (-score, id) per row of self.top, for bisect
+        self.recent = [] # Newest first
+        self.top_complete = False # True if every positive score fits in self.top
+        self.recent_complete = False
+
+    def _load(self):
+        columns = ', '.join(SCORE_COLUMNS)
+        top = db.query(f"SELECT {columns} FROM scores WHERE score > 0 ORDER BY score DESC, id LIMIT ?", (self.top_size + 1,))
+        recent = db.query(f"SELECT {columns} FROM scores ORDER BY date DESC, id DESC LIMIT ?", (self.recent_size + 1,))
+        self.top = [dict(zip(SCORE_COLUMNS, row)) for row in top[:self.top_size]]
+        self.top_keys = [(-row['score'], row['id']) for row in self.top]
+        self.top_complete = len(top) <= self.top_size
+        self.recent = [dict(zip(SCORE_COLUMNS, row)) for row in recent[:self.recent_size]]
+        self.recent_complete = len(recent) <= self.recent_size
+        self.loaded = True
+
+    def _ensure_loaded(self):
+        if not self.loaded:
+            self._load()
+
+    def top_scores(self, limit):
+        with self.lock:
+            self._ensure_loaded()
+            if limit > len(self.top) and not self.top_complete:
+                return None
+            return self.top[:limit]
+
+    def recent_games(self, limit):
+        with self.lock:
+            self._ensure_loaded()
+            if limit > len(self.recent) and not self.recent_complete:
+                return None
+            return self.recent[:limit]
+
+    def latest(self):
+        # Newest game with points by id (score-0 runs have no recording); the recent list is by
+        # date, which is the same order for inserted rows
+        with self.lock:
+            self._ensure_loaded()
+            scored = [row for row in self.recent if row['score'] > 0]
+            if scored:
+                return max(scored, key=lambda row: row['id'])
+            if self.recent_complete:
+                return None
+        row = db.query_one(f"SELECT {', '.join(SCORE_COLUMNS)} FROM scores WHERE score > 0 ORDER BY id DESC LIMIT 1")
+        return dict(zip(SCORE_COLUMNS, row)) if row else None
+
+    def add(self, row):
+        with self.lock:
+            if not self.loaded or any(r['id'] == row['id'] for r in self.recent):
+                return # Loaded from the database (including this row) on first read
+            self.recent.insert(0, row)
+            if len(self.recent) > self.recent_size:
+                self.recent.pop()
+                self.recent_complete = False
+            if row['score'] > 0:
+                key = (-row['score'], row['id'])
+                index = bisect.bisect_left(self.top_keys, key)
+                if index < self.top_size:
+                    self.top_keys.insert(index, key)
+                    self.top.insert(index, row)
+                    if len(self.top) > self.top_size:
+                        self.top_keys.pop()
+                        self.top.pop()
+                        self.top_complete = False
+                else:
+                    self.top_complete = False
+
+    def update(self, score_id, **fields):
+        # A row can be in both lists
+        with self.lock:
+            for row in self.top + self.recent:
+                if row['id'] == score_id:
+                    row.update(fields)
+
+score_cache = ScoreCache()
+scores_version = Versioned() # Bumped on every change to `scores` (ETag of the leaderboard endpoints)
+
+# Stan poczatkowy Snake / Ptak (kazda stacja dostaje swoja kopie, patrz Station)
+SNAKE_STATE_INITIAL = {
     "score": 0,
     "n_games": 0,
     "snake": [],
     "food": None,
     "timestamp": 0
 }
-
-snake_settings = {
+SNAKE_SETTINGS_INITIAL = {
     "fps": 30,
     "paused": False
 }
-snake_commands = []
-latest_snake_frame = None
-snake_frame_event = threading.Event()
+# Binarny strumien plansz Snake: keyframe + delty, format w Snake/board_stream.py
+MAX_BOARD_DELTAS = 600 # Trainer sends a keyframe every 60 messages, this is just a safety cap
+SNAKE_MAX_COMMANDS = 100 # Queued dashboard commands per trainer, the oldest are dropped
+CONTROL_MAX_WAIT = 25 # seconds a long-poll may be held open
 
-# Globalne zmienne dla Ptak (Live State)
-ptak_state = {
+PTAK_STATE_INITIAL = {
     "player_y": 25,
     "pipes": [],
     "score": 0,
-    "landmarks": None, # Pose landmarks
+    "landmarks": None, # Pose landmarks as JSON (older kiosks)
+    "pose": None, # Pose landmarks in the binary format of js/pose_landmarks.js, base64; stored and forwarded as-is
     "timestamp": 0,
     "is_playing": False
 }
-latest_ptak_frame = None
-ptak_frame_event = threading.Event()
 
-latest_ptak_camera_frame = None
-ptak_camera_frame_event = threading.Event()
+# --- LIVE STATE EVENTS ---
+EVENTS_MAX_RATE = 20 # Events per second per subscriber at most; ?max_rate= can ask for fewer
+EVENTS_KEEPALIVE = 15 # Seconds without a change before a comment line is sent (detects closed clients)
+EVENTS_RETRY_MS = 1000 # Reconnect delay the browser's EventSource uses after a dropped connection
+
+def events_params(last_id=None, max_rate=None):
+    """
+    (last version, seconds between events) for an event stream request.
+    Last-Event-ID (sent by EventSource on reconnect) has the ETag format, so a client that
+    reconnects - or switches over from polling with the ETag it last saw - only gets a
+    state it hasn't seen; ids from before a restart never match and the state is resent.
+    """
+    boot_id, _, version = (last_id or '').strip('"').partition('-')
+    last_version = int(version) if boot_id == BOOT_ID and version.isdigit() else None
+    try:
+        rate = min(float(max_rate), EVENTS_MAX_RATE) if max_rate else EVENTS_MAX_RATE
+    except ValueError:
+        rate = EVENTS_MAX_RATE
+    return last_version, 1.0 / max(rate, 0.1)
+
+def state_events(document, last_version, interval):
+    """
+    Server-sent event stream of a LiveDocument: the full state, each time it changes.
+    Updates that arrive faster than the subscriber's rate, or while its socket is still
+    busy with the previous event, are coalesced - the next event is always the latest state.
+    """
+    with document.cond:
+        document.local_subscribers += 1
+    try:
+        yield f"retry: {EVENTS_RETRY_MS}\n\n".encode()
+        version = -1 if last_version is None else last_version
+        sent_at = 0.0
+        while True:
+            delay = sent_at + interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if document.wait(version, EVENTS_KEEPALIVE) == version:
+                yield b': keepalive\n\n'
+                continue
+            version, chunk = document.event()
+            sent_at = time.monotonic()
+            yield chunk
+    finally:
+        with document.cond:
+            document.local_subscribers -= 1
+
+def events_response(document):
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    last_version, interval = events_params(last_id, request.args.get('max_rate'))
+    return Response(state_events(document, last_version, interval), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# --- STREAM BROADCASTER ---
+class FrameBroadcaster:
+    """
+    Latest-frame-wins fan-out for one MJPEG stream.
+    Every published frame gets a sequence number; each viewer remembers the last seq it
+    sent, so no viewer can 'consume' a frame for the others. The multipart chunk is built
+    once per frame and shared by all viewers.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.frame = None
+        self.chunk = None
+        self.seq = 0
+        self.local_viewers = 0 # Open MJPEG responses in this process
+        self.remote_viewers = 0 # In the other worker processes (see shared_state.py)
+        self.listeners = [] # Callables run after each publish (e.g. to wake asyncio viewers)
+
+    @property
+    def viewers(self):
+        return self.local_viewers + self.remote_viewers
+
+    def publish(self, frame):
+        chunk = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + frame + b'\r\n'
+        with self.cond:
+            self.frame = frame
+            self.chunk = chunk
+            self.seq += 1
+            self.cond.notify_all()
+        for listener in self.listeners:
+            listener()
+
+    def wait(self, last_seq, timeout=1.0):
+        # Returns (seq, chunk) as soon as there is a frame newer than last_seq, or the current one on timeout
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq != last_seq, timeout=timeout)
+            return self.seq, self.chunk
+
+    def frames(self):
+        # MJPEG generator; the viewer is counted for as long as the response is open
+        with self.cond:
+            self.local_viewers += 1
+        try:
+            seq = -1
+            while True:
+                seq, chunk = self.wait(seq)
+                # On timeout this resends the last frame as a keepalive
+                if chunk:
+                    yield chunk
+        finally:
+            with self.cond:
+                self.local_viewers -= 1
+
+    def response(self):
+        return Response(self.frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+# Jeden broadcaster na strumien w kazdej stacji (viewer counts tell senders to throttle or stop streaming)
+STREAM_NAMES = ("snake", "ptak", "ptak_camera")
+
+def ingest_frame(station, stream, data, header=None):
+    # Through the state backend: with several worker processes the frame also has to reach the
+    # recorder and the viewers in the other processes
+    shared.frame(station, stream, data, header)
+
+def apply_frame(station, stream, data, header=None):
+    # In the process that owns the recorders; data is None when only the stats are passed on
+    if header:
+        record_ingest_stats(station.ingest_stats[stream], *header)
+    if data is None:
+        return
+    if stream == 'ptak_camera':
+        # Write to recorder if active
+        station.recorder.write(data)
+    station.streams[stream].publish(data)
+
+# Persistent WebSocket senders prefix every JPEG with: u32 seq, f64 timestamp (ms, sender clock)
+WS_FRAME_HEADER = struct.Struct('<Id')
+
+def record_ingest_stats(stats, seq, timestamp):
+    if stats['last_seq'] is not None and seq > stats['last_seq'] + 1:
+        stats['lost'] += seq - stats['last_seq'] - 1
+    stats['last_seq'] = seq
+    stats['frames'] += 1
+    # Only meaningful when the sender's clock is in sync (same box / NTP)
+    latency = time.time() * 1000 - timestamp
+    stats['latency_ms'] = latency if stats['frames'] == 1 else stats['latency_ms'] * 0.9 + latency * 0.1
+
+def ingest_ws_message(station, stream, data):
+    if len(data) <= WS_FRAME_HEADER.size:
+        return False
+    ingest_frame(station, stream, data[WS_FRAME_HEADER.size:], WS_FRAME_HEADER.unpack_from(data))
+    return True
+
+def frame_accepted(station, stream):
+    # Senders read X-Stream-Viewers to know if anyone is watching
+    return "OK", 200, {'X-Stream-Viewers': str(station.streams[stream].viewers)}
 
 # --- STREAM RECORDER ---
+RECORD_FPS = 25 # Output frame rate; frames are placed on this grid by their arrival time
+RECORD_QUEUE_SIZE = 50 # Frames buffered for ffmpeg (~2s), the oldest is dropped when full
+RECORD_MAX_REPEAT = 50 # Cap on frames repeated to fill a gap in the input (~2s)
+RECORD_STOP_TIMEOUT = 5 # Seconds to wait for the writer and ffmpeg to finish
+RECORD_PREROLL = 3.0 # Seconds of camera frames kept in memory and put at the start of a recording
+RECORD_PREROLL_MAX_BYTES = 16 * 1024 * 1024 # Hard cap on the pre-roll buffer
+# 'copy': the camera JPEGs are muxed into .mkv as they are (no encoding during play), and only
+# recordings linked to a score are transcoded to MP4 later; 'x264': encode to MP4 live (old behaviour)
+RECORD_MODE = 'copy'
+
+# Background media jobs (transcodes, posters, thumbnails)
+MEDIA_WORKERS = 2 # Jobs running at once
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_DELAY = 10 # Seconds, times the attempt number
+JOB_POLL_INTERVAL = 5 # Seconds; workers are woken directly on enqueue, this only catches missed wakeups
+THUMB_WIDTH = 320
+
 class StreamRecorder:
-    def __init__(self):
+    """
+    Records the camera stream to MP4 with ffmpeg.
+    write() only timestamps the frame and puts it on a bounded queue, so ingest never waits
+    for the encoder; a writer thread per recording feeds ffmpeg. If ffmpeg falls behind the
+    oldest queued frames are dropped. Frames are placed on a constant RECORD_FPS grid by
+    their arrival time (repeated or skipped as needed), so the video plays at real speed
+    whatever rate the camera frames came in at.
+
+    The last RECORD_PREROLL seconds of frames are always kept in memory, and the next ffmpeg
+    process is started ahead of time (it just waits on stdin), so start() only hands the
+    pre-roll to a new writer thread and the first moments of a run are not lost.
+    """
+
+    def __init__(self, fps=RECORD_FPS, queue_size=RECORD_QUEUE_SIZE, preroll=RECORD_PREROLL):
+        self.fps = fps
+        self.queue_size = queue_size
+        self.queue_limit = queue_size
         self.proc = None
+        self.writer = None
+        self.warm = None # (proc, filename) of the prewarmed ffmpeg
+        self.queue = collections.deque()
+        self.preroll = preroll
+        self.ring = collections.deque() # (arrival time, frame) for the pre-roll
+        self.ring_bytes = 0
         self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
         self.current_file = None
+        self.finalizing = set() # Files stop() is still waiting on (writer draining, ffmpeg closing)
+        self.stats = {}
 
-    def start(self, filename):
-        with self.lock:
-            if self.proc:
-                self.stop()
-            
-            self.current_file = filename
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            
-            # FFmpeg command to read MJPEG from pipe and write MP4
-            # -f image2pipe: Input format
-            # -vcodec mjpeg: Input codec
-            # -r 25: Assume 25 FPS (matches client interval)
-            # -i -: Read from stdin
+    @staticmethod
+    def new_filename():
+        # Use unique filename to avoid conflicts
+        extension = '.mkv' if RECORD_MODE == 'copy' else '.mp4'
+        return f"rec_{int(time.time())}_{str(uuid.uuid4())[:8]}{extension}"
+
+    def _spawn(self, filename):
+        filepath = os.path.join(UPLOAD_FOLDER, filename)
+
+        # FFmpeg command to read MJPEG from pipe
+        # -f image2pipe: Input format
+        # -vcodec mjpeg: Input codec
+        # -r: Pipe frame rate, the writer thread keeps the input on this grid
+        # -i -: Read from stdin
+        if RECORD_MODE == 'copy':
+            # -c:v copy: Keep the JPEGs, Matroska stays playable even if ffmpeg is killed
+            output = ['-c:v', 'copy', filepath]
+        else:
             # -c:v libx264: Output codec
             # -preset ultrafast: Low CPU usage
             # -pix_fmt yuv420p: Compatibility
-            cmd = [
-                'ffmpeg', '-y', 
-                '-f', 'image2pipe', 
-                '-vcodec', 'mjpeg', 
-                '-r', '25', 
-                '-i', '-', 
-                '-c:v', 'libx264', 
-                '-preset', 'ultrafast', 
-                '-pix_fmt', 'yuv420p', 
-                filepath
-            ]
-            
+            output = ['-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', filepath]
+        cmd = [
+            'ffmpeg', '-y',
+            '-f', 'image2pipe',
+            '-vcodec', 'mjpeg',
+            '-r', str(self.fps),
+            '-i', '-'
+        ] + output
+        return subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def prewarm(self):
+        # Start the ffmpeg for the next recording; it writes nothing until frames arrive
+        with self.lock:
+            if self.warm:
+                return
+        filename = self.new_filename()
+        try:
+            proc = self._spawn(filename)
+        except Exception as e:
+            print(f"Failed to prewarm recorder: {e}")
+            return
+        with self.lock:
+            if self.warm is None:
+                self.warm = (proc, filename)
+                return
+        proc.stdin.close() # Lost a race with another prewarm
+        proc.wait()
+
+    def start(self, preroll=None):
+        """Starts a new recording and returns its filename (None on failure)"""
+        started = time.perf_counter()
+        self.stop()
+        preroll = self.preroll if preroll is None else max(0.0, min(preroll, self.preroll))
+
+        with self.lock:
+            warm, self.warm = self.warm, None
+        if warm and warm[0].poll() is None:
+            proc, filename = warm
+        else:
+            warm = None
+            filename = self.new_filename()
             try:
-                self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.DEVNULL)
-                print(f"Recording started: {filepath}")
+                proc = self._spawn(filename)
             except Exception as e:
                 print(f"Failed to start recording: {e}")
+                return None
+
+        with self.lock:
+            cutoff = time.monotonic() - preroll
+            self.queue = collections.deque(item for item in self.ring if item[0] >= cutoff)
+            self.queue_limit = self.queue_size + len(self.queue)
+            self.proc = proc
+            self.current_file = filename
+            self.stats = {'queued': len(self.queue), 'dropped': 0, 'written': 0, 'repeated': 0, 'skipped': 0,
+                          'max_queue': len(self.queue), 'preroll_frames': len(self.queue),
+                          'prewarmed': warm is not None}
+            self.writer = threading.Thread(target=self._write_loop, args=(proc, self.queue, self.stats), daemon=True)
+            self.writer.start()
+            self.stats['start_ms'] = (time.perf_counter() - started) * 1000
+        print(f"Recording started: {filename} ({self.stats['start_ms']:.1f} ms, {self.stats['preroll_frames']} pre-roll frames)")
+        threading.Thread(target=self.prewarm, daemon=True).start()
+        return filename
 
     def write(self, frame_data):
-        # Write frame to FFmpeg stdin
-        # Only write if process is running
-        if self.proc and self.proc.stdin:
+        # Called from the ingest path: never blocks on ffmpeg
+        arrived = time.monotonic()
+        with self.lock:
+            self.ring.append((arrived, frame_data))
+            self.ring_bytes += len(frame_data)
+            while self.ring and (self.ring[0][0] < arrived - self.preroll or self.ring_bytes > RECORD_PREROLL_MAX_BYTES):
+                self.ring_bytes -= len(self.ring.popleft()[1])
+
+            if not self.proc:
+                return False
+            if len(self.queue) >= self.queue_limit:
+                self.queue.popleft()
+                self.stats['dropped'] += 1
+            self.queue.append((arrived, frame_data))
+            self.stats['queued'] += 1
+            self.stats['max_queue'] = max(self.stats['max_queue'], len(self.queue))
+            self.ready.notify()
+        return True
+
+    def _write_loop(self, proc, frames, stats):
+        first = None
+        slot = 0 # Next output frame index
+        last_frame = None
+        try:
+            while True:
+                with self.lock:
+                    self.ready.wait_for(lambda: frames or self.proc is not proc)
+                    if not frames:
+                        break # Stopped and drained
+                    arrived, frame = frames.popleft()
+
+                if first is None:
+                    first = arrived
+                target = int((arrived - first) * self.fps)
+                if target < slot:
+                    stats['skipped'] += 1 # Same grid slot as the previous frame
+                    continue
+                # Hold the previous frame over a gap in the input
+                repeats = min(target - slot, RECORD_MAX_REPEAT) if last_frame else 0
+                for _ in range(repeats):
+                    proc.stdin.write(last_frame)
+                proc.stdin.write(frame)
+                proc.stdin.flush()
+                stats['repeated'] += repeats
+                stats['written'] += 1
+                slot = target + 1
+                last_frame = frame
+        except (BrokenPipeError, OSError, ValueError):
+            print("Recording pipe broken, stopping.")
+            with self.lock:
+                if self.proc is proc:
+                    self.proc = None
+            proc.kill()
+            proc.wait()
+        finally:
             try:
-                # Use a separate thread or non-blocking write if possible, 
-                # but for now we trust OS pipe buffer.
-                # Just catch broken pipe errors to avoid crashing server.
-                self.proc.stdin.write(frame_data)
-                self.proc.stdin.flush()
-            except BrokenPipeError:
-                print("Recording pipe broken, stopping.")
-                self.stop()
-            except Exception as e:
-                # Ignore other errors during write to avoid spamming logs or crashing
+                proc.stdin.close()
+            except Exception:
                 pass
 
     def stop(self):
         with self.lock:
-            if self.proc:
+            proc, writer, filename = self.proc, self.writer, self.current_file
+            self.proc = None
+            self.writer = None
+            if proc is not None:
+                self.finalizing.add(filename)
+            self.ready.notify_all()
+        try:
+            # The writer drains what is still queued, then closes ffmpeg's stdin
+            deadline = time.monotonic() + RECORD_STOP_TIMEOUT
+            if writer:
+                writer.join(timeout=RECORD_STOP_TIMEOUT)
+            if proc is None:
+                return None
+            try:
+                proc.wait(timeout=max(0.1, deadline - time.monotonic()))
+            except Exception as e:
+                print(f"Error stopping recording: {e}")
+                proc.kill()
+                proc.wait()
+            print(f"Recording stopped: {self.stats}")
+            return filename
+        finally:
+            with self.lock:
+                self.finalizing.discard(filename)
+
+    def is_recording(self, filename):
+        # Also while stop() is finishing the file: it is complete only after ffmpeg exits
+        with self.lock:
+            return (self.proc is not None and self.current_file == filename) or filename in self.finalizing
+
+    def close(self):
+        # Stops a running recording and the prewarmed ffmpeg (the station is being dropped)
+        self.stop()
+        with self.lock:
+            warm, self.warm = self.warm, None
+            self.ring.clear()
+            self.ring_bytes = 0
+        if warm:
+            warm[0].stdin.close()
+            warm[0].wait()
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, recording=self.proc is not None, queue=len(self.queue), file=self.current_file,
+                        warm=self.warm is not None, preroll_seconds=self.preroll,
+                        preroll_buffered=len(self.ring), preroll_bytes=self.ring_bytes)
+
+# --- SHARED STATE ---
+STATE_OPS = {} # name -> (func, replicate)
+
+def state_op(name, replicate=True):
+    """
+    Registers a change of the live state as a named op, run with shared.apply(name, station, *args).
+    func gets (station, *args); station is None for ops that aren't per station. With several
+    worker processes (shared_state.py) a replicated op runs in every process in the same order,
+    so all copies of the state - and their versions, i.e. ETags and event ids - stay equal.
+    replicate=False ops run only in the primary process, which owns the recorders, telemetry
+    and media jobs. Arguments and results have to be picklable.
+    """
+    def register(func):
+        STATE_OPS[name] = (func, replicate)
+        return func
+    return register
+
+class LocalState:
+    """
+    State backend of a single server process (the Flask server, asgi.py without --workers):
+    ops run right here. shared_state.py has the multi-process backends with the same methods.
+    """
+    primary = True # Owns the recorders, telemetry and media jobs
+
+    def apply(self, op, station, *args):
+        return STATE_OPS[op][0](station, *args)
+
+    def frame(self, station, stream, data, header=None):
+        apply_frame(station, stream, data, header)
+
+    def open_station(self, name):
+        return stations.get(name)
+
+shared = LocalState()
+
+@state_op('open_station')
+def open_station_op(station, name):
+    return stations.get(name) is not None
+
+@state_op('drop_station')
+def drop_station_op(station, name):
+    stations.remove(name)
+
+def state_snapshot():
+    return {
+        'scores_version': scores_version.version,
+        'stations': {station.name: station.snapshot() for station in stations.all()}
+    }
+
+def restore_state(snapshot):
+    with scores_version.cond:
+        scores_version.version = snapshot['scores_version']
+    for name, station_snapshot in snapshot['stations'].items():
+        stations.get(name).restore(station_snapshot)
+
+def watcher_counts():
+    # {(station, 'stream' / 'events', name): viewers / subscribers} open in this process
+    counts = {}
+    for station in stations.all():
+        for name, broadcaster in station.streams.items():
+            if broadcaster.local_viewers:
+                counts[(station.name, 'stream', name)] = broadcaster.local_viewers
+        for name, document in station.live_documents.items():
+            if document.local_subscribers:
+                counts[(station.name, 'events', name)] = document.local_subscribers
+    return counts
+
+def set_remote_watchers(counts):
+    # Viewers / subscribers of the other processes, in the format of watcher_counts()
+    for station in stations.all():
+        for name, broadcaster in station.streams.items():
+            broadcaster.remote_viewers = counts.get((station.name, 'stream', name), 0)
+        for name, document in station.live_documents.items():
+            document.remote_subscribers = counts.get((station.name, 'events', name), 0)
+
+# --- UPLOADS ---
+UPLOAD_MAX_SIZE = 512 * 1024 * 1024 # Bytes per uploaded video
+UPLOAD_CHUNK = 256 * 1024 # Bytes read from the request and written per step
+
+def fsync_dir(path):
+    # Makes a rename in the directory durable (no directory handles on Windows)
+    if os.name != 'nt':
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+def upload_chunks(req, field):
+    """
+    The uploaded file of a request, chunk by chunk as it arrives: the `field` part of a
+    multipart/form-data body, or the raw body for any other Content-Type. Nothing is spooled
+    (unlike request.files), so memory use doesn't grow with the file.
+    """
+    mimetype, options = parse_options_header(req.headers.get('Content-Type', ''))
+    if mimetype != 'multipart/form-data':
+        yield from iter(lambda: req.stream.read(UPLOAD_CHUNK), b'')
+        return
+    decoder = MultipartDecoder(options.get('boundary', '').encode())
+    current = None
+    while True:
+        data = req.stream.read(UPLOAD_CHUNK)
+        decoder.receive_data(data or None)
+        event = decoder.next_event()
+        while event is not NEED_DATA:
+            if isinstance(event, Epilogue):
+                return
+            if isinstance(event, (Field, File)):
+                current = event.name
+            elif isinstance(event, Data) and current == field:
+                if event.data:
+                    yield event.data
+                if not event.more_data:
+                    return
+            event = decoder.next_event()
+        if not data:
+            return
+
+def receive_upload(chunks, path, limit=UPLOAD_MAX_SIZE):
+    """
+    Writes the chunks to path and fsyncs it. Returns the size; 0 (nothing written) for an empty
+    upload, None if it went over limit. A failed, oversized or cut-off upload leaves no file behind.
+    """
+    size = 0
+    try:
+        with open(path, 'wb') as f:
+            for chunk in chunks:
+                size += len(chunk)
+                if size > limit:
+                    break
+                f.write(chunk)
+            else:
+                f.flush()
+                os.fsync(f.fileno()) # On disk before anything renames or links it
+        if 0 < size <= limit:
+            return size
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(path)
+        raise
+    os.remove(path)
+    return 0 if size == 0 else None
+
+# --- MEDIA JOBS ---
+def low_priority():
+    # Popen kwargs so background ffmpeg never competes with the live game
+    if os.name == 'nt':
+        return {'creationflags': subprocess.BELOW_NORMAL_PRIORITY_CLASS}
+    return {'preexec_fn': lambda: os.nice(10)}
+
+def run_ffmpeg(args):
+    result = subprocess.run(['ffmpeg', '-y', '-loglevel', 'error'] + args, stdin=subprocess.DEVNULL,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, **low_priority())
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg exit {result.returncode}: {result.stderr.decode(errors='replace')[-300:]}")
+
+def set_score_paths(score_id, **paths):
+    previous = db.query_one(f"SELECT {', '.join(paths)} FROM scores WHERE id = ?", (score_id,))
+    db.execute(f"UPDATE scores SET {', '.join(k + ' = ?' for k in paths)} WHERE id = ?",
+               list(paths.values()) + [score_id])
+    media_catalogue.paths_changed(score_id, paths, dict(zip(paths, previous or ())))
+    shared.apply('score_paths', None, score_id, paths)
+
+@state_op('score_paths')
+def cache_score_paths(station, score_id, paths):
+    score_cache.update(score_id, **paths)
+    scores_version.bump()
+
+@state_op('score_added')
+def cache_new_score(station, row):
+    score_cache.add(row)
+    scores_version.bump()
+
+class MediaJobQueue:
+    """
+    Persistent job queue in the `jobs` table, worked off by a few background threads.
+    Jobs survive a server restart (anything left 'running' is queued again on start) and
+    are retried up to JOB_MAX_ATTEMPTS times. Handlers are registered per kind with
+    @media_jobs.handler('kind') and get (score_id, payload); their return value is stored
+    as the job result.
+    """
+
+    def __init__(self, workers=MEDIA_WORKERS):
+        self.workers = workers
+        self.handlers = {}
+        self.threads = []
+        self.wake = threading.Event()
+
+    def handler(self, kind):
+        def register(func):
+            self.handlers[kind] = func
+            return func
+        return register
+
+    def enqueue(self, kind, score_id=None, payload=None, conn=None):
+        """Adds a job and returns its id. With conn the job is part of the caller's transaction;
+        call notify() after committing it."""
+        sql = "INSERT INTO jobs (kind, score_id, payload, created) VALUES (?, ?, ?, ?)"
+        args = (kind, score_id, json.dumps(payload or {}), time.time())
+        if conn is not None:
+            return conn.execute(sql, args).lastrowid
+        job_id = db.execute(sql, args)
+        self.notify()
+        return job_id
+
+    def notify(self):
+        shared.apply('wake_media_jobs', None) # The workers run in the primary process
+
+    def start(self):
+        db.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"media-job-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _claim(self):
+        with db.transaction(immediate=True) as conn: # Only one worker can pick a given job
+            row = conn.execute("SELECT id, kind, score_id, payload, attempts FROM jobs "
+                               "WHERE status = 'queued' AND run_after <= ? ORDER BY id LIMIT 1", (time.time(),)).fetchone()
+            if row:
+                conn.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, started = ? WHERE id = ?",
+                             (time.time(), row[0]))
+            return row
+
+    def _finish(self, job_id, status, result=None, error=None, retry_in=0):
+        now = time.time()
+        db.execute("UPDATE jobs SET status = ?, result = ?, error = ?, finished = ?, run_after = ? WHERE id = ?",
+                   (status, json.dumps(result) if result is not None else None, error, now, now + retry_in, job_id))
+
+    def _work(self):
+        while True:
+            self.wake.clear() # Cleared before looking, so an enqueue during the query is not missed
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                print(f"Media job queue error: {e}")
+                job = None
+            if job is None:
+                self.wake.wait(JOB_POLL_INTERVAL)
+                continue
+
+            job_id, kind, score_id, payload, attempts = job
+            started = time.time()
+            try:
+                result = self.handlers[kind](score_id, json.loads(payload or '{}'))
+                self._finish(job_id, 'done', result)
+                print(f"Media job {job_id} ({kind}) done in {time.time() - started:.1f}s")
+            except Exception as e:
+                retry = attempts + 1 < JOB_MAX_ATTEMPTS
+                print(f"Media job {job_id} ({kind}) failed{', will retry' if retry else ''}: {e}")
+                self._finish(job_id, 'queued' if retry else 'failed', error=str(e), retry_in=JOB_RETRY_DELAY * (attempts + 1))
+
+    def get(self, job_id):
+        jobs = self.list(job_id=job_id)
+        return jobs[0] if jobs else None
+
+    def list(self, job_id=None, score_id=None, status=None, limit=50):
+        query, args = "SELECT id, kind, score_id, status, attempts, error, result, created, started, finished FROM jobs WHERE 1=1", []
+        for column, value in (('id', job_id), ('score_id', score_id), ('status', status)):
+            if value is not None:
+                query += f" AND {column} = ?"
+                args.append(value)
+        query += " ORDER BY id DESC LIMIT ?"
+        args.append(limit)
+        rows = db.query(query, args)
+        return [{
+            'id': row[0],
+            'kind': row[1],
+            'score_id': row[2],
+            'status': row[3],
+            'attempts': row[4],
+            'error': row[5],
+            'result': json.loads(row[6]) if row[6] else None,
+            'created': row[7],
+            'started': row[8],
+            'finished': row[9]
+        } for row in rows]
+
+media_jobs = MediaJobQueue()
+
+@state_op('wake_media_jobs', replicate=False)
+def wake_media_jobs(station):
+    media_jobs.wake.set()
+
+@media_jobs.handler('link_recording')
+def link_recording_job(score_id, payload):
+    # Server-side recording of a run -> game_<id>.mp4 (copy-mode .mkv recordings are transcoded here)
+    src_path = os.path.join(UPLOAD_FOLDER, payload['filename'])
+    if any(station.recorder.is_recording(payload['filename']) for station in stations.all()):
+        raise RuntimeError("Recording still in progress") # Retried after JOB_RETRY_DELAY
+    out_filename = f"game_{score_id}.mp4"
+    out_path = os.path.join(UPLOAD_FOLDER, out_filename)
+    if not os.path.exists(src_path):
+        if os.path.exists(out_path): # Finished before a restart, only the DB update is missing
+            src_path = out_path
+        else:
+            raise FileNotFoundError(f"Recording file not found: {src_path}")
+
+    if src_path.endswith('.mkv'):
+        part_path = out_path + '.part'
+        run_ffmpeg([
+            '-i', src_path,
+            '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p',
+            '-movflags', '+faststart', # moov atom first: playback starts before the whole file is loaded
+            '-threads', '2',
+            '-f', 'mp4', part_path
+        ])
+        os.replace(part_path, out_path)
+        os.remove(src_path)
+    elif src_path != out_path:
+        # Use shutil.move for cross-fs safety
+        shutil.move(src_path, out_path)
+
+    video_url = f"/uploads/{out_filename}"
+    set_score_paths(score_id, video_path=video_url)
+    media_jobs.enqueue('poster', score_id, {'filename': out_filename})
+    return {'video_path': video_url}
+
+@media_jobs.handler('attach_upload')
+def attach_upload_job(score_id, payload):
+    # Client-side upload already saved under a temporary name by upload_media
+    filename = f"game_{score_id}.webm"
+    part_path = os.path.join(UPLOAD_FOLDER, payload['filename'])
+    if os.path.exists(part_path):
+        os.replace(part_path, os.path.join(UPLOAD_FOLDER, filename)) # Complete and fsync'd by receive_upload
+        fsync_dir(UPLOAD_FOLDER)
+    video_url = f"/uploads/{filename}"
+    set_score_paths(score_id, video_path=video_url)
+    media_jobs.enqueue('poster', score_id, {'filename': filename})
+    return {'video_path': video_url}
+
+@media_jobs.handler('poster')
+def poster_job(score_id, payload):
+    # Poster frame (full size) + small thumbnail, so pages don't have to load the video to preview it
+    video_path = os.path.join(UPLOAD_FOLDER, payload['filename'])
+    poster = f"game_{score_id}_poster.jpg"
+    thumb = f"game_{score_id}_thumb.jpg"
+    poster_path = os.path.join(UPLOAD_FOLDER, poster)
+    for seek in ('1', '0'): # Short clips have no frame at 1s
+        try:
+            run_ffmpeg(['-ss', seek, '-i', video_path, '-frames:v', '1', '-q:v', '3', poster_path])
+        except RuntimeError:
+            if seek == '0':
+                raise
+        if os.path.exists(poster_path) and os.path.getsize(poster_path) > 0:
+            break
+    else:
+        raise RuntimeError(f"No frame could be extracted from {payload['filename']}")
+    run_ffmpeg(['-i', poster_path, '-vf', f"scale={THUMB_WIDTH}:-2", '-q:v', '5', os.path.join(UPLOAD_FOLDER, thumb)])
+
+    paths = {'poster_path': f"/uploads/{poster}", 'thumb_path': f"/uploads/{thumb}"}
+    set_score_paths(score_id, **paths)
+    return paths
+
+# --- MEDIA CATALOGUE ---
+MEDIA_PAGE_MAX = 200 # Cap on ?limit= of /api/media
+MEDIA_RECONCILE_BATCH = 200 # Catalogue rows / directory entries checked per reconciler step
+MEDIA_RECONCILE_PAUSE = 0.05 # Seconds between steps of a pass, so a big folder never hogs the disk
+MEDIA_RECONCILE_INTERVAL = 60 # Seconds between passes
+MEDIA_ORPHAN_AGE = 3600 # Seconds an unreferenced file may wait for its score (link_recording) before it is orphaned
+MEDIA_RECORDING_KEEP = 6 * 3600 # Seconds an orphaned camera recording (score-0 or abandoned run) is kept before it is deleted
+MEDIA_VIDEO_EXTENSIONS = ('.mp4', '.webm', '.mkv')
+MEDIA_PATH_COLUMNS = ('video_path', 'image1_path', 'image2_path', 'image3_path', 'poster_path', 'thumb_path')
+MEDIA_DERIVED_COLUMNS = ('poster_path', 'thumb_path') # Files made from a video, not listed on their own
+
+def probe_duration(path):
+    # Seconds, or None (no ffprobe, unreadable file)
+    try:
+        result = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', path],
+                                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                timeout=30, **low_priority())
+        return float(result.stdout.strip())
+    except (OSError, ValueError, subprocess.SubprocessError):
+        return None
+
+def media_kind(filename):
+    return 'video' if filename.lower().endswith(MEDIA_VIDEO_EXTENSIONS) else 'image'
+
+class MediaCatalogue:
+    """
+    The `media` table: one row per file in uploads/ (size, duration, type, thumbnail, created).
+    The media page is an indexed keyset-paginated query on it, so a page costs the same however
+    many files there are, and no request touches the filesystem. Rows are written when a score
+    gets a file (set_score_paths; the file it replaces becomes an 'orphan') and removed by
+    delete_media. A background reconciler walks the
+    table and the folder MEDIA_RECONCILE_BATCH entries at a time: files that disappeared are
+    marked 'missing' (and unlinked from their score), files no score references are 'orphan';
+    orphaned camera recordings are deleted after MEDIA_RECORDING_KEEP.
+    """
+
+    def __init__(self):
+        self.row_cursor = 0 # Last media id checked by the running pass
+        self.entries = None # os.scandir iterator of the running pass
+        self.thread = None
+
+    def record(self, score_id, filename, derived=False):
+        path = os.path.join(UPLOAD_FOLDER, filename)
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+        kind = media_kind(filename)
+        duration = probe_duration(path) if st and kind == 'video' and not derived else None
+        db.execute("""INSERT INTO media (filename, score_id, kind, derived, size, mtime, duration, created, status)
+                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                      ON CONFLICT (filename) DO UPDATE SET score_id = excluded.score_id, kind = excluded.kind,
+                        derived = excluded.derived, size = excluded.size, mtime = excluded.mtime,
+                        duration = excluded.duration, status = excluded.status""",
+                   (filename, score_id, kind, int(derived), st.st_size if st else 0, st.st_mtime if st else 0,
+                    duration, st.st_mtime if st else time.time(), 'ok' if st else 'missing'))
+
+    def paths_changed(self, score_id, paths, previous):
+        # Called by set_score_paths; None values (unlinked files) are handled by whoever unlinked them
+        for column, url in paths.items():
+            old = previous.get(column)
+            if url and old and old != url and old.startswith('/uploads/'):
+                # Replaced: the old file stays on disk, now without a game
+                db.execute("UPDATE media SET score_id = NULL, derived = 0, status = 'orphan' WHERE filename = ? AND score_id = ?",
+                           (os.path.basename(old), score_id))
+            if column in MEDIA_PATH_COLUMNS and url and url.startswith('/uploads/'):
+                self.record(score_id, os.path.basename(url), derived=column in MEDIA_DERIVED_COLUMNS)
+        if paths.get('thumb_path'):
+            db.execute("UPDATE media SET thumbnail = ? WHERE score_id = ? AND derived = 0 AND kind = 'video'",
+                       (paths['thumb_path'], score_id))
+
+    def page(self, status='ok', kind=None, cursor=None, limit=50):
+        """Newest first; pass next_cursor back as cursor for the following page"""
+        sql = """SELECT m.id, m.filename, m.kind, m.size, m.duration, m.thumbnail, m.created, m.status,
+                        s.id, s.name, s.score, s.date
+                 FROM media m LEFT JOIN scores s ON s.id = m.score_id
+                 WHERE m.status = ? AND m.derived = 0 AND m.id < ?"""
+        args = [status, cursor if cursor is not None else 2 ** 63 - 1]
+        if kind:
+            sql += " AND m.kind = ?"
+            args.append(kind)
+        rows = db.query(sql + " ORDER BY m.id DESC LIMIT ?", args + [limit + 1])
+        items = [{
+            'media_id': row[0],
+            'filename': row[1],
+            'type': row[2],
+            'size': row[3],
+            'duration': row[4],
+            'thumbnail': row[5],
+            'created': row[6],
+            'status': row[7],
+            'id': row[8], # Score
+            'name': row[9],
+            'score': row[10],
+            'date': row[11]
+        } for row in rows[:limit]]
+        return {'items': items, 'next_cursor': items[-1]['media_id'] if len(rows) > limit else None}
+
+    def _unlink(self, score_id, filename):
+        # Clears every path of the score that points to the file (leaderboards stop linking to it)
+        if score_id is None:
+            return
+        url = f"/uploads/{filename}"
+        row = db.query_one(f"SELECT {', '.join(MEDIA_PATH_COLUMNS)} FROM scores WHERE id = ?", (score_id,))
+        cleared = {column: None for column, value in zip(MEDIA_PATH_COLUMNS, row or ()) if value == url}
+        if cleared:
+            set_score_paths(score_id, **cleared)
+
+    def delete(self, filename):
+        """Removes the file and its row, unlinks it from its score; a video takes its poster and thumbnail along"""
+        row = db.query_one("SELECT score_id, kind, derived FROM media WHERE filename = ?", (filename,))
+        path = os.path.join(UPLOAD_FOLDER, filename)
+        if row is None and not os.path.isfile(path):
+            return False
+        names = [filename]
+        if row and row[1] == 'video' and not row[2] and row[0] is not None:
+            names += [name for name, in db.query("SELECT filename FROM media WHERE score_id = ? AND derived = 1", (row[0],))]
+        for name in names:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(UPLOAD_FOLDER, name))
+            if row:
+                self._unlink(row[0], name)
+            db.execute("DELETE FROM media WHERE filename = ?", (name,))
+        return True
+
+    def start(self):
+        self.thread = threading.Thread(target=self._reconcile_loop, name="media-reconciler", daemon=True)
+        self.thread.start()
+
+    def _reconcile_loop(self):
+        while True:
+            try:
+                more = self.reconcile_step()
+            except Exception as e:
+                print(f"Media reconciler error: {e}")
+                more = False
+            time.sleep(MEDIA_RECONCILE_PAUSE if more else MEDIA_RECONCILE_INTERVAL)
+
+    def reconcile_step(self):
+        """One batch of catalogue rows and one batch of directory entries; False once the pass is complete"""
+        rows = db.query("SELECT id, filename, score_id, kind, derived, size, mtime, status FROM media "
+                        "WHERE id > ? ORDER BY id LIMIT ?", (self.row_cursor, MEDIA_RECONCILE_BATCH))
+        self.row_cursor = rows[-1][0] if len(rows) == MEDIA_RECONCILE_BATCH else 0
+        gone, missing, checked = [], [], []
+        for media_id, filename, score_id, kind, derived, size, mtime, status in rows:
+            try:
+                st = os.stat(os.path.join(UPLOAD_FOLDER, filename))
+            except FileNotFoundError:
+                if score_id is None:
+                    gone.append((media_id,)) # An orphan that is gone for good
+                elif status != 'missing':
+                    missing.append((media_id, score_id, filename))
+                continue
+            if score_id is None and self._expired_recording(filename, st):
                 try:
-                    if self.proc.stdin:
-                        self.proc.stdin.close()
-                    self.proc.wait(timeout=2)
-                except Exception as e:
-                    print(f"Error stopping recording: {e}")
-                    if self.proc:
-                        self.proc.kill()
-                
-                self.proc = None
-                print("Recording stopped")
-                return self.current_file
-            return None
-
-recorder = StreamRecorder()
+                    os.remove(os.path.join(UPLOAD_FOLDER, filename))
+                    gone.append((media_id,))
+                except OSError as e:
+                    print(f"Media reconciler: could not remove {filename}: {e}")
+                continue
+            if status in ('unchecked', 'missing') or st.st_size != size or st.st_mtime != mtime:
+                duration = probe_duration(os.path.join(UPLOAD_FOLDER, filename)) if kind == 'video' and not derived else None
+                checked.append((st.st_size, st.st_mtime, duration, 'ok' if score_id is not None else 'orphan', media_id))
+        if gone or missing or checked:
+            with db.transaction() as conn: # One commit per batch
+                conn.executemany("DELETE FROM media WHERE id = ?", gone)
+                conn.executemany("UPDATE media SET status = 'missing' WHERE id = ?", [(m[0],) for m in missing])
+                conn.executemany("UPDATE media SET size = ?, mtime = ?, duration = ?, status = ? WHERE id = ?", checked)
+        for media_id, score_id, filename in missing:
+            self._unlink(score_id, filename)
+
+        if self.entries is None:
+            self.entries = os.scandir(UPLOAD_FOLDER)
+        entries = list(itertools.islice(self.entries, MEDIA_RECONCILE_BATCH))
+        if len(entries) < MEDIA_RECONCILE_BATCH:
+            self.entries.close()
+            self.entries = None
+        candidates = {entry.name: entry for entry in entries
+                      if entry.is_file() and not entry.name.endswith(('.part', '.tmp'))}
+        if candidates:
+            known = db.query(f"SELECT filename FROM media WHERE filename IN ({', '.join('?' * len(candidates))})",
+                             list(candidates))
+            for name, in known:
+                del candidates[name]
+        for name, entry in candidates.items():
+            if time.time() - entry.stat().st_mtime < MEDIA_ORPHAN_AGE:
+                continue # Recording in progress, or a run that is about to get its score
+            self._adopt(name)
+        return self.row_cursor != 0 or self.entries is not None
+
+    def _expired_recording(self, filename, st):
+        # Server recordings no score took: big copy-mode .mkv files, not worth keeping for long
+        if not filename.startswith('rec_') or time.time() - st.st_mtime < MEDIA_RECORDING_KEEP:
+            return False
+        return not any(station.recorder.is_recording(filename) for station in stations.all())
+
+    def _adopt(self, filename):
+        # A file the catalogue doesn't know: linked by some score after all (a full scan, but once per file), or orphaned
+        url = f"/uploads/{filename}"
+        for column in MEDIA_PATH_COLUMNS:
+            row = db.query_one(f"SELECT id FROM scores WHERE {column} = ? LIMIT 1", (url,))
+            if row:
+                return self.record(row[0], filename, derived=column in MEDIA_DERIVED_COLUMNS)
+        st = os.stat(os.path.join(UPLOAD_FOLDER, filename))
+        db.execute("""INSERT OR IGNORE INTO media (filename, score_id, kind, derived, size, mtime, created, status)
+                      VALUES (?, NULL, ?, 0, ?, ?, ?, 'orphan')""",
+                   (filename, media_kind(filename), st.st_size, st.st_mtime, st.st_mtime))
+
+media_catalogue = MediaCatalogue()
+
+# --- TELEMETRY ---
+TELEMETRY_FOLDER = os.path.join(BASE_DIR, 'telemetry')
+TELEMETRY_CHUNK = 3000 # Samples held in memory per session before a chunk is written (5 min at 10 Hz)
+TELEMETRY_PIPES = 4 # Pipes kept per sample (the kiosk never has more on screen)
+TELEMETRY_POSE_BYTES = 158 # One pose in the format of js/pose_landmarks.js
+TELEMETRY_IDLE_END = 30 # Seconds without a state update before an open session is closed
+TELEMETRY_MAX_POINTS = 5000 # Cap on ?points= of the series API
+TELEMETRY_CHUNK_HEADER = struct.Struct('<4sI') # b'PTT1', samples in the chunk
+
+# (name, array typecode, values per sample); a chunk on disk is every column's raw array in this order
+TELEMETRY_COLUMNS = (
+    ('t', 'd', 1), # time.time() of the update
+    ('player_y', 'f', 1),
+    ('score', 'i', 1),
+    ('pipe_count', 'B', 1),
+    ('pipes', 'f', TELEMETRY_PIPES * 3), # z, gapY, gapHeight per pipe
+    ('has_pose', 'B', 1),
+    ('pose', 'B', TELEMETRY_POSE_BYTES)
+)
+
+class TelemetrySession:
+    """
+    Column buffers of one game, allocated once at TELEMETRY_CHUNK samples. When they are full
+    (or the game ends) the filled part goes to disk as one chunk and writing starts over at
+    the beginning, so a session's memory never grows whatever its length.
+    """
+
+    def __init__(self, session_id, station, capacity=TELEMETRY_CHUNK):
+        self.id = session_id
+        self.station = station
+        self.path = os.path.join(TELEMETRY_FOLDER, f"{session_id}.bin")
+        self.capacity = capacity
+        self.columns = {name: array.array(code, bytes(array.array(code).itemsize * width * capacity))
+                        for name, code, width in TELEMETRY_COLUMNS}
+        self.count = 0 # Samples in the buffers
+        self.flushed = 0 # Samples handed to the writer
+        self.started = time.time()
+        self.last_update = self.started
+        self.score = 0
+
+    def append(self, state, now):
+        i = self.count
+        cols = self.columns
+        cols['t'][i] = now
+        cols['player_y'][i] = state.get('player_y') or 0
+        self.score = cols['score'][i] = int(state.get('score') or 0)
+
+        pipes = (state.get('pipes') or [])[:TELEMETRY_PIPES]
+        cols['pipe_count'][i] = len(pipes)
+        base = i * TELEMETRY_PIPES * 3
+        for j, pipe in enumerate(pipes):
+            cols['pipes'][base + j * 3:base + j * 3 + 3] = array.array('f', (
+                pipe.get('z') or 0, pipe.get('gapY') or 0, pipe.get('gapHeight') or 0))
+
+        # The pose is kept as the kiosk's bytes; anything else (old JSON landmarks) is not stored
+        pose = state.get('pose')
+        try:
+            pose = binascii.a2b_base64(pose) if pose else b''
+        except (binascii.Error, TypeError):
+            pose = b''
+        if len(pose) == TELEMETRY_POSE_BYTES:
+            cols['has_pose'][i] = 1
+            cols['pose'][i * TELEMETRY_POSE_BYTES:(i + 1) * TELEMETRY_POSE_BYTES] = array.array('B', pose)
+        else:
+            cols['has_pose'][i] = 0
+
+        self.count += 1
+        self.last_update = now
+
+    def take_chunk(self):
+        # The filled part as one chunk of the on-disk format; the buffers start over
+        parts = [TELEMETRY_CHUNK_HEADER.pack(b'PTT1', self.count)]
+        for name, code, width in TELEMETRY_COLUMNS:
+            parts.append(self.columns[name][:self.count * width].tobytes())
+        self.flushed += self.count
+        self.count = 0
+        return b''.join(parts)
+
+    def buffered(self):
+        # Copy of the samples still in memory, in the decoded form of read_telemetry_chunks
+        return {name: self.columns[name][:self.count * width] for name, code, width in TELEMETRY_COLUMNS}
+
+def read_telemetry_chunks(path, max_samples):
+    """Columns of the first max_samples samples of a session file (native byte order, as written)"""
+    columns = {name: array.array(code) for name, code, width in TELEMETRY_COLUMNS}
+    if not os.path.exists(path):
+        return columns
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    samples = 0
+    while offset + TELEMETRY_CHUNK_HEADER.size <= len(data) and samples < max_samples:
+        magic, count = TELEMETRY_CHUNK_HEADER.unpack_from(data, offset)
+        if magic != b'PTT1':
+            break
+        offset += TELEMETRY_CHUNK_HEADER.size
+        for name, code, width in TELEMETRY_COLUMNS:
+            size = columns[name].itemsize * width * count
+            columns[name].frombytes(data[offset:offset + size])
+            offset += size
+        samples += count
+    return columns
+
+class TelemetryStore:
+    """
+    Records every Ptak state update of a game into a TelemetrySession and appends its chunks to
+    telemetry/<session>.bin (one sequential write each, on a writer thread - never on the
+    request path). A session starts with the first update where is_playing is set and ends
+    at GAME_OVER, when is_playing drops, or after TELEMETRY_IDLE_END seconds of silence.
+    Every station has at most one open session. Sessions are listed in the `telemetry_sessions` table.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = {} # Station name -> open TelemetrySession
+        self.writes = queue.Queue() # Callables, run in order by the writer thread
+        self.writer = None
+
+    def start(self):
+        os.makedirs(TELEMETRY_FOLDER, exist_ok=True)
+        # Sessions that were open when the server stopped: close them with what reached the disk
+        for session_id, path in db.query("SELECT id, path FROM telemetry_sessions WHERE ended IS NULL"):
+            columns = read_telemetry_chunks(path, float('inf'))
+            db.execute("UPDATE telemetry_sessions SET ended = ?, samples = ?, score = ? WHERE id = ?",
+                       (columns['t'][-1] if columns['t'] else None, len(columns['t']),
+                        max(columns['score'], default=0), session_id))
+        self.writer = threading.Thread(target=self._write_loop, name="telemetry-writer", daemon=True)
+        self.writer.start()
+
+    def record(self, station, state):
+        now = time.time()
+        playing = bool(state.get('is_playing'))
+        with self.lock:
+            session = self.active.get(station)
+            if session is None:
+                if not playing:
+                    return
+                session_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+                session = self.active[station] = TelemetrySession(session_id, station)
+                self.writes.put(lambda s=session: db.execute(
+                    "INSERT INTO telemetry_sessions (id, station, started, path) VALUES (?, ?, ?, ?)",
+                    (s.id, s.station, s.started, s.path)))
+            session.append(state, now)
+            if not playing or state.get('game_state') == 'GAME_OVER':
+                self._end(session)
+            elif session.count == session.capacity:
+                self._flush(session)
+
+    def _flush(self, session):
+        chunk = session.take_chunk()
+        self.writes.put(lambda: self._append(session.path, chunk))
+
+    def _end(self, session):
+        self._flush(session)
+        del self.active[session.station]
+        ended, samples, score = session.last_update, session.flushed, session.score
+        self.writes.put(lambda: db.execute("UPDATE telemetry_sessions SET ended = ?, samples = ?, score = ? WHERE id = ?",
+                                           (ended, samples, score, session.id)))
+
+    @staticmethod
+    def _append(path, chunk):
+        with open(path, 'ab') as f:
+            f.write(chunk)
+
+    def _write_loop(self):
+        while True:
+            try:
+                write = self.writes.get(timeout=TELEMETRY_IDLE_END / 3)
+            except queue.Empty:
+                with self.lock:
+                    for session in list(self.active.values()):
+                        if time.time() - session.last_update > TELEMETRY_IDLE_END:
+                            self._end(session) # Kiosk went away mid-game
+                continue
+            try:
+                write()
+            except Exception as e:
+                print(f"Telemetry write failed: {e}")
+            finally:
+                self.writes.task_done()
+
+    def series(self, session_id):
+        """All samples of a session (finished or still running), as columns"""
+        with self.lock:
+            session = next((s for s in self.active.values() if s.id == session_id), None)
+            if session:
+                on_disk, memory = session.flushed, session.buffered()
+        if session is None:
+            self.writes.join() # The last chunk of a session that just ended may still be queued
+            row = db.query_one("SELECT path FROM telemetry_sessions WHERE id = ?", (session_id,))
+            if row is None:
+                return None
+            return read_telemetry_chunks(row[0], float('inf'))
+        self.writes.join()
+        # Only the chunks written before the snapshot: later ones are already in `memory` or newer
+        columns = read_telemetry_chunks(session.path, on_disk)
+        for name in columns:
+            columns[name].extend(memory[name])
+        return columns
+
+    def sessions(self, limit=50, station=None):
+        query, args = "SELECT id, station, started, ended, samples, score FROM telemetry_sessions", []
+        if station is not None:
+            query += " WHERE station = ?"
+            args.append(station)
+        rows = db.query(query + " ORDER BY started DESC LIMIT ?", args + [limit])
+        with self.lock:
+            active = {s.id: s.flushed + s.count for s in self.active.values()}
+        return [{
+            'id': row[0],
+            'station': row[1],
+            'started': row[2],
+            'ended': row[3],
+            'samples': active.get(row[0], row[4]),
+            'score': row[5],
+            'active': row[0] in active
+        } for row in rows]
+
+def downsample_telemetry(columns, points, fields):
+    """Every step-th sample (plus the last) so that at most `points` are returned, as JSON-ready lists"""
+    samples = len(columns['t'])
+    step = 1 if samples <= points else -(-(samples - 1) // max(points - 1, 1))
+    indexes = list(range(0, samples, step))
+    if samples and indexes[-1] != samples - 1:
+        indexes.append(samples - 1)
+
+    series = {}
+    for name in fields:
+        if name == 'pipes':
+            width = TELEMETRY_PIPES * 3
+            pipes, counts = columns['pipes'], columns['pipe_count']
+            series['pipes'] = [[{'z': pipes[i * width + j * 3], 'gapY': pipes[i * width + j * 3 + 1],
+                                 'gapHeight': pipes[i * width + j * 3 + 2]} for j in range(counts[i])]
+                               for i in indexes]
+        elif name == 'pose':
+            size = TELEMETRY_POSE_BYTES
+            poses, has_pose = columns['pose'], columns['has_pose']
+            series['pose'] = [base64.b64encode(poses[i * size:(i + 1) * size].tobytes()).decode() if has_pose[i] else None
+                              for i in indexes]
+        else:
+            values = columns[name]
+            series[name] = [values[i] for i in indexes]
+    return {'samples': samples, 'step': step, 'returned': len(indexes), 'series': series}
+
+telemetry = TelemetryStore()
+
+# --- STATIONS ---
+DEFAULT_STATION = 'main' # The unprefixed /api/... routes
+STATION_MAX = 32 # Stations kept at once; the longest idle one is dropped to make room
+STATION_NAME = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+
+class Station:
+    """
+    Live state of one kiosk / trainer: Snake and Ptak state, board stream, control queue,
+    frame broadcasters and the camera recorder. Served under /api/s/<name>/...; the plain
+    /api/... routes are the DEFAULT_STATION, so single-kiosk setups don't change.
+    Memory per station is bounded: one frame per stream, RECORD_PREROLL_MAX_BYTES of pre-roll
+    (only while the camera streams), RECORD_QUEUE_SIZE frames queued for ffmpeg,
+    MAX_BOARD_DELTAS board deltas, SNAKE_MAX_COMMANDS commands, TELEMETRY_CHUNK samples.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.snake_state = LiveDocument(SNAKE_STATE_INITIAL)
+        self.snake_boards = {"seq": None, "keyframe": None, "deltas": []}
+        self.snake_boards_lock = threading.Lock()
+        self.snake_settings = dict(SNAKE_SETTINGS_INITIAL)
+        self.snake_commands = []
+        # Push channel: long-poll clients wait here for settings changes / new commands
+        self.snake_control = threading.Condition()
+        self.snake_settings_version = 0
+        self.ptak_state = LiveDocument(PTAK_STATE_INITIAL)
+        self.live_documents = {"snake": self.snake_state, "ptak": self.ptak_state}
+        self.streams = {stream: FrameBroadcaster() for stream in STREAM_NAMES}
+        self.ingest_stats = {stream: {'frames': 0, 'lost': 0, 'latency_ms': 0.0, 'last_seq': None}
+                             for stream in STREAM_NAMES}
+        self.recorder = StreamRecorder()
+        self.last_active = time.monotonic()
+
+    def busy(self):
+        # Watched, subscribed to or recording: never dropped
+        return (any(b.viewers for b in self.streams.values())
+                or any(d.subscribers for d in self.live_documents.values())
+                or self.recorder.proc is not None)
+
+    def info(self):
+        return {
+            'name': self.name,
+            'idle_seconds': round(time.monotonic() - self.last_active, 1),
+            'viewers': {stream: b.viewers for stream, b in self.streams.items()},
+            'subscribers': {name: d.subscribers for name, d in self.live_documents.items()},
+            'recording': self.recorder.proc is not None
+        }
+
+    def snapshot(self):
+        # Everything a new worker process needs to serve this station (see restore_state)
+        with self.snake_boards_lock:
+            boards = dict(self.snake_boards, deltas=list(self.snake_boards['deltas']))
+        with self.snake_control:
+            control = (dict(self.snake_settings), self.snake_settings_version, list(self.snake_commands))
+        documents = {}
+        for name, document in self.live_documents.items():
+            with document.cond:
+                documents[name] = (document.version, dict(document.data))
+        return {'boards': boards, 'control': control, 'documents': documents}
+
+    def restore(self, snapshot):
+        with self.snake_boards_lock:
+            self.snake_boards = snapshot['boards']
+        with self.snake_control:
+            self.snake_settings, self.snake_settings_version, self.snake_commands = snapshot['control']
+            self.snake_control.notify_all()
+        for name, (version, data) in snapshot['documents'].items():
+            self.live_documents[name].restore(version, data)
+
+    def close(self):
+        self.recorder.close()
+
+class StationRegistry:
+    """
+    Stations by name, created on first use. At STATION_MAX the station idle for the
+    longest time is dropped (never the default one, nor a busy one); when every station
+    is busy, get() returns None. on_remove callbacks get each dropped Station.
+    """
+
+    def __init__(self, limit=STATION_MAX):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.stations = {}
+        self.on_remove = []
+
+    def get(self, name):
+        removed = None
+        with self.lock:
+            station = self.stations.get(name)
+            if station is None:
+                if len(self.stations) >= self.limit:
+                    idle = [s for s in self.stations.values() if s.name != DEFAULT_STATION and not s.busy()]
+                    if not idle:
+                        return None
+                    removed = min(idle, key=lambda s: s.last_active)
+                    del self.stations[removed.name]
+                station = self.stations[name] = Station(name)
+            station.last_active = time.monotonic()
+        if removed:
+            removed.close()
+            for callback in self.on_remove:
+                callback(removed)
+        return station
+
+    def find(self, name):
+        # Existing station or None, without creating one
+        with self.lock:
+            return self.stations.get(name)
+
+    def remove(self, name):
+        with self.lock:
+            station = self.stations.pop(name, None)
+        if station:
+            station.close()
+            for callback in self.on_remove:
+                callback(station)
+
+    def all(self):
+        with self.lock:
+            return list(self.stations.values())
+
+stations = StationRegistry()
+default_station = stations.get(DEFAULT_STATION)
+
+def station_route(rule, **options):
+    """@app.route for per-station endpoints: registers /api<rule> and /api/s/<station><rule>"""
+    def register(func):
+        app.route('/api' + rule, **options)(func)
+        app.route('/api/s/<station>' + rule, **options)(func)
+        return func
+    return register
+
+@app.url_value_preprocessor
+def pick_station(endpoint, values):
+    # g.station for the handlers; the <station> URL part is not passed on as an argument
+    name = values.pop('station', None) if values else None
+    if name is None:
+        g.station = default_station
+        return
+    if not STATION_NAME.match(name):
+        abort(make_response(jsonify({'error': 'Invalid station name'}), 404))
+    g.station = shared.open_station(name)
+    if g.station is None:
+        abort(make_response(jsonify({'error': 'Too many active stations'}), 503))
+
+# --- STATIC ASSETS ---
+STATIC_CACHE_DIR = os.path.join(BASE_DIR, 'static_cache') # Rewritten and compressed copies, named by content hash
+STATIC_FOLDERS = {'js': JS_FOLDER, 'css': CSS_FOLDER}
+STATIC_PAGES = ('ptak.html', 'ptak_leaderboard.html', 'leaderboard1.html', 'leaderboard2.html', 'dashboard.html')
+STATIC_IMMUTABLE_AGE = 365 * 24 * 3600 # Seconds; a hashed URL always has the same content
+STATIC_COMPRESS_MIN = 1024 # Bytes, smaller files are only sent as they are
+STATIC_COMPRESS_RATIO = 0.9 # A compressed copy is kept only if at most this fraction of the file
+STATIC_COMPRESSIBLE = {'.js', '.css', '.html', '.json', '.svg', '.ttf', '.data', '.tflite', '.binarypb'}
+STATIC_REF = re.compile(r'''(?<=["'(])(/?static/)((?:js|css)/[\w./-]+)''') # Quoted references in pages and stylesheets
+STATIC_HASH = re.compile(r'\.[0-9a-f]{12}(?=\.\w+$)') # three.min.<hash>.js
+
+# Content-Encoding -> (suffix of the copy, compress), in order of preference
+STATIC_ENCODERS = {'gzip': ('gz', lambda data: gzip.compress(data, 9, mtime=0))}
+if brotli is not None:
+    STATIC_ENCODERS = {'br': ('br', lambda data: brotli.compress(data, quality=11)), **STATIC_ENCODERS}
+
+def write_atomic(path, data):
+    # Readers (and other server processes) never see a half-written file
+    part_path = f"{path}.{os.getpid()}.part"
+    with open(part_path, 'wb') as f:
+        f.write(data)
+    os.replace(part_path, path)
+
+class StaticAsset:
+    """A file under js/ or css/, or a page: its content hash and the file to send per Content-Encoding"""
+
+    def __init__(self, name, source, path, digest, size):
+        self.name = name # 'js/three.min.js', or the page's file name
+        self.source = source
+        self.mtime = os.stat(source).st_mtime_ns
+        self.path = path # Sent without Content-Encoding: the source, or its rewritten copy
+        self.digest = digest
+        self.size = size
+        self.mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        root, self.ext = os.path.splitext(name)
+        self.hashed_name = f"{root}.{digest}{self.ext}"
+        self.compressible = self.ext in STATIC_COMPRESSIBLE and size >= STATIC_COMPRESS_MIN
+        self.encoded = {} # Content-Encoding -> compressed copy ('' if compressing didn't pay off)
+
+    def encoded_path(self, encoding):
+        return os.path.join(STATIC_CACHE_DIR, f"{self.digest}{self.ext}.{STATIC_ENCODERS[encoding][0]}")
+
+class StaticAssets:
+    """
+    The js/ and css/ files by content hash, and the pages that load them.
+    Pages and stylesheets are served with every quoted /static/... reference rewritten to the
+    hashed name (three.min.js -> three.min.<hash>.js). Hashed URLs are cached for a year as
+    immutable, so a kiosk reload only revalidates the page (ETag -> 304). gzip and brotli
+    copies are built in the background by start() and kept in STATIC_CACHE_DIR under the
+    content hash, so they are built once per version of a file, not once per start.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.building = False # True in the process that builds the compressed copies
+        self.build_lock = threading.Lock()
+        self.assets = {} # 'js/three.min.js' -> StaticAsset
+        self.hashed = {} # 'js/three.min.<hash>.js' -> StaticAsset
+        self.pages = {} # 'ptak.html' -> StaticAsset
+
+    def _asset(self, name, source, assets):
+        with open(source, 'rb') as f:
+            data = f.read()
+        path = source
+        if name.endswith(('.css', '.html')):
+            rewritten = STATIC_REF.sub(lambda m: m.group(1) + (assets[m.group(2)].hashed_name if m.group(2) in assets
+                                                               else m.group(2)), data.decode('utf-8')).encode('utf-8')
+            if rewritten != data:
+                data = rewritten
+                path = None
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        if path is None:
+            path = os.path.join(STATIC_CACHE_DIR, digest + os.path.splitext(name)[1])
+            if not os.path.exists(path):
+                write_atomic(path, data)
+        return StaticAsset(name, source, path, digest, len(data))
+
+    def _load(self):
+        os.makedirs(STATIC_CACHE_DIR, exist_ok=True)
+        files = []
+        for folder, folder_path in STATIC_FOLDERS.items():
+            for root, dirs, names in os.walk(folder_path):
+                for filename in names:
+                    if not filename.startswith('.'):
+                        source = os.path.join(root, filename)
+                        files.append((f"{folder}/{os.path.relpath(source, folder_path).replace(os.sep, '/')}", source))
+        files.sort(key=lambda item: item[0].endswith('.css')) # Stylesheets last: they reference the fonts by hash
+
+        assets = {}
+        for name, source in files:
+            assets[name] = self._asset(name, source, assets)
+        self.pages = {page: self._asset(page, os.path.join(BASE_DIR, page), assets) for page in STATIC_PAGES}
+        self.assets = assets
+        self.hashed = {asset.hashed_name: asset for asset in assets.values()}
+        self.loaded = True
+        if self.building:
+            threading.Thread(target=self._build, args=(False,), name="static-assets", daemon=True).start()
+
+    def _ensure_current(self):
+        # Reloads if a file was edited since (edits show up on the next page load, as before)
+        with self.lock:
+            if self.loaded:
+                try:
+                    if all(os.stat(asset.source).st_mtime_ns == asset.mtime
+                           for asset in itertools.chain(self.assets.values(), self.pages.values())):
+                        return
+                except OSError:
+                    pass # Deleted: reload
+            self._load()
+
+    def start(self):
+        with self.lock:
+            self.building = True
+            if self.loaded:
+                threading.Thread(target=self._build, args=(True,), name="static-assets", daemon=True).start()
+                return
+            self._load()
+
+    def _build(self, prune=True):
+        # prune: remove copies of older versions of the files (at startup only, not after an edit)
+        with self.build_lock:
+            self._compress(prune)
+
+    def _compress(self, prune):
+        assets = list(self.assets.values()) + list(self.pages.values())
+        keep = {os.path.basename(asset.path) for asset in assets}
+        for asset in assets:
+            if not asset.compressible:
+                continue
+            for encoding, (suffix, compress) in STATIC_ENCODERS.items():
+                path = asset.encoded_path(encoding)
+                keep.add(os.path.basename(path))
+                try:
+                    if not os.path.exists(path):
+                        with open(asset.path, 'rb') as f:
+                            data = compress(f.read())
+                        # Empty file: not worth it, so it isn't compressed again on the next start
+                        write_atomic(path, data if len(data) <= asset.size * STATIC_COMPRESS_RATIO else b'')
+                    asset.encoded[encoding] = path if os.path.getsize(path) else ''
+                except OSError as e:
+                    print(f"Static asset {asset.name} ({encoding}) not compressed: {e}")
+        for filename in os.listdir(STATIC_CACHE_DIR) if prune else ():
+            if filename not in keep and not filename.endswith('.part'):
+                with contextlib.suppress(OSError):
+                    os.remove(os.path.join(STATIC_CACHE_DIR, filename)) # Older versions of the files
+
+    def find(self, name):
+        """(asset, immutable) for a path under /static/; an outdated hash gets the current file, revalidated"""
+        if not self.loaded:
+            self._ensure_current()
+        asset = self.hashed.get(name)
+        if asset is not None:
+            return asset, True
+        self._ensure_current()
+        return self.assets.get(name) or self.assets.get(STATIC_HASH.sub('', name, count=1)), False
+
+    def page(self, name):
+        self._ensure_current()
+        return self.pages[name]
+
+    def select(self, asset, accept_encodings, immutable):
+        """(file, ETag, headers) of the best encoding the client accepts (a werkzeug Accept object)"""
+        for encoding in STATIC_ENCODERS:
+            if not asset.compressible or not accept_encodings[encoding]:
+                continue
+            path = asset.encoded.get(encoding)
+            if path is None and not self.building:
+                # Worker of asgi.py --workers N: the supervisor builds the copies, picked up once they exist
+                candidate = asset.encoded_path(encoding)
+                if os.path.exists(candidate):
+                    path = asset.encoded[encoding] = candidate if os.path.getsize(candidate) else ''
+            if path:
+                return path, f"{asset.digest}-{encoding}", {'Content-Encoding': encoding, 'Vary': 'Accept-Encoding',
+                                                            'Cache-Control': self.cache_control(immutable)}
+        headers = {'Cache-Control': self.cache_control(immutable)}
+        if asset.compressible:
+            headers['Vary'] = 'Accept-Encoding'
+        return asset.path, asset.digest, headers
+
+    @staticmethod
+    def cache_control(immutable):
+        return f"public, max-age={STATIC_IMMUTABLE_AGE}, immutable" if immutable else 'no-cache'
+
+static_assets = StaticAssets()
+
+def send_asset(asset, immutable=False):
+    # File-backed response: under a WSGI server with wsgi.file_wrapper the body goes out with sendfile
+    if asset is None:
+        abort(404)
+    path, etag, headers = static_assets.select(asset, request.accept_encodings, immutable)
+    response = send_file(path, mimetype=asset.mimetype, etag=etag, conditional=True)
+    response.headers.update(headers)
+    return response
 
 def init_db():
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
+    # WAL is stored in the database file, so this holds for every later connection
+    c.execute("PRAGMA journal_mode = WAL")
     c.execute('''CREATE TABLE IF NOT EXISTS scores
                  (id INTEGER PRIMARY KEY AUTOINCREMENT,
                   name TEXT NOT NULL,
@@ -151,29 +1940,98 @@ def init_db():
         c.execute("ALTER TABLE scores ADD COLUMN image1_path TEXT")
         c.execute("ALTER TABLE scores ADD COLUMN image2_path TEXT")
         c.execute("ALTER TABLE scores ADD COLUMN image3_path TEXT")
+    if 'poster_path' not in columns:
+        c.execute("ALTER TABLE scores ADD COLUMN poster_path TEXT")
+        c.execute("ALTER TABLE scores ADD COLUMN thumb_path TEXT")
+
+    # Background media jobs (see MediaJobQueue)
+    c.execute('''CREATE TABLE IF NOT EXISTS jobs
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  kind TEXT NOT NULL,
+                  score_id INTEGER,
+                  payload TEXT,
+                  status TEXT NOT NULL DEFAULT 'queued',
+                  attempts INTEGER NOT NULL DEFAULT 0,
+                  error TEXT,
+                  result TEXT,
+                  created REAL,
+                  started REAL,
+                  finished REAL,
+                  run_after REAL NOT NULL DEFAULT 0)''')
+    # Leaderboard (score) and history (date) orderings. They cover the handlers' queries for more
+    # rows than ScoreCache holds; the cache's own load (every column, ~300 rows once) still reads
+    # the table rows, which isn't worth doubling the indexes for
+    c.execute("""CREATE INDEX IF NOT EXISTS idx_scores_top
+                 ON scores (score DESC, id, name, video_path, thumb_path) WHERE score > 0""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_scores_date ON scores (date DESC, id DESC, name, score, video_path)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_score ON jobs (score_id)")
+
+    # Ptak telemetry sessions (see TelemetryStore); the samples themselves are in telemetry/<id>.bin
+    c.execute('''CREATE TABLE IF NOT EXISTS telemetry_sessions
+                 (id TEXT PRIMARY KEY,
+                  station TEXT NOT NULL DEFAULT 'main',
+                  started REAL NOT NULL,
+                  ended REAL,
+                  samples INTEGER NOT NULL DEFAULT 0,
+                  score INTEGER NOT NULL DEFAULT 0,
+                  path TEXT NOT NULL)''')
+    c.execute("PRAGMA table_info(telemetry_sessions)")
+    if 'station' not in [column[1] for column in c.fetchall()]:
+        c.execute("ALTER TABLE telemetry_sessions ADD COLUMN station TEXT NOT NULL DEFAULT 'main'")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_telemetry_started ON telemetry_sessions (started DESC)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_telemetry_station ON telemetry_sessions (station, started DESC)")
+
+    # Catalogue of uploads/ (see MediaCatalogue)
+    c.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'media'")
+    backfill = c.fetchone() is None
+    c.execute('''CREATE TABLE IF NOT EXISTS media
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  filename TEXT NOT NULL UNIQUE,
+                  score_id INTEGER,
+                  kind TEXT NOT NULL,
+                  derived INTEGER NOT NULL DEFAULT 0,
+                  size INTEGER NOT NULL DEFAULT 0,
+                  mtime REAL NOT NULL DEFAULT 0,
+                  duration REAL,
+                  thumbnail TEXT,
+                  created REAL NOT NULL,
+                  status TEXT NOT NULL)''')
+    if backfill:
+        # Every file the scores link to, oldest first; the reconciler fills in size and duration
+        for column in MEDIA_PATH_COLUMNS:
+            c.execute(f'''INSERT OR IGNORE INTO media (filename, score_id, kind, derived, thumbnail, created, status)
+                          SELECT substr({column}, 10), id,
+                                 CASE WHEN lower({column}) LIKE '%.mp4' OR lower({column}) LIKE '%.webm'
+                                        OR lower({column}) LIKE '%.mkv' THEN 'video' ELSE 'image' END,
+                                 {int(column in MEDIA_DERIVED_COLUMNS)}, {'thumb_path' if column == 'video_path' else 'NULL'},
+                                 COALESCE(CAST(strftime('%s', date) AS REAL), 0), 'unchecked'
+                          FROM scores WHERE {column} LIKE '/uploads/%' ORDER BY id''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_media_list ON media (status, derived, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_media_score ON media (score_id)")
         
     conn.commit()
     conn.close()
 
 @app.route('/')
 def index():
-    return send_from_directory(BASE_DIR, 'ptak.html')
+    return send_asset(static_assets.page('ptak.html'))
 
 @app.route('/leaderboard')
 def board_page():
-    return send_from_directory(BASE_DIR, 'ptak_leaderboard.html')
+    return send_asset(static_assets.page('ptak_leaderboard.html'))
 
 @app.route('/leaderboard1')
 def board1_page():
-    return send_from_directory(BASE_DIR, 'leaderboard1.html')
+    return send_asset(static_assets.page('leaderboard1.html'))
 
 @app.route('/leaderboard2')
 def board2_page():
-    return send_from_directory(BASE_DIR, 'leaderboard2.html')
+    return send_asset(static_assets.page('leaderboard2.html'))
 
 @app.route('/dashboard')
 def dashboard_page():
-    return send_from_directory(BASE_DIR, 'dashboard.html')
+    return send_asset(static_assets.page('dashboard.html'))
 
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
@@ -181,11 +2039,11 @@ def uploaded_file(filename):
 
 @app.route('/static/js/<path:filename>')
 def serve_js(filename):
-    return send_from_directory(JS_FOLDER, filename)
+    return send_asset(*static_assets.find('js/' + filename))
 
 @app.route('/static/css/<path:filename>')
 def serve_css(filename):
-    return send_from_directory(CSS_FOLDER, filename)
+    return send_asset(*static_assets.find('css/' + filename))
 
 @app.route('/favicon.ico')
 def favicon():
@@ -193,195 +2051,346 @@ def favicon():
 
 # --- API dla Snake ---
 
-@app.route('/api/snake/state', methods=['POST'])
+@station_route('/snake/state', methods=['POST'])
 def update_snake_state():
-    global snake_state
-    data = request.json
-    snake_state.update(data)
-    snake_state['timestamp'] = time.time()
+    shared.apply('snake_state', g.station, request.json, time.time())
     return jsonify({'status': 'ok'})
 
-@app.route('/api/snake/state', methods=['GET'])
+@state_op('snake_state')
+def store_snake_state(station, data, now):
+    station.snake_state.update(data, now)
+
+@state_op('snake_boards')
+def store_snake_boards(station, data):
+    # Body is a sequence of length-prefixed messages. We only look at the header
+    # (kind + seq) to keep a keyframe and the deltas after it. Returns True if the
+    # sender should send a keyframe because the delta chain is broken.
+    need_keyframe = False
+    offset = 0
+    boards = station.snake_boards
+    with station.snake_boards_lock:
+        while offset + 4 <= len(data):
+            length = struct.unpack_from('<I', data, offset)[0]
+            msg = data[offset + 4:offset + 4 + length]
+            offset += 4 + length
+            if len(msg) < 6 or len(msg) != length:
+                break
+            kind = msg[1]
+            seq = struct.unpack_from('<I', msg, 2)[0]
+
+            if kind == 0:
+                boards['keyframe'] = msg
+                boards['deltas'] = []
+            elif (boards['keyframe'] is not None
+                  and seq == (boards['seq'] + 1) & 0xFFFFFFFF
+                  and len(boards['deltas']) < MAX_BOARD_DELTAS):
+                boards['deltas'].append(msg)
+            else:
+                need_keyframe = True
+                continue
+            boards['seq'] = seq
+    return need_keyframe
+
+@station_route('/snake/boards', methods=['POST'])
+def update_snake_boards():
+    if not request.data:
+        return "No data", 400
+    need_keyframe = shared.apply('snake_boards', g.station, request.data)
+    return jsonify({'status': 'ok', 'seq': g.station.snake_boards['seq'], 'need_keyframe': need_keyframe})
+
+@station_route('/snake/boards', methods=['GET'])
+def get_snake_boards():
+    # ?since=<seq>: only the deltas after it if we still have them, otherwise keyframe + deltas
+    since = request.args.get('since', None, type=int)
+    station = g.station
+    with station.snake_boards_lock:
+        keyframe = station.snake_boards['keyframe']
+        deltas = list(station.snake_boards['deltas'])
+        seq = station.snake_boards['seq']
+    if keyframe is None:
+        return '', 204
+
+    first_delta = seq - len(deltas) + 1
+    if since is not None and first_delta - 1 <= since <= seq:
+        msgs = deltas[since - first_delta + 1:]
+    else:
+        msgs = [keyframe] + deltas
+
+    body = b''.join(struct.pack('<I', len(m)) + m for m in msgs)
+    return Response(body, mimetype='application/octet-stream', headers={'X-Board-Seq': str(seq)})
+
+@station_route('/snake/state', methods=['GET'])
 def get_snake_state():
-    return jsonify(snake_state)
+    return versioned_response(g.station.snake_state)
 
-@app.route('/api/snake/settings', methods=['POST'])
+@station_route('/snake/events', methods=['GET'])
+def snake_state_events():
+    return events_response(g.station.snake_state)
+
+@station_route('/snake/settings', methods=['POST'])
 def update_snake_settings():
-    global snake_settings
-    data = request.json
-    if 'fps' in data:
-        snake_settings['fps'] = int(data['fps'])
-    if 'paused' in data:
-        snake_settings['paused'] = bool(data['paused'])
-    return jsonify({'status': 'updated', 'settings': snake_settings})
+    settings = shared.apply('snake_settings', g.station, request.json)
+    return jsonify({'status': 'updated', 'settings': settings})
+
+@state_op('snake_settings')
+def store_snake_settings(station, data):
+    with station.snake_control:
+        if 'fps' in data:
+            station.snake_settings['fps'] = int(data['fps'])
+        if 'paused' in data:
+            station.snake_settings['paused'] = bool(data['paused'])
+        station.snake_settings_version += 1
+        station.snake_control.notify_all()
+        return dict(station.snake_settings)
 
-@app.route('/api/snake/settings', methods=['GET'])
+@station_route('/snake/settings', methods=['GET'])
 def get_snake_settings():
-    return jsonify(snake_settings)
+    return jsonify(g.station.snake_settings)
 
-@app.route('/api/snake/command', methods=['POST'])
+@state_op('take_snake_commands')
+def take_snake_commands(station):
+    with station.snake_control:
+        cmds = station.snake_commands
+        station.snake_commands = []
+        return cmds
+
+@state_op('snake_command')
+def queue_snake_command(station, command):
+    with station.snake_control:
+        station.snake_commands.append(command)
+        # Nobody is fetching them (trainer offline): keep only the newest
+        del station.snake_commands[:-SNAKE_MAX_COMMANDS]
+        station.snake_control.notify_all()
+        return len(station.snake_commands)
+
+@station_route('/snake/command', methods=['POST'])
 def add_snake_command():
-    global snake_commands
     data = request.json
     if 'command' in data:
-        snake_commands.append(data['command'])
-    return jsonify({'status': 'added', 'queue_size': len(snake_commands)})
+        queue_size = shared.apply('snake_command', g.station, data['command'])
+    else:
+        queue_size = len(g.station.snake_commands)
+    return jsonify({'status': 'added', 'queue_size': queue_size})
 
-@app.route('/api/snake/commands', methods=['GET'])
+@station_route('/snake/commands', methods=['GET'])
 def pop_snake_commands():
-    global snake_commands
-    cmds = list(snake_commands)
-    snake_commands = []
-    return jsonify(cmds)
+    return jsonify(shared.apply('take_snake_commands', g.station))
+
+@station_route('/snake/control', methods=['GET'])
+def wait_snake_control():
+    # Long-poll: returns as soon as settings are newer than ?version= or commands are queued,
+    # otherwise after ?timeout= seconds with an empty command list
+    station = g.station
+    since = request.args.get('version', -1, type=int)
+    timeout = min(request.args.get('timeout', CONTROL_MAX_WAIT, type=float), CONTROL_MAX_WAIT)
+    with station.snake_control:
+        station.snake_control.wait_for(
+            lambda: station.snake_settings_version != since or station.snake_commands, timeout=timeout)
+        version, settings, pending = station.snake_settings_version, dict(station.snake_settings), station.snake_commands
+    return jsonify({
+        'version': version,
+        'settings': settings,
+        'commands': shared.apply('take_snake_commands', station) if pending else []
+    })
+
+@station_route('/snake/sync', methods=['POST'])
+def sync_snake():
+    # One round-trip for the trainer: takes the latest state (JSON body, or multipart with
+    # a 'state' field and an optional 'frame' file) and returns settings, commands and viewers
+    station = g.station
+    frame = None
+    boards = None
+    if request.is_json:
+        state = request.json
+    else:
+        state = json.loads(request.form.get('state', 'null'))
+        if 'frame' in request.files:
+            frame = request.files['frame'].read()
+        if 'boards' in request.files:
+            boards = request.files['boards'].read()
+
+    now = time.time()
+    if state:
+        shared.apply('snake_state', station, state, now)
+    if frame:
+        ingest_frame(station, 'snake', frame)
+    need_keyframe = shared.apply('snake_boards', station, boards) if boards else False
+
+    with station.snake_control:
+        version, settings, pending = station.snake_settings_version, dict(station.snake_settings), station.snake_commands
+    return jsonify({
+        'version': version,
+        'settings': settings,
+        'commands': shared.apply('take_snake_commands', station) if pending else [],
+        'viewers': station.streams['snake'].viewers,
+        'need_keyframe': need_keyframe
+    })
 
 # --- API dla Ptaka (Live State) ---
 
-@app.route('/api/ptak/state', methods=['POST'])
+@station_route('/ptak/state', methods=['POST'])
 def update_ptak_state():
-    global ptak_state
-    data = request.json
-    ptak_state.update(data)
-    ptak_state['timestamp'] = time.time()
+    shared.apply('ptak_state', g.station, request.json, time.time())
     return jsonify({'status': 'ok'})
 
-@app.route('/api/ptak/state', methods=['GET'])
+@state_op('ptak_state')
+def store_ptak_state(station, data, now):
+    station.ptak_state.update(data, now)
+    if shared.primary:
+        telemetry.record(station.name, data)
+
+@station_route('/ptak/state', methods=['GET'])
 def get_ptak_state():
-    return jsonify(ptak_state)
+    return versioned_response(g.station.ptak_state)
+
+@station_route('/ptak/events', methods=['GET'])
+def ptak_state_events():
+    # Same JSON as GET /api/ptak/state, pushed on every change instead of polled
+    return events_response(g.station.ptak_state)
+
+@station_route('/events/stats', methods=['GET'])
+def get_event_stats():
+    return jsonify({name: {'subscribers': d.subscribers, 'version': d.version}
+                    for name, d in g.station.live_documents.items()})
+
+# --- API dla Stacji ---
+
+@app.route('/api/stations', methods=['GET'])
+def list_stations():
+    return jsonify({'max': stations.limit, 'stations': shared.apply('station_info', None)})
+
+@state_op('station_info', replicate=False)
+def station_info(station):
+    return [s.info() for s in stations.all()] # idle_seconds is only tracked by the primary
 
 # --- API dla Streaming (Screen Mirror) ---
 
-@app.route('/api/stream/snake', methods=['POST'])
+@station_route('/stream/snake', methods=['POST'])
 def update_snake_frame():
-    global latest_snake_frame
     if request.data:
-        latest_snake_frame = request.data
-        snake_frame_event.set()
-        return "OK", 200
+        ingest_frame(g.station, 'snake', request.data)
+        return frame_accepted(g.station, 'snake')
     return "No data", 400
 
-def gen_snake_frames():
-    while True:
-        if snake_frame_event.wait(timeout=1.0): # Wait for new frame
-            snake_frame_event.clear()
-            if latest_snake_frame:
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + latest_snake_frame + b'\r\n')
-        else:
-            # Send keepalive or last frame if timeout
-            if latest_snake_frame:
-                 yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + latest_snake_frame + b'\r\n')
-
-@app.route('/api/stream/snake/mjpeg')
+@station_route('/stream/snake/mjpeg')
 def stream_snake_mjpeg():
-    return Response(gen_snake_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    return g.station.streams['snake'].response()
 
 
-@app.route('/api/stream/ptak', methods=['POST'])
+@station_route('/stream/ptak', methods=['POST'])
 def update_ptak_frame():
-    global latest_ptak_frame
     if request.data:
-        latest_ptak_frame = request.data
-        ptak_frame_event.set()
-        return "OK", 200
+        ingest_frame(g.station, 'ptak', request.data)
+        return frame_accepted(g.station, 'ptak')
     return "No data", 400
 
-def gen_ptak_frames():
-    while True:
-        if ptak_frame_event.wait(timeout=1.0):
-            ptak_frame_event.clear()
-            if latest_ptak_frame:
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + latest_ptak_frame + b'\r\n')
-        else:
-             if latest_ptak_frame:
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + latest_ptak_frame + b'\r\n')
-
-@app.route('/api/stream/ptak/mjpeg')
+@station_route('/stream/ptak/mjpeg')
 def stream_ptak_mjpeg():
-    return Response(gen_ptak_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    return g.station.streams['ptak'].response()
 
 
-@app.route('/api/stream/ptak/camera', methods=['POST'])
+@station_route('/stream/ptak/camera', methods=['POST'])
 def update_ptak_camera_frame():
-    global latest_ptak_camera_frame
     if request.data:
-        latest_ptak_camera_frame = request.data
-        
-        # Write to recorder if active
-        recorder.write(request.data)
-        
-        ptak_camera_frame_event.set()
-        return "OK", 200
+        ingest_frame(g.station, 'ptak_camera', request.data)
+        return frame_accepted(g.station, 'ptak_camera')
     return "No data", 400
 
-def gen_ptak_camera_frames():
-    while True:
-        if ptak_camera_frame_event.wait(timeout=1.0):
-            ptak_camera_frame_event.clear()
-            if latest_ptak_camera_frame:
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + latest_ptak_camera_frame + b'\r\n')
-        else:
-            if latest_ptak_camera_frame:
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + latest_ptak_camera_frame + b'\r\n')
-
-@app.route('/api/stream/ptak/camera/mjpeg')
+@station_route('/stream/ptak/camera/mjpeg')
 def stream_ptak_camera_mjpeg():
-    return Response(gen_ptak_camera_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    return g.station.streams['ptak_camera'].response()
+
+@station_route('/stream/viewers', methods=['GET'])
+def get_stream_viewers():
+    return jsonify({name: b.viewers for name, b in g.station.streams.items()})
+
+@station_route('/stream/stats', methods=['GET'])
+def get_stream_stats():
+    return jsonify(shared.apply('stream_stats', g.station))
+
+@state_op('stream_stats', replicate=False)
+def stream_stats(station):
+    # Ingest stats are kept where the frames are recorded
+    return {name: dict(station.ingest_stats[name], viewers=b.viewers, seq=b.seq) for name, b in station.streams.items()}
+
+@station_route('/stream/<path:stream>/viewers', methods=['GET'])
+def get_stream_viewer_count(stream):
+    key = stream.replace('/', '_') # e.g. ptak/camera -> ptak_camera
+    if key not in g.station.streams:
+        return jsonify({'error': 'Unknown stream'}), 404
+    return jsonify({'stream': key, 'viewers': g.station.streams[key].viewers})
+
+if Sock is not None:
+    sock = Sock(app)
+
+    def ingest_stream_ws(ws, stream):
+        # One connection per source instead of one POST per frame; the POST endpoints stay as fallback
+        station = g.station
+        key = stream.replace('/', '_')
+        if key not in station.streams:
+            return
+        broadcaster = station.streams[key]
+        viewers = None
+        while True:
+            data = ws.receive()
+            if isinstance(data, (bytes, bytearray)):
+                ingest_ws_message(station, key, bytes(data))
+            if broadcaster.viewers != viewers:
+                viewers = broadcaster.viewers
+                ws.send(json.dumps({'viewers': viewers}))
+
+    sock.route('/api/stream/<path:stream>/ws')(ingest_stream_ws)
+    sock.route('/api/s/<station>/stream/<path:stream>/ws', endpoint='ingest_station_stream_ws')(ingest_stream_ws)
 
 
 # --- API dla Nagrywania (New) ---
 
-@app.route('/api/recording/start', methods=['POST'])
+# The recorders run in the primary process (the one that gets every camera frame)
+
+@station_route('/recording/start', methods=['POST'])
 def start_recording():
-    # Use unique filename to avoid conflicts
-    unique_id = str(uuid.uuid4())
-    filename = f"rec_{int(time.time())}_{unique_id[:8]}.mp4"
-    recorder.start(filename)
-    return jsonify({'status': 'started', 'filename': filename})
+    # Optional {"preroll": seconds} (at most RECORD_PREROLL)
+    data = request.get_json(silent=True) or {}
+    filename, stats = shared.apply('recording_start', g.station, data.get('preroll'))
+    if not filename:
+        return jsonify({'status': 'error'}), 500
+    return jsonify({'status': 'started', 'filename': filename, 'start_ms': stats['start_ms'],
+                    'preroll_frames': stats['preroll_frames']})
 
-@app.route('/api/recording/stop', methods=['POST'])
+@state_op('recording_start', replicate=False)
+def start_station_recording(station, preroll):
+    filename = station.recorder.start(preroll)
+    return filename, station.recorder.get_stats()
+
+@station_route('/recording/stop', methods=['POST'])
 def stop_recording():
-    filename = recorder.stop()
+    filename = shared.apply('recording_stop', g.station)
     return jsonify({'status': 'stopped', 'filename': filename})
 
+@state_op('recording_stop', replicate=False)
+def stop_station_recording(station):
+    return station.recorder.stop()
+
+@station_route('/recording/stats', methods=['GET'])
+def recording_stats():
+    return jsonify(shared.apply('recording_stats', g.station))
+
+@state_op('recording_stats', replicate=False)
+def station_recording_stats(station):
+    return station.recorder.get_stats()
+
 
 # --- API dla Mediów Ptaka ---
 
 @app.route('/api/media', methods=['GET'])
 def list_media():
+    # ?cursor=<next_cursor of the previous page>&limit=&type=video|image&status=ok|missing|orphan
     try:
-        # Get all scores with video paths
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        # Join not needed as we just want to list files that have metadata
-        c.execute('SELECT id, name, score, video_path, date FROM scores WHERE video_path IS NOT NULL ORDER BY id DESC')
-        rows = c.fetchall()
-        conn.close()
-        
-        media_list = []
-        for row in rows:
-            # row: (id, name, score, video_path, date)
-            video_path = row[3]
-            if not video_path: continue
-            
-            filename = os.path.basename(video_path)
-            
-            # Check if file actually exists
-            if os.path.exists(os.path.join(UPLOAD_FOLDER, filename)):
-                media_list.append({
-                    'id': row[0],
-                    'name': row[1],
-                    'score': row[2],
-                    'filename': filename,
-                    'date': row[4],
-                    'type': 'video' if filename.endswith(('.mp4', '.webm')) else 'image'
-                })
-        
-        return jsonify(media_list)
+        page = media_catalogue.page(status=request.args.get('status', 'ok'),
+                                    kind=request.args.get('type'),
+                                    cursor=request.args.get('cursor', type=int),
+                                    limit=max(1, min(request.args.get('limit', 50, type=int), MEDIA_PAGE_MAX)))
+        return jsonify(page)
     except Exception as e:
         print(f"Error listing media: {e}")
         return jsonify({'error': str(e)}), 500
@@ -389,9 +2398,9 @@ def list_media():
 @app.route('/api/media/<filename>', methods=['DELETE'])
 def delete_media(filename):
     try:
-        path = os.path.join(UPLOAD_FOLDER, filename)
-        if os.path.exists(path):
-            os.remove(path)
+        if os.path.basename(filename) != filename or filename in ('.', '..'):
+            return jsonify({'error': 'Invalid filename'}), 400
+        if media_catalogue.delete(filename):
             return jsonify({'status': 'deleted'})
         return jsonify({'error': 'File not found'}), 404
     except Exception as e:
@@ -403,66 +2412,67 @@ def delete_media(filename):
 def get_scores():
     try:
         limit = request.args.get('limit', 100, type=int)
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        # Zmieniono zapytanie, aby filtrowac wyniki <= 0
-        c.execute('SELECT name, score, id, video_path FROM scores WHERE score > 0 ORDER BY score DESC LIMIT ?', (limit,))
-        rows = c.fetchall()
-        conn.close()
-        
-        # Formatowanie danych do JSON
-        data = [{'name': row[0], 'score': row[1], 'id': row[2], 'video_path': row[3]} for row in rows]
-        return jsonify(data)
+        return versioned_response(scores_version, lambda: scores_body(limit))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def scores_body(limit):
+    rows = score_cache.top_scores(limit)
+    if rows is None:
+        # Zmieniono zapytanie, aby filtrowac wyniki <= 0
+        rows = db.query('SELECT name, score, id, video_path, thumb_path FROM scores WHERE score > 0 ORDER BY score DESC, id LIMIT ?', (limit,))
+        rows = [dict(zip(('name', 'score', 'id', 'video_path', 'thumb_path'), row)) for row in rows]
+    
+    # Formatowanie danych do JSON
+    data = [{'name': row['name'], 'score': row['score'], 'id': row['id'], 'video_path': row['video_path'], 'thumbnail': row['thumb_path']} for row in rows]
+    return compact_json(data)
+
 @app.route('/api/history', methods=['GET'])
 def get_history():
     try:
         limit = request.args.get('limit', 50, type=int)
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        # Get latest games
-        c.execute('SELECT name, score, id, video_path, date FROM scores ORDER BY date DESC LIMIT ?', (limit,))
-        rows = c.fetchall()
-        conn.close()
-        
-        data = [{
-            'name': row[0], 
-            'score': row[1], 
-            'id': row[2], 
-            'video_path': row[3],
-            'date': row[4]
-        } for row in rows]
-        return jsonify(data)
+        return versioned_response(scores_version, lambda: history_body(limit))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def history_body(limit):
+    # Get latest games
+    rows = score_cache.recent_games(limit)
+    if rows is None:
+        rows = db.query('SELECT name, score, id, video_path, date FROM scores ORDER BY date DESC, id DESC LIMIT ?', (limit,))
+        rows = [dict(zip(('name', 'score', 'id', 'video_path', 'date'), row)) for row in rows]
+    
+    data = [{
+        'name': row['name'], 
+        'score': row['score'], 
+        'id': row['id'], 
+        'video_path': row['video_path'],
+        'date': row['date']
+    } for row in rows]
+    return compact_json(data)
+
 
 @app.route('/api/latest_game', methods=['GET'])
 def get_latest_game():
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        # Get the most recently inserted game (by ID descending)
-        c.execute('SELECT name, score, video_path, image1_path, image2_path, image3_path, id FROM scores ORDER BY id DESC LIMIT 1')
-        row = c.fetchone()
-        conn.close()
-        
-        if row:
-            data = {
-                'name': row[0],
-                'score': row[1],
-                'video': row[2],
-                'images': [row[3], row[4], row[5]],
-                'id': row[6]
-            }
-            return jsonify(data)
-        else:
-            return jsonify(None)
+        return versioned_response(scores_version, latest_game_body)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def latest_game_body():
+    # Get the most recently inserted game with points (by ID descending)
+    row = score_cache.latest()
+    if not row:
+        return compact_json(None)
+    return compact_json({
+        'name': row['name'],
+        'score': row['score'],
+        'video': row['video_path'],
+        'images': [row['image1_path'], row['image2_path'], row['image3_path']],
+        'id': row['id'],
+        'poster': row['poster_path']
+    })
+
 @app.route('/api/scores', methods=['POST'])
 def add_score():
     try:
@@ -474,68 +2484,103 @@ def add_score():
         link_recording = data.get('link_recording', False)
         recording_filename = data.get('recording_filename', None)
         
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute('INSERT INTO scores (name, score) VALUES (?, ?)', (name, score))
-        score_id = c.lastrowid
-        
-        # Handle recording linking
-        if link_recording and recording_filename:
-            temp_path = os.path.join(UPLOAD_FOLDER, recording_filename)
-            new_filename = f"game_{score_id}.mp4"
-            new_path = os.path.join(UPLOAD_FOLDER, new_filename)
+        job_id = None
+        with db.transaction() as conn:
+            score_id = conn.execute('INSERT INTO scores (name, score) VALUES (?, ?)', (name, score)).lastrowid
+            row = conn.execute(f"SELECT {', '.join(SCORE_COLUMNS)} FROM scores WHERE id = ?", (score_id,)).fetchone()
             
-            if os.path.exists(temp_path):
-                try:
-                    # Use shutil.move for cross-fs safety
-                    shutil.move(temp_path, new_path)
-                    
-                    video_url = f"/uploads/{new_filename}"
-                    c.execute("UPDATE scores SET video_path = ? WHERE id = ?", (video_url, score_id))
-                except Exception as e:
-                    print(f"Error renaming recording: {e}")
-            else:
-                 print(f"Recording file not found: {temp_path}")
+            # Recording linking runs in the background (move / transcode, poster, thumbnail).
+            # Runs without points are never shown, their recording is left to the media reconciler (orphan)
+            if link_recording and recording_filename and score > 0:
+                job_id = media_jobs.enqueue('link_recording', score_id,
+                                            {'filename': os.path.basename(recording_filename)}, conn=conn)
+        shared.apply('score_added', None, dict(zip(SCORE_COLUMNS, row)))
+        if job_id:
+            media_jobs.notify()
         
-        conn.commit()
-        conn.close()
-        
-        return jsonify({'status': 'success', 'id': score_id}), 201
+        return jsonify({'status': 'success', 'id': score_id, 'job_id': job_id}), 201
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/upload_media/<int:score_id>', methods=['POST'])
 def upload_media(score_id):
+    # The video as a multipart 'video' field, or as the raw body (Content-Type: video/webm)
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        
-        video = request.files.get('video')
-        # images = request.files.getlist('images') # Removed
+        if (request.content_length or 0) > UPLOAD_MAX_SIZE:
+            return jsonify({'error': 'Upload too large'}), 413
         
-        video_path = None
-        # image_paths = [None, None, None]
+        # Streamed to disk under a temporary name; renaming and linking to the score is a background job
+        filename = f"upload_{score_id}_{uuid.uuid4().hex[:8]}.part"
+        size = receive_upload(upload_chunks(request, 'video'), os.path.join(UPLOAD_FOLDER, filename))
+        if size is None:
+            return jsonify({'error': 'Upload too large'}), 413
         
-        if video:
-            filename = f"game_{score_id}.webm"
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            video.save(filepath)
-            video_path = f"/uploads/{filename}"
-            c.execute("UPDATE scores SET video_path = ? WHERE id = ?", (video_path, score_id))
-            
-        conn.commit()
-        conn.close()
-        
-        return jsonify({'status': 'success'}), 200
+        job_id = None
+        if size:
+            job_id = media_jobs.enqueue('attach_upload', score_id, {'filename': filename})
         
+        return jsonify({'status': 'success', 'job_id': job_id, 'size': size}), 200
+    
+    except ClientDisconnected:
+        return jsonify({'error': 'Upload interrupted'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# --- API dla Zadań w tle ---
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    jobs = media_jobs.list(score_id=request.args.get('score_id', type=int),
+                           status=request.args.get('status'),
+                           limit=min(request.args.get('limit', 50, type=int), 500))
+    return jsonify(jobs)
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    job = media_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+# --- API dla Telemetrii Ptaka ---
+
+@app.route('/api/telemetry/sessions', methods=['GET'])
+def list_telemetry_sessions():
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    return jsonify(shared.apply('telemetry_sessions', None, limit, request.args.get('station')))
+
+@state_op('telemetry_sessions', replicate=False)
+def telemetry_sessions(station, limit, station_name):
+    return telemetry.sessions(limit, station_name)
+
+@app.route('/api/telemetry/<session_id>', methods=['GET'])
+def get_telemetry(session_id):
+    # ?points=<max samples returned>&fields=t,player_y,score,pipes,pose
+    points = max(2, min(request.args.get('points', 500, type=int), TELEMETRY_MAX_POINTS))
+    fields = request.args.get('fields', 't,player_y,score,pipes').split(',')
+    known = {name for name, code, width in TELEMETRY_COLUMNS}
+    if not all(name in known for name in fields):
+        return jsonify({'error': f"Unknown field, use: {', '.join(sorted(known))}"}), 400
+    columns = shared.apply('telemetry_series', None, session_id)
+    if columns is None:
+        return jsonify({'error': 'Session not found'}), 404
+    return jsonify(dict(downsample_telemetry(columns, points, fields), session=session_id))
+
+@state_op('telemetry_series', replicate=False)
+def telemetry_series(station, session_id):
+    # The session still being recorded is only in the primary's memory
+    return telemetry.series(session_id)
+
 if __name__ == '__main__':
     # Upewnij się, że jesteśmy w katalogu skryptu
     os.chdir(os.path.dirname(os.path.abspath(__file__)))
     
     init_db()
+    media_jobs.start()
+    telemetry.start()
+    media_catalogue.start()
+    static_assets.start()
+    default_station.recorder.prewarm()
     print("===============================================================")
     print(" SERWER GRY URUCHOMIONY (HTTPS)")
     print(" Gra dostepna pod adresem: https://192.168.0.110:5001")
@@ -0,0 +1,274 @@
+"""
+Wspolny stan dla kilku procesow serwera (python asgi.py --workers N).
+
+The supervisor process runs a StateHub: the primary copy of every station, the recorders,
+telemetry and media jobs. Each worker connects to it over a Unix socket
+(multiprocessing.connection) with a HubClient and keeps its own copy of the stations, so
+reads, long-polls, event streams and MJPEG viewers are served from the worker's memory.
+
+- State changes (server.state_op) are sent to the hub, applied there and broadcast to every
+  worker in one order, so all copies - and their versions, ETags, event ids - are the same.
+  The caller gets the result after its own copy has applied the change.
+- Frames are not ordered: a worker publishes to its own viewers and sends the frame to the
+  hub, which records camera frames and forwards the frame only to workers with viewers.
+- Every WATCH_INTERVAL each worker reports its open MJPEG viewers / event subscribers; the
+  hub sends each worker the counts of the others (X-Stream-Viewers, busy stations).
+- A worker that (re)starts gets a snapshot of all stations before it serves requests.
+"""
+import collections
+import itertools
+import os
+import signal
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Client, Listener
+import server
+
+WATCH_INTERVAL = 0.2 # Seconds between viewer / subscriber count reports
+CALL_TIMEOUT = 30 # Seconds a worker waits for the hub (recording stop waits up to RECORD_STOP_TIMEOUT)
+HUB_QUERY_THREADS = 4 # Hub threads for replicate=False ops, so a slow one doesn't hold up a worker's frames
+
+
+def hub_address():
+    # Unix socket (a named pipe on Windows) of this supervisor process
+    if os.name == 'nt':
+        return rf"\\.\pipe\ptak_state_{os.getpid()}"
+    return os.path.join(tempfile.gettempdir(), f"ptak_state_{os.getpid()}.sock")
+
+
+class WorkerLink:
+    """The hub's end of one worker connection"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.send_lock = threading.Lock()
+        self.watching = {} # Last watcher_counts() of this worker
+        self.others = {} # Last counts of the other workers sent to it
+
+    def send(self, message):
+        with self.send_lock:
+            self.conn.send(message)
+
+
+class StateHub(server.LocalState):
+    """State backend of the supervisor process: the primary copy, shared with the workers"""
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        self.lock = threading.RLock() # Order of the replicated ops; held while broadcasting
+        self.watch_lock = threading.Lock()
+        self.links = []
+        self.queries = ThreadPoolExecutor(HUB_QUERY_THREADS, thread_name_prefix='state-hub-query')
+        self.listener = None
+        server.stations.on_remove.append(self._dropped)
+
+    def start(self):
+        if os.name != 'nt' and os.path.exists(self.address):
+            os.remove(self.address) # Left over from a crashed run
+        self.listener = Listener(self.address, authkey=self.authkey)
+        threading.Thread(target=self._accept, name="state-hub", daemon=True).start()
+
+    def apply(self, op, station, *args):
+        func, replicate = server.STATE_OPS[op]
+        if not replicate:
+            return func(station, *args)
+        with self.lock:
+            if station is not None:
+                station.last_active = time.monotonic()
+            result = func(station, *args)
+            self._broadcast(('op', op, station.name if station else None, args))
+        return result
+
+    def open_station(self, name):
+        if not self.apply('open_station', None, name):
+            return None
+        return server.stations.find(name)
+
+    def _dropped(self, station):
+        # Evicted by StationRegistry.get (inside the 'open_station' op, so before it in every worker)
+        with self.lock:
+            self._broadcast(('op', 'drop_station', None, (station.name,)))
+
+    def _broadcast(self, message):
+        for link in list(self.links):
+            try:
+                link.send(message)
+            except OSError:
+                pass # Gone; _serve removes it
+
+    def _accept(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError as e:
+                print(f"State hub: rejected worker connection: {e}")
+                continue
+            threading.Thread(target=self._serve, args=(WorkerLink(conn),), name="state-hub-worker", daemon=True).start()
+
+    def _serve(self, link):
+        with self.lock:
+            # Under the op lock: the worker gets every op after the snapshot, and none twice
+            link.send(('snapshot', server.state_snapshot()))
+            self.links.append(link)
+        with self.watch_lock:
+            self._update_watchers() # Sends it the other workers' counts
+        try:
+            while True:
+                message = link.conn.recv()
+                kind = message[0]
+                if kind == 'call':
+                    _, call_id, op, name, args = message
+                    if server.STATE_OPS[op][1]:
+                        self._call(link, call_id, op, name, args)
+                    else:
+                        self.queries.submit(self._call, link, call_id, op, name, args)
+                elif kind == 'frame':
+                    self._frame(link, *message[1:])
+                elif kind == 'watch':
+                    with self.watch_lock:
+                        link.watching = message[1]
+                        self._update_watchers()
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self.lock:
+                self.links.remove(link)
+            with self.watch_lock:
+                self._update_watchers()
+            link.conn.close()
+
+    def _call(self, link, call_id, op, name, args):
+        result, error = None, None
+        try:
+            station = server.stations.find(name) if name is not None else None
+            if name is None or station is not None: # A dropped station's ops are ignored
+                result = self.apply(op, station, *args)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        try:
+            link.send(('result', call_id, result, error))
+        except OSError:
+            pass
+
+    def _frame(self, link, name, stream, data, header):
+        station = server.stations.find(name)
+        if station is None:
+            return
+        server.apply_frame(station, stream, data, header)
+        if data is None:
+            return
+        for other in list(self.links):
+            if other is not link and other.watching.get((name, 'stream', stream)):
+                try:
+                    other.send(('frame', name, stream, data))
+                except OSError:
+                    pass
+
+    def _update_watchers(self):
+        # Called with watch_lock held
+        totals = collections.Counter()
+        for link in self.links:
+            totals.update(link.watching)
+        server.set_remote_watchers(totals) # All viewers are remote from here (busy stations, stats)
+        for link in list(self.links):
+            others = {key: count - link.watching.get(key, 0) for key, count in totals.items()
+                      if count > link.watching.get(key, 0)}
+            if others != link.others:
+                link.others = others
+                try:
+                    link.send(('remote', others))
+                except OSError:
+                    pass
+
+
+class HubClient(server.LocalState):
+    """State backend of a worker process: changes go through the StateHub, reads are local"""
+
+    primary = False
+
+    def __init__(self, address, authkey):
+        self.conn = Client(address, authkey=authkey)
+        self.send_lock = threading.Lock()
+        self.calls = {} # call id -> [threading.Event, result, error]
+        self.call_ids = itertools.count()
+        kind, snapshot = self.conn.recv()
+        server.restore_state(snapshot)
+        threading.Thread(target=self._read, name="state-hub-client", daemon=True).start()
+        threading.Thread(target=self._report_watchers, name="state-hub-watchers", daemon=True).start()
+
+    def _send(self, message):
+        with self.send_lock:
+            self.conn.send(message)
+
+    def apply(self, op, station, *args):
+        call_id = next(self.call_ids)
+        call = self.calls[call_id] = [threading.Event(), None, None]
+        try:
+            self._send(('call', call_id, op, station.name if station else None, args))
+            if not call[0].wait(CALL_TIMEOUT):
+                raise TimeoutError(f"State hub did not answer {op}")
+        finally:
+            del self.calls[call_id]
+        if call[2]:
+            raise RuntimeError(call[2])
+        return call[1]
+
+    def frame(self, station, stream, data, header=None):
+        broadcaster = station.streams[stream]
+        broadcaster.publish(data)
+        # Camera frames always go to the hub (recorder pre-roll); the others only if someone else watches
+        if stream == 'ptak_camera' or broadcaster.remote_viewers:
+            self._send(('frame', station.name, stream, data, header))
+        elif header:
+            self._send(('frame', station.name, stream, None, header))
+
+    def open_station(self, name):
+        station = server.stations.find(name)
+        if station is None and self.apply('open_station', None, name):
+            station = server.stations.find(name) # Created by the op, which arrived before the result
+        return station
+
+    def _read(self):
+        try:
+            while True:
+                message = self.conn.recv()
+                kind = message[0]
+                if kind == 'op':
+                    self._apply_op(*message[1:])
+                elif kind == 'result':
+                    _, call_id, result, error = message
+                    call = self.calls.get(call_id)
+                    if call:
+                        call[1], call[2] = result, error
+                        call[0].set()
+                elif kind == 'frame':
+                    _, name, stream, data = message
+                    station = server.stations.find(name)
+                    if station:
+                        station.streams[stream].publish(data)
+                elif kind == 'remote':
+                    server.set_remote_watchers(message[1])
+        except (EOFError, OSError):
+            print("State hub connection lost, stopping worker")
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    def _apply_op(self, op, name, args):
+        station = server.stations.find(name) if name is not None else None
+        if name is not None and station is None:
+            return
+        try:
+            server.STATE_OPS[op][0](station, *args)
+        except Exception as e:
+            print(f"State op {op} failed in worker: {e}")
+
+    def _report_watchers(self):
+        last = {}
+        while True:
+            time.sleep(WATCH_INTERVAL)
+            counts = server.watcher_counts()
+            if counts != last:
+                self._send(('watch', counts))
+                last = counts
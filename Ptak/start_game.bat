@@ -2,7 +2,7 @@
 echo ========================================
 echo INSTALOWANIE WYMAGANYCH BIBLIOTEK...
 echo ========================================
-pip install flask pyopenssl
+pip install flask pyopenssl flask-sock
 
 echo.
 echo ========================================
@@ -3,9 +3,12 @@ import random
 import numpy as np
 from collections import deque
 from model import Linear_QNet, QTrainer
+from history import History
 from snake_game import Direction, Point
 
 MAX_MEMORY = 100_000
+HISTORY_SIZE = 1000 # Points kept for the live charts
+HISTORY_WINDOW = 100 # Games in the running average
 BATCH_SIZE = 500
 LR = 0.001
 
@@ -21,10 +24,10 @@ class Agent:
         self.model = Linear_QNet(11, 256, 3)
         self.trainer = QTrainer(self.model, lr=LR, gamma=self.gamma)
         
-        # Stats
-        self.loss_history = []
-        self.score_history = []
-        self.average_score_history = []
+        # Stats (bounded, aggregates are kept up to date on append)
+        self.loss_history = History(HISTORY_SIZE, HISTORY_WINDOW)
+        self.score_history = History(HISTORY_SIZE, HISTORY_WINDOW)
+        self.average_score_history = History(HISTORY_SIZE, HISTORY_WINDOW)
 
     def get_state(self, game):
         head = game.snake[0]
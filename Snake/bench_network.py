@@ -0,0 +1,81 @@
+"""
+Benchmark NetworkManager sync modes against a running dashboard server.
+
+    python3 bench_network.py --url https://192.168.0.110:5001 --seconds 10
+
+For every mode it pushes numbered states at the game step rate and reports
+requests/sec made by the trainer and end-to-end state latency (time from
+update_state() until the state is readable from /api/snake/state).
+"""
+import argparse
+import threading
+import time
+import requests
+from network import NetworkManager
+
+
+def observe(url, sent_at, latencies, stop):
+    # Separate "dashboard" that polls the state and records when each seq shows up
+    session = requests.Session()
+    session.verify = False
+    seen = -1
+    while not stop.is_set():
+        try:
+            seq = session.get(f"{url}/api/snake/state", timeout=2).json().get('bench_seq', -1)
+        except Exception:
+            continue
+        if seq is not None and seq > seen and seq in sent_at:
+            latencies.append((time.perf_counter() - sent_at[seq]) * 1000)
+            seen = seq
+        time.sleep(0.001)
+    session.close()
+
+
+def run(url, mode, seconds, rate, with_frames):
+    network = NetworkManager(url=url, control=mode)
+    sent_at, latencies = {}, []
+    stop = threading.Event()
+    observer = threading.Thread(target=observe, args=(url, sent_at, latencies, stop))
+    observer.start()
+
+    frame = b'\xff\xd8' + b'\0' * 40_000 + b'\xff\xd9' # ~40 kB, like a 960px dashboard JPEG
+    time.sleep(0.5)
+    start_reqs = network.stats['requests']
+    start = time.perf_counter()
+    seq = 0
+    while time.perf_counter() - start < seconds:
+        sent_at[seq] = time.perf_counter()
+        network.update_state({"score": 0, "n_games": seq, "snake": [], "food": None, "bench_seq": seq})
+        if with_frames:
+            network.update_frame(frame)
+        seq += 1
+        time.sleep(1.0 / rate)
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    observer.join()
+    stats = network.get_stats()
+    network.stop()
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] if latencies else float('nan')
+    p95 = latencies[int(len(latencies) * 0.95)] if latencies else float('nan')
+    print(f"{mode:>5}: {(stats['requests'] - start_reqs) / elapsed:7.1f} req/s, "
+          f"state latency p50 {p50:6.1f} ms, p95 {p95:6.1f} ms, failures {stats['failures']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default="https://192.168.0.110:5001")
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--rate', type=float, default=30, help="game steps (states) per second")
+    parser.add_argument('--frames', action='store_true', help="also send a frame every step")
+    parser.add_argument('--modes', default="poll,push,sync")
+    args = parser.parse_args()
+
+    for mode in args.modes.split(','):
+        run(args.url, mode, args.seconds, args.rate, args.frames)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Compact binary state stream for all Snake boards (decoded by Ptak/js/snake_boards.js).
+
+All values little-endian. Every message is sent with a u32 length prefix.
+
+Message header (14 bytes):
+    u8 version, u8 kind (0 = keyframe, 1 = delta), u32 seq, u32 n_games,
+    u16 fps, u8 n_boards, u8 focused
+Per board:
+    u8 board_kind (0 = full, 1 = delta), u16 score, u8 flags (bit 0 = dead),
+    u8 food_x, u8 food_y (255, 255 = no food)
+    full:  u8 w, u8 h, u16 length, length x (u8 x, u8 y)     - head first
+    delta: u8 added, u16 removed, added x (u8 x, u8 y)       - new head segments first,
+                                                               then `removed` tail segments dropped
+Coordinates are stored +1 so a head that just left the board (-1) still fits in a u8.
+A keyframe has only full boards; a delta message may still carry a full board (e.g. after a reset).
+"""
+import struct
+
+VERSION = 1
+KIND_KEYFRAME = 0
+KIND_DELTA = 1
+BOARD_FULL = 0
+BOARD_DELTA = 1
+FLAG_DEAD = 1
+NO_FOOD = 255
+
+KEYFRAME_INTERVAL = 60 # Messages between keyframes (~2s at 30 steps/s)
+MAX_DELTA = 8 # More new segments than this -> just send the full board
+
+HEADER = struct.Struct('<BBIIHBB')
+BOARD = struct.Struct('<BHBBB')
+FULL = struct.Struct('<BBH')
+DELTA = struct.Struct('<BH')
+LENGTH = struct.Struct('<I')
+
+
+def _pack_points(points):
+    out = bytearray()
+    for p in points:
+        out.append(p.x + 1)
+        out.append(p.y + 1)
+    return out
+
+
+def _diff(old, new):
+    """Returns (added, removed) so that new == new[:added] + old[:len(old) - removed], or None"""
+    for added in range(min(MAX_DELTA, len(new)) + 1):
+        kept = len(new) - added
+        if kept <= len(old) and new[added:] == old[:kept]:
+            return added, len(old) - kept
+    return None
+
+
+class BoardEncoder:
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self.seq = 0
+        self.since_keyframe = 0
+        self.last_snakes = None # Snake of each board as of the last message
+        self.last_sizes = None
+
+    def encode(self, games, dead, n_games, fps, focused, force_keyframe=False):
+        """Encodes all boards into one length-prefixed message"""
+        keyframe = (
+            force_keyframe
+            or self.last_snakes is None
+            or len(self.last_snakes) != len(games)
+            or self.since_keyframe >= self.keyframe_interval
+        )
+
+        out = bytearray(HEADER.pack(VERSION, KIND_KEYFRAME if keyframe else KIND_DELTA, self.seq,
+                                    n_games, int(fps), len(games), focused))
+        snakes = []
+        sizes = []
+        for i, game in enumerate(games):
+            snake = list(game.snake)
+            snakes.append(snake)
+            sizes.append((game.w, game.h))
+            food = game.food
+            out += BOARD.pack(BOARD_FULL, 0, 0, 0, 0) # Placeholder, kind decided below
+            board_at = len(out) - BOARD.size
+
+            diff = None
+            if not keyframe and sizes[i] == self.last_sizes[i]:
+                diff = _diff(self.last_snakes[i], snake)
+
+            if diff is None:
+                out += FULL.pack(game.w, game.h, len(snake))
+                out += _pack_points(snake)
+                board_kind = BOARD_FULL
+            else:
+                added, removed = diff
+                out += DELTA.pack(added, removed)
+                out += _pack_points(snake[:added])
+                board_kind = BOARD_DELTA
+
+            BOARD.pack_into(out, board_at, board_kind, min(game.score, 0xFFFF),
+                            FLAG_DEAD if dead[i] else 0,
+                            food.x + 1 if food else NO_FOOD, food.y + 1 if food else NO_FOOD)
+
+        self.last_snakes = snakes
+        self.last_sizes = sizes
+        self.since_keyframe = 0 if keyframe else self.since_keyframe + 1
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        return LENGTH.pack(len(out)) + bytes(out)
@@ -0,0 +1,164 @@
+class RingBuffer:
+    """Fixed-size buffer that overwrites the oldest value once full"""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = [None] * capacity
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, value):
+        """Adds a value and returns the one it pushed out (or None)"""
+        idx = (self.start + self.size) % self.capacity
+        evicted = None
+        if self.size < self.capacity:
+            self.size += 1
+        else:
+            evicted = self.data[idx]
+            self.start = (self.start + 1) % self.capacity
+        self.data[idx] = value
+        return evicted
+
+    def last(self, default=None):
+        if self.size == 0:
+            return default
+        return self.data[(self.start + self.size - 1) % self.capacity]
+
+    def to_list(self, limit=None):
+        # Oldest -> newest, optionally only the newest `limit` values
+        count = self.size if limit is None else min(limit, self.size)
+        first = (self.start + self.size - count) % self.capacity
+        end = first + count
+        if end <= self.capacity:
+            return self.data[first:end]
+        return self.data[first:] + self.data[:end - self.capacity]
+
+    def clear(self):
+        self.data = [None] * self.capacity
+        self.start = 0
+        self.size = 0
+
+
+class Downsampler:
+    """
+    Keeps the whole run as at most `max_buckets` (min, max, mean) buckets.
+    When the buckets run out, neighbours are merged and the bucket width doubles,
+    so memory stays constant no matter how long training goes on.
+    """
+
+    def __init__(self, max_buckets=256):
+        if max_buckets < 2:
+            raise ValueError("Downsampler needs at least 2 buckets")
+        self.max_buckets = max_buckets - (max_buckets % 2) # Must be even for pair merging
+        self.bucket_size = 1
+        self.buckets = [] # [min, max, sum, count]
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def append(self, value):
+        if self.buckets and self.buckets[-1][3] < self.bucket_size:
+            b = self.buckets[-1]
+            b[0] = min(b[0], value)
+            b[1] = max(b[1], value)
+            b[2] += value
+            b[3] += 1
+            return
+
+        if len(self.buckets) == self.max_buckets:
+            self._merge()
+        self.buckets.append([value, value, value, 1])
+
+    def _merge(self):
+        merged = []
+        for i in range(0, len(self.buckets), 2):
+            a, b = self.buckets[i], self.buckets[i + 1]
+            merged.append([min(a[0], b[0]), max(a[1], b[1]), a[2] + b[2], a[3] + b[3]])
+        self.buckets = merged
+        self.bucket_size *= 2
+
+    def mins(self):
+        return [b[0] for b in self.buckets]
+
+    def maxs(self):
+        return [b[1] for b in self.buckets]
+
+    def means(self):
+        return [b[2] / b[3] for b in self.buckets]
+
+    def clear(self):
+        self.bucket_size = 1
+        self.buckets = []
+
+
+class History:
+    """
+    Training metric history with O(1) appends and aggregates.
+    - recent: ring buffer with the last `capacity` values (for plotting)
+    - max / min / mean: over the whole run
+    - window_mean: mean of the last `window` values (e.g. L100 average)
+    - long_range: optional downsampled series of the whole run
+    """
+
+    def __init__(self, capacity=1000, window=100, long_range_buckets=256):
+        self.recent = RingBuffer(capacity)
+        self.window = RingBuffer(window)
+        self.window_sum = 0
+        self.long_range = Downsampler(long_range_buckets) if long_range_buckets else None
+        self.count = 0
+        self.total = 0
+        self.max = None
+        self.min = None
+
+    def __len__(self):
+        return self.count
+
+    def __bool__(self):
+        return self.count > 0
+
+    def append(self, value):
+        self.count += 1
+        self.total += value
+        if self.max is None or value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+        self.recent.append(value)
+
+        evicted = self.window.append(value)
+        self.window_sum += value
+        if evicted is not None:
+            self.window_sum -= evicted
+
+        if self.long_range is not None:
+            self.long_range.append(value)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    @property
+    def window_mean(self):
+        return self.window_sum / len(self.window) if len(self.window) else 0
+
+    def last(self, default=None):
+        return self.recent.last(default)
+
+    def tail(self, limit=None):
+        """Latest values as a list (oldest first)"""
+        return self.recent.to_list(limit)
+
+    def clear(self):
+        self.recent.clear()
+        self.window.clear()
+        self.window_sum = 0
+        if self.long_range is not None:
+            self.long_range.clear()
+        self.count = 0
+        self.total = 0
+        self.max = None
+        self.min = None
@@ -1,19 +1,27 @@
 import pygame
 import torch
 import random
-import numpy as np
 from agent import Agent
 from snake_game import SnakeGameAI
 from visualizer import Visualizer
 from network import NetworkManager
+from streamer import FrameStreamer
+from board_stream import BoardEncoder
 import time
-import io
 
 # Config
 WINDOW_W = 1920
 WINDOW_H = 1080
 INITIAL_FPS = 30 
 SERVER_URL = "https://192.168.0.110:5001"
+FRAME_MODE = "ws" # "ws": frames over one WebSocket (needs websocket-client), "post": one request per frame
+CONTROL_MODE = "push" # "push": long-poll for settings/commands, "sync": one combined request per loop, "poll": separate requests
+STATION = None # Station name when several trainers/kiosks share the server (dashboard: /dashboard?station=...)
+
+# Dashboard stream (scaled + encoded off the render thread)
+STREAM_WIDTH = 960
+STREAM_QUALITY = 70
+STREAM_FPS = 60
 
 def main():
     global WINDOW_W, WINDOW_H
@@ -26,7 +34,8 @@ def main():
     
     # Initialize Network Manager
     print(f"Connecting to dashboard at {SERVER_URL}...")
-    network = NetworkManager(url=SERVER_URL)
+    network = NetworkManager(url=SERVER_URL, control=CONTROL_MODE, frames=FRAME_MODE, station=STATION)
+    streamer = FrameStreamer(network.update_frame, width=STREAM_WIDTH, quality=STREAM_QUALITY, fps=STREAM_FPS)
 
     # Layout Config (Initial)
     # Use proportional layout instead of fixed pixels for better adaptability
@@ -53,6 +62,7 @@ def main():
     game_cooldowns = [0] * len(games)
     
     agent = Agent()
+    board_encoder = BoardEncoder()
     visualizer = Visualizer(RIGHT_PANEL_W, WINDOW_H)
 
     # Focus Mode State
@@ -64,7 +74,6 @@ def main():
     # Time Accumulator for Logic Updates
     accumulator = 0
     last_time = pygame.time.get_ticks()
-    last_stream_time = 0
     
     # Game Control State
     paused = False
@@ -121,6 +130,7 @@ def main():
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
+                streamer.stop()
                 network.stop()
             elif event.type == pygame.VIDEORESIZE:
                 # Handle resizing
@@ -169,8 +179,9 @@ def main():
         
         # Display FPS & Mode
         status_str = "PAUSED (REMOTE)" if paused else "RUNNING"
-        conn_str = "ONLINE" if network.connected else "OFFLINE"
-        pygame.display.set_caption(f"Snake AI - {status_str} | Speed: {fps} TPS | Focus: Game {focused_game_idx+1} | Server: {conn_str}")
+        conn_str = f"ONLINE ({network.stats['latency_ms']:.0f}ms)" if network.connected else "OFFLINE"
+        stream_str = f"{streamer.encode_ms:.0f}ms enc, {streamer.dropped_frames} dropped"
+        pygame.display.set_caption(f"Snake AI - {status_str} | Speed: {fps} TPS | Focus: Game {focused_game_idx+1} | Server: {conn_str} | Stream: {stream_str}")
 
         # Update & Train Logic
         # Run logic steps ONLY if accumulator > step_interval
@@ -236,11 +247,12 @@ def main():
                             agent.train_long_memory()
 
                             # Always record score history to show progress (even 0)
+                            record = agent.score_history.max if agent.score_history else 0
                             agent.score_history.append(score)
-                            mean_score = np.mean(agent.score_history[-100:])
+                            mean_score = agent.score_history.window_mean
                             agent.average_score_history.append(mean_score)
                             
-                            if score > (max(agent.score_history[:-1]) if len(agent.score_history) > 1 else 0):
+                            if score > record:
                                 agent.model.save()
                     except Exception as e:
                         print(f"CRASH in Game {i}: {e}")
@@ -249,16 +261,20 @@ def main():
                 
                 # --- LOGIC UPDATE END ---
                 
-                # Network Sync (Send State) - sending only focused game
+                # Network Sync (Send State) - stats of the focused game as JSON,
+                # positions of all boards as a compact binary delta stream
                 focused_game = games[focused_game_idx]
                 state_data = {
                     "score": focused_game.score,
                     "n_games": agent.n_games, # Global games count
-                    "snake": [{"x": p.x, "y": p.y} for p in focused_game.snake],
-                    "food": {"x": focused_game.food.x, "y": focused_game.food.y} if focused_game.food else None,
+                    "focused": focused_game_idx,
                     "fps": fps
                 }
                 network.update_state(state_data)
+                network.update_boards(board_encoder.encode(
+                    games, [c > 0 for c in game_cooldowns], agent.n_games, fps, focused_game_idx,
+                    force_keyframe=network.take_keyframe_request()
+                ))
 
                 # Break if too many steps to avoid freeze (spiral of death)
                 if steps_processed > 5:
@@ -318,21 +334,11 @@ def main():
             # Draw Visualizer on the right as usual
             visualizer.draw_dashboard(screen, agent, LEFT_PANEL_W, 0, RIGHT_PANEL_W, WINDOW_H, focused_activations, dashboard_mode, focused_game_idx, paused)
 
-        # Capture and Stream Frame (Limit to 60 FPS)
-        if current_time - last_stream_time > 16: # ~60 FPS
-             last_stream_time = current_time
+        # Capture and Stream Frame (grab only, scaling + JPEG happen on the streamer thread)
+        # Skipped entirely while nobody has the dashboard stream open
+        if network.has_viewers() and streamer.due():
              try:
-                 # Resize for dashboard? 
-                 # Let's send full res but scaled down if too big to save bandwidth
-                 # Target width ~960 for better performance/smoothness
-                 target_w = 960
-                 target_h = int(WINDOW_H * (960 / WINDOW_W))
-                 scaled = pygame.transform.smoothscale(screen, (target_w, target_h))
-                 
-                 # Save to buffer
-                 buf = io.BytesIO()
-                 pygame.image.save(scaled, buf, "JPEG")
-                 network.update_frame(buf.getvalue())
+                 streamer.submit(screen)
              except Exception as e:
                  print(f"Stream error: {e}")
 
@@ -340,6 +346,7 @@ def main():
         clock.tick(120) # Limit loop speed (not game logic speed)
 
     pygame.quit()
+    streamer.stop()
     network.stop()
 
 if __name__ == '__main__':
@@ -1,71 +1,296 @@
 import threading
 import time
+import json
+import select
+import ssl
+import struct
 import requests
 import urllib3
+from requests.adapters import HTTPAdapter
+
+try:
+    import websocket # Optional: pip install websocket-client (frames over one WebSocket)
+except ImportError:
+    websocket = None
 
 # Disable warnings for self-signed certificates
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+VIEWER_CHECK_INTERVAL = 1.0 # Seconds between viewer checks while not streaming
+CONNECT_TIMEOUT = 1.0 # Seconds
+READ_TIMEOUT = 2.0 # Seconds, so one stalled request can't freeze the whole sync
+POLL_INTERVAL = 0.005 # ~200 updates per second while online
+BACKOFF_MIN = 0.1 # Offline retry delay, doubles up to BACKOFF_MAX
+BACKOFF_MAX = 5.0
+LONG_POLL_TIMEOUT = 20.0 # Seconds the server may hold a control long-poll (push mode)
+SYNC_IDLE_INTERVAL = 0.1 # Sync mode: how often to check in when there's nothing to send
+MAX_BOARD_QUEUE = 300 # Board messages kept while offline before we give up and ask for a keyframe
+WS_RETRY_INTERVAL = 5.0 # Seconds before trying the frame WebSocket again after it failed
+WS_FRAME_HEADER = struct.Struct('<Id') # u32 seq, f64 timestamp (ms)
+
 class NetworkManager:
-    def __init__(self, url="https://192.168.0.110:5001"):
+    def __init__(self, url="https://192.168.0.110:5001", control="poll", frames="post", station=None):
+        # control: "poll" asks for settings/commands every loop,
+        #          "push" waits on the server's /api/snake/control long-poll instead,
+        #          "sync" sends state + frame and gets settings/commands in one /api/snake/sync call
+        # frames:  "post" sends every frame as its own request,
+        #          "ws" streams them over one WebSocket (falls back to "post" while it's down)
+        # station: server-side namespace (/api/s/<station>/...) when several trainers share one server
         self.url = url
+        self.api = f"/api/s/{station}" if station else "/api"
+        self.control = control
+        self.frames = frames if websocket is not None else "post"
+        self.ws = None
+        self.ws_seq = 0
+        self.ws_retry_at = 0
+        self.settings_version = -1
         self.state_buffer = None
         self.frame_buffer = None
+        self.board_queue = [] # Board deltas must all arrive, so they are queued, not overwritten
+        self.need_keyframe = False
         self.settings = {"fps": 30, "paused": False}
         self.command_queue = []
         self.lock = threading.Lock()
         self.running = True
         self.connected = False
+        self.viewers = None # MJPEG viewers of our stream (None = unknown / old server)
+        self.last_viewer_check = 0
+        self.last_sync = 0
+        self.backoff = 0
+        self.stats = {"requests": 0, "failures": 0, "latency_ms": 0.0, "max_latency_ms": 0.0}
+        self.session = self._make_session()
         self.thread = threading.Thread(target=self._loop)
         self.thread.daemon = True
         self.thread.start()
 
+        self.control_thread = None
+        if control == "push":
+            self.control_session = self._make_session() # Sessions aren't shared between threads
+            self.control_thread = threading.Thread(target=self._control_loop)
+            self.control_thread.daemon = True
+            self.control_thread.start()
+
+    def _make_session(self):
+        # One pooled keep-alive session: the TLS handshake happens once per connection,
+        # not once per request (only the sync thread uses it, so a small pool is enough)
+        session = requests.Session()
+        session.verify = False
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def _request(self, method, path, session=None, read_timeout=READ_TIMEOUT, **kwargs):
+        session = session or self.session
+        start = time.perf_counter()
+        try:
+            r = session.request(method, f"{self.url}{path.replace('/api', self.api, 1)}", timeout=(CONNECT_TIMEOUT, read_timeout), **kwargs)
+        except requests.RequestException:
+            self.stats["failures"] += 1
+            raise
+
+        latency = (time.perf_counter() - start) * 1000
+        n = self.stats["requests"]
+        self.stats["latency_ms"] = latency if n == 0 else self.stats["latency_ms"] * 0.95 + latency * 0.05
+        self.stats["max_latency_ms"] = max(self.stats["max_latency_ms"], latency)
+        self.stats["requests"] = n + 1
+        return r
+
     def _loop(self):
         while self.running:
-            # Send state if available
-            if self.state_buffer:
-                try:
-                    requests.post(f"{self.url}/api/snake/state", json=self.state_buffer, verify=False)
-                    self.connected = True
-                except Exception as e:
-                    self.connected = False
-                    # print(f"Connection error: {e}")
-                self.state_buffer = None
-
-            # Send frame if available
-            if self.frame_buffer:
-                try:
-                    requests.post(f"{self.url}/api/stream/snake", data=self.frame_buffer, headers={'Content-Type': 'application/octet-stream'}, verify=False)
-                except Exception as e:
-                    pass
-                self.frame_buffer = None
-            
-            # Get settings
             try:
-                r = requests.get(f"{self.url}/api/snake/settings", verify=False)
-                if r.status_code == 200:
-                    with self.lock:
-                        new_settings = r.json()
-                        # Update only if keys exist to avoid overwriting with empty
-                        if 'fps' in new_settings:
-                            self.settings['fps'] = new_settings['fps']
-                        if 'paused' in new_settings:
-                            self.settings['paused'] = new_settings['paused']
-                    self.connected = True
-            except Exception as e:
+                self._sync()
+                self.connected = True
+                self.backoff = 0
+                time.sleep(POLL_INTERVAL)
+            except requests.RequestException as e:
+                # Server offline or stalled: back off instead of spinning
                 self.connected = False
+                self.backoff = min(BACKOFF_MAX, max(BACKOFF_MIN, self.backoff * 2))
+                time.sleep(self.backoff)
+            except Exception as e:
+                print(f"Network sync error: {e}")
+                time.sleep(BACKOFF_MIN)
+
+    def _sync(self):
+        if self.control == "sync":
+            return self._sync_combined()
 
-            # Get commands
+        # Send state if available
+        state, self.state_buffer = self.state_buffer, None
+        if state:
+            self._request("POST", "/api/snake/state", json=state)
+
+        # Send board stream messages
+        boards = self._take_boards()
+        if boards:
             try:
-                r = requests.get(f"{self.url}/api/snake/commands", verify=False)
-                if r.status_code == 200:
-                    cmds = r.json()
-                    with self.lock:
-                        self.command_queue.extend(cmds)
-            except:
+                r = self._request("POST", "/api/snake/boards", data=boards, headers={'Content-Type': 'application/octet-stream'})
+            except requests.RequestException:
+                self.need_keyframe = True # These deltas are lost
+                raise
+            if r.status_code == 200 and r.json().get('need_keyframe'):
+                self.need_keyframe = True
+
+        # Send frame if available
+        frame, self.frame_buffer = self.frame_buffer, None
+        if frame and self._send_frame_ws(frame):
+            pass
+        elif frame:
+            r = self._request("POST", "/api/stream/snake", data=frame, headers={'Content-Type': 'application/octet-stream'})
+            self._update_viewers(r.headers.get('X-Stream-Viewers'))
+        elif time.time() - self.last_viewer_check > VIEWER_CHECK_INTERVAL:
+            # Not streaming: check now and then if someone opened the stream
+            r = self._request("GET", "/api/stream/snake/viewers")
+            if r.status_code == 200:
+                self._update_viewers(r.json().get('viewers'))
+            self.last_viewer_check = time.time()
+
+        if self.control == "push":
+            return # Settings and commands arrive on the control thread
+
+        # Get settings
+        r = self._request("GET", "/api/snake/settings")
+        if r.status_code == 200:
+            self._apply_settings(r.json())
+
+        # Get commands
+        r = self._request("GET", "/api/snake/commands")
+        if r.status_code == 200:
+            self._add_commands(r.json())
+
+    def _sync_combined(self):
+        state, frame = self.state_buffer, self.frame_buffer
+        if not state and not frame and not self.board_queue and time.time() - self.last_sync < SYNC_IDLE_INTERVAL:
+            return
+        self.state_buffer = None
+        self.frame_buffer = None
+        boards = self._take_boards()
+        if frame and self._send_frame_ws(frame):
+            frame = None
+
+        try:
+            if frame or boards:
+                files = {}
+                if frame:
+                    files['frame'] = ('frame.jpg', frame, 'image/jpeg')
+                if boards:
+                    files['boards'] = ('boards.bin', boards, 'application/octet-stream')
+                r = self._request("POST", "/api/snake/sync", data={'state': json.dumps(state)}, files=files)
+            else:
+                r = self._request("POST", "/api/snake/sync", json=state)
+        except requests.RequestException:
+            if boards:
+                self.need_keyframe = True
+            raise
+        self.last_sync = time.time()
+
+        if r.status_code == 404:
+            # Old server without the combined endpoint: go back to separate requests
+            print("Server has no /api/snake/sync, falling back to polling")
+            self.control = "poll"
+            self.need_keyframe = True
+            return
+        if r.status_code == 200:
+            data = r.json()
+            self.settings_version = data.get('version', self.settings_version)
+            self._apply_settings(data.get('settings', {}))
+            self._add_commands(data.get('commands', []))
+            self._update_viewers(data.get('viewers'))
+            if data.get('need_keyframe'):
+                self.need_keyframe = True
+
+    def _send_frame_ws(self, frame):
+        # Returns False when the frame still has to be POSTed
+        if self.frames != "ws":
+            return False
+        if self.ws is None:
+            if time.time() < self.ws_retry_at:
+                return False
+            try:
+                ws_url = self.url.replace("https://", "wss://", 1).replace("http://", "ws://", 1)
+                self.ws = websocket.create_connection(f"{ws_url}{self.api}/stream/snake/ws", timeout=READ_TIMEOUT,
+                                                      sslopt={"cert_reqs": ssl.CERT_NONE})
+            except Exception as e:
+                self.ws_retry_at = time.time() + WS_RETRY_INTERVAL
+                return False
+
+        try:
+            self.ws.send_binary(WS_FRAME_HEADER.pack(self.ws_seq, time.time() * 1000) + frame)
+            self.ws_seq = (self.ws_seq + 1) & 0xFFFFFFFF
+            # The server answers with {"viewers": n} whenever the count changes
+            while select.select([self.ws.sock], [], [], 0)[0]:
+                self._update_viewers(json.loads(self.ws.recv()).get('viewers'))
+            return True
+        except Exception as e:
+            self._close_ws()
+            self.ws_retry_at = time.time() + WS_RETRY_INTERVAL
+            return False
+
+    def _close_ws(self):
+        if self.ws is not None:
+            try:
+                self.ws.close()
+            except Exception:
                 pass
-            
-            time.sleep(0.005) # ~200 updates per second (faster poll)
+            self.ws = None
+
+    def _take_boards(self):
+        with self.lock:
+            boards, self.board_queue = self.board_queue, []
+        return b''.join(boards)
+
+    def _control_loop(self):
+        backoff = 0
+        while self.running and self.control == "push":
+            try:
+                r = self._request(
+                    "GET", "/api/snake/control",
+                    session=self.control_session,
+                    read_timeout=LONG_POLL_TIMEOUT + READ_TIMEOUT,
+                    params={"version": self.settings_version, "timeout": LONG_POLL_TIMEOUT}
+                )
+                if r.status_code == 404:
+                    # Old server without the push channel: go back to polling
+                    print("Server has no /api/snake/control, falling back to polling")
+                    self.control = "poll"
+                    break
+                if r.status_code == 200:
+                    data = r.json()
+                    self.settings_version = data.get('version', self.settings_version)
+                    self._apply_settings(data.get('settings', {}))
+                    self._add_commands(data.get('commands', []))
+                    self.connected = True
+                backoff = 0
+            except requests.RequestException as e:
+                self.connected = False
+                backoff = min(BACKOFF_MAX, max(BACKOFF_MIN, backoff * 2))
+                time.sleep(backoff)
+            except Exception as e:
+                print(f"Control channel error: {e}")
+                time.sleep(BACKOFF_MIN)
+
+    def _apply_settings(self, new_settings):
+        with self.lock:
+            # Update only if keys exist to avoid overwriting with empty
+            if 'fps' in new_settings:
+                self.settings['fps'] = new_settings['fps']
+            if 'paused' in new_settings:
+                self.settings['paused'] = new_settings['paused']
+
+    def _add_commands(self, cmds):
+        if cmds:
+            with self.lock:
+                self.command_queue.extend(cmds)
+
+    def _update_viewers(self, value):
+        if value is not None:
+            self.viewers = int(value)
+            self.last_viewer_check = time.time()
+
+    def has_viewers(self):
+        # Unknown counts as watched so we keep streaming to servers without viewer tracking
+        return self.viewers is None or self.viewers > 0
 
     def update_state(self, state):
         self.state_buffer = state
@@ -73,6 +298,19 @@ class NetworkManager:
     def update_frame(self, frame_bytes):
         self.frame_buffer = frame_bytes
 
+    def update_boards(self, message):
+        with self.lock:
+            if len(self.board_queue) >= MAX_BOARD_QUEUE:
+                # Offline for a while: drop the backlog, the next keyframe resyncs the server
+                self.board_queue = []
+                self.need_keyframe = True
+            self.board_queue.append(message)
+
+    def take_keyframe_request(self):
+        # True once after the server lost track of the delta chain
+        requested, self.need_keyframe = self.need_keyframe, False
+        return requested
+
     def get_settings(self):
         with self.lock:
             return self.settings.copy()
@@ -83,6 +321,13 @@ class NetworkManager:
             self.command_queue = []
             return cmds
 
+    def get_stats(self):
+        return dict(self.stats)
+
     def stop(self):
         self.running = False
         self.thread.join(timeout=1.0)
+        self.session.close()
+        self._close_ws()
+        if self.control_thread:
+            self.control_session.close() # Also aborts a pending long-poll
@@ -0,0 +1,112 @@
+import threading
+import time
+import io
+import pygame
+
+try:
+    from PIL import Image # Optional: faster resize + configurable JPEG quality
+except ImportError:
+    Image = None
+
+
+class FrameStreamer:
+    """
+    Scales and JPEG-encodes dashboard frames on a worker thread.
+    The render loop only grabs the raw pixels and drops them into a single-slot
+    mailbox; if the worker is still busy the older frame is replaced (latest frame wins).
+    """
+
+    def __init__(self, on_frame, width=960, quality=70, fps=60):
+        self.on_frame = on_frame # Called with encoded JPEG bytes (from the worker thread)
+        self.width = width
+        self.quality = quality
+        self.fps = fps
+
+        self.cond = threading.Condition()
+        self.pending = None # (pixels, size)
+        self.last_grab = 0
+
+        # Stats
+        self.encoded_frames = 0
+        self.dropped_frames = 0
+        self.encode_ms = 0.0 # Smoothed encode latency
+        self.last_encode_ms = 0.0
+
+        self.running = True
+        self.thread = threading.Thread(target=self._loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def due(self, now=None):
+        """True when a new frame should be grabbed to keep the target FPS"""
+        if self.fps <= 0:
+            return False
+        now = time.perf_counter() if now is None else now
+        return now - self.last_grab >= 1.0 / self.fps
+
+    def submit(self, surface):
+        # The screen gets redrawn next frame, so we need our own snapshot of the pixels.
+        # tobytes copies once straight into a bytes object; scaling/encoding happens off-thread.
+        pixels = pygame.image.tobytes(surface, "RGB")
+        self.last_grab = time.perf_counter()
+        with self.cond:
+            if self.pending is not None:
+                self.dropped_frames += 1
+            self.pending = (pixels, surface.get_size())
+            self.cond.notify()
+
+    def _loop(self):
+        while self.running:
+            with self.cond:
+                while self.pending is None and self.running:
+                    self.cond.wait(timeout=0.5)
+                if not self.running:
+                    break
+                pixels, size = self.pending
+                self.pending = None
+
+            start = time.perf_counter()
+            try:
+                data = self._encode(pixels, size)
+            except Exception as e:
+                print(f"Stream encode error: {e}")
+                continue
+            elapsed = (time.perf_counter() - start) * 1000
+
+            self.last_encode_ms = elapsed
+            self.encode_ms = elapsed if self.encoded_frames == 0 else self.encode_ms * 0.9 + elapsed * 0.1
+            self.encoded_frames += 1
+            self.on_frame(data)
+
+    def _encode(self, pixels, size):
+        w, h = size
+        target_w = min(self.width, w)
+        target_h = int(h * (target_w / w))
+        buf = io.BytesIO()
+
+        if Image is not None:
+            img = Image.frombuffer("RGB", size, pixels, "raw", "RGB", 0, 1)
+            if (target_w, target_h) != size:
+                img = img.resize((target_w, target_h), Image.BILINEAR)
+            img.save(buf, "JPEG", quality=self.quality)
+        else:
+            # Fallback: pygame (quality is fixed by SDL_image)
+            surf = pygame.image.frombuffer(pixels, size, "RGB")
+            if (target_w, target_h) != size:
+                surf = pygame.transform.smoothscale(surf, (target_w, target_h))
+            pygame.image.save(surf, buf, "JPEG")
+
+        return buf.getvalue()
+
+    def stats(self):
+        return {
+            "encoded": self.encoded_frames,
+            "dropped": self.dropped_frames,
+            "encode_ms": round(self.encode_ms, 1)
+        }
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify()
+        self.thread.join(timeout=1.0)
@@ -80,7 +80,7 @@ class Visualizer:
         # Always draw Graphs (No Focus Mode)
         # We assume w and h are enough
         graph_rect = pygame.Rect(x + 10, content_y, w - 20, h - content_y - 20)
-        self._draw_graphs(surface, agent, graph_rect)
+        self._draw_graphs(surface, agent, graph_rect, whole_run=(mode == 1))
 
     def _draw_stats(self, surface, agent, x, y):
         # Title
@@ -90,8 +90,8 @@ class Visualizer:
         # Compact Stats
         stats = [
             f"Games: {agent.n_games}",
-            f"Best: {max(agent.score_history) if agent.score_history else 0}",
-            f"Average: {agent.average_score_history[-1] if agent.average_score_history else 0:.2f}"
+            f"Best: {agent.score_history.max if agent.score_history else 0}",
+            f"Average: {agent.average_score_history.last(0):.2f}"
         ]
         
         # Draw in a grid 2x2
@@ -284,7 +284,7 @@ class Visualizer:
             lbl = self.font.render(output_labels[i], True, WHITE if is_best else GRAY)
             surface.blit(lbl, (pos[0]+15, pos[1]-7))
 
-    def _draw_graphs(self, surface, agent, rect):
+    def _draw_graphs(self, surface, agent, rect, whole_run=False):
         # Background for graphs
         pygame.draw.rect(surface, (30, 30, 40), rect, border_radius=10)
         pygame.draw.rect(surface, (50, 50, 60), rect, 1, border_radius=10)
@@ -295,15 +295,28 @@ class Visualizer:
         score_rect = pygame.Rect(rect.x + 10, rect.y + 30, rect.width - 20, h_half)
         loss_rect = pygame.Rect(rect.x + 10, rect.y + 30 + h_half + 20, rect.width - 20, h_half)
 
+        if whole_run and agent.score_history.long_range:
+            # Downsampled buckets covering the whole run (max per bucket + mean per bucket)
+            score_data = agent.score_history.long_range.maxs()
+            avg_data = agent.score_history.long_range.means()
+            loss_data = agent.loss_history.long_range.means()
+            score_title, avg_label = "Score History (All)", "Avg (Bucket)"
+        else:
+            limit = 200 # Show more history
+            score_data = agent.score_history.tail(limit)
+            avg_data = agent.average_score_history.tail(limit)
+            loss_data = agent.loss_history.tail(limit)
+            score_title, avg_label = "Score History", "Average (L100)"
+
         # 1. Score Graph
-        self._draw_single_chart(surface, score_rect, agent.score_history, agent.average_score_history, "Score History", CYAN, ORANGE)
+        self._draw_single_chart(surface, score_rect, score_data, avg_data, score_title, CYAN, ORANGE, avg_label)
 
         # 2. Loss Graph
         # We only pass one history list for loss
-        self._draw_single_chart(surface, loss_rect, agent.loss_history, None, "Loss Trend", PURPLE, None)
+        self._draw_single_chart(surface, loss_rect, loss_data, None, "Loss Trend", PURPLE, None)
 
 
-    def _draw_single_chart(self, surface, rect, data1, data2, title, color1, color2):
+    def _draw_single_chart(self, surface, rect, data1, data2, title, color1, color2, legend=None):
         # Background
         pygame.draw.rect(surface, (30, 34, 40), rect, border_radius=6) # Darker modern bg
         pygame.draw.rect(surface, (60, 65, 75), rect, 1, border_radius=6) # Border
@@ -315,10 +328,9 @@ class Visualizer:
         if not data1 or len(data1) < 2:
             return
 
-        # Data processing
-        limit = 200 # Show more history
-        d1 = data1[-limit:]
-        d2 = data2[-limit:] if data2 else []
+        # Data processing (callers pass already-limited lists)
+        d1 = data1
+        d2 = data2 if data2 else []
 
         # Dynamic Scaling
         all_vals = d1 + (d2 if d2 else [])
@@ -391,6 +403,6 @@ class Visualizer:
             pygame.draw.lines(surface, color2, False, points2, 3)
             
             # Legend
-            leg_text = "Average (L100)"
+            leg_text = legend or "Average"
             leg = self.small_font.render(leg_text, True, color2)
             surface.blit(leg, (rect.right - 80, rect.y + 5))